@@ -23,4 +23,6 @@ class ContentEnum(Enum):
     EXCEPTION = "exception"
     COMMON = "common"
     STATE = "state"
-    END = "end"
\ No newline at end of file
+    END = "end"
+    SQL_STREAM = "sql_stream"
+    SQL = "sql"
\ No newline at end of file
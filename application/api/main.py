@@ -13,6 +13,7 @@ from . import service
 from nlq.business.nlq_chain import NLQChain
 from dotenv import load_dotenv
 
+from utils.async_executor import run_blocking, STAGE_DEFAULT
 from utils.auth import authenticate, skipAuthentication
 
 from .service import ask_websocket
@@ -32,8 +33,7 @@ def option(id: str=None):
 
 @router.get("/get_custom_question", response_model=CustomQuestion)
 def get_custom_question(data_profile: str):
-    all_profiles = ProfileManagement.get_all_profiles_with_info()
-    comments = all_profiles[data_profile]['comments']
+    comments = ProfileManagement.get_profile_info(data_profile)['comments']
     comments_questions = []
     if len(comments.split("Examples:")) > 1:
         comments_questions_txt = comments.split("Examples:")[1]
@@ -150,7 +150,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 if refresh_token:
                     del question_json['X-Refresh-Token']
 
-                response = authenticate(access_token, id_token, refresh_token)
+                response = await run_blocking(STAGE_DEFAULT, authenticate, access_token, id_token, refresh_token)
             else:
                 response = {'X-Status-Code': status.HTTP_200_OK}
 
@@ -201,20 +201,6 @@ async def response_sagemaker_explain(websocket: WebSocket, session_id: str, resp
         await response_websocket(websocket, session_id, current_content.get("outputs"))
 
 
-async def response_bedrock(websocket: WebSocket, session_id: str, response: dict, current_nlq_chain: NLQChain):
-    result_pieces = []
-    for event in response['body']:
-        current_body = event["chunk"]["bytes"].decode('utf8')
-        current_content = json.loads(current_body)
-        if current_content.get("type") == "content_block_delta":
-            current_text = current_content.get("delta").get("text")
-            result_pieces.append(current_text)
-            await response_websocket(websocket, session_id, current_text)
-        elif current_content.get("type") == "content_block_stop":
-            break
-    current_nlq_chain.set_generated_sql_response(''.join(result_pieces))
-
-
 async def response_websocket(websocket: WebSocket, session_id: str, content,
                              content_type: ContentEnum = ContentEnum.COMMON, status: str = "-1",
                              user_id: str = "admin"):
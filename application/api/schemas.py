@@ -1,4 +1,4 @@
-from typing import Any, Union
+from typing import Any, Optional, Union
 from pydantic import BaseModel
 
 
@@ -25,6 +25,9 @@ class Question(BaseModel):
     previous_intent: str = ""
     entity_user_select: dict = {}
     entity_retrieval: list = []
+    speculative_retrieval_flag: bool = False
+    # stream the text2sql completion as sql_stream messages and the SQL as a sql message once its block is closed
+    sql_stream_flag: bool = False
 
 
 class Example(BaseModel):
@@ -85,6 +88,8 @@ class SQLSearchResult(BaseModel):
     sql_gen_process: str
     data_analyse: str
     sql_data_chart: list[ChartEntity]
+    truncated: bool = False
+    total_row_estimate: Optional[int] = None
 
 
 class TaskSQLSearchResult(BaseModel):
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from dotenv import load_dotenv
 import os
@@ -13,6 +14,7 @@ from nlq.business.log_store import LogManagement
 from nlq.core.chat_context import ProcessingContext
 from nlq.core.state import QueryState
 from nlq.core.state_machine import QueryStateMachine
+from utils.async_executor import run_blocking, STAGE_LLM, STAGE_RETRIEVAL, STAGE_DATABASE, STAGE_DEFAULT
 from utils.logging import getLogger
 from utils.env_var import opensearch_info
 from utils.tool import generate_log_id, get_current_time, serialize_timestamp
@@ -30,7 +32,7 @@ ENABLE_USER_PROFILE_MAP = os.getenv("ENABLE_USER_PROFILE_MAP")
 
 def get_option(id: str=None) -> Option:
     logger.info(f'{id} user try to get option , ENABLE_USER_PROFILE_MAP=[{ENABLE_USER_PROFILE_MAP}]')
-    all_profiles = ProfileManagement.get_all_profiles_with_info()
+    all_profiles = ProfileManagement.get_all_profiles()
     all_sagemaker = ModelManagement.get_all_models()
     all_model_list = BEDROCK_MODEL_IDS
     for model_name in all_sagemaker:
@@ -51,7 +53,7 @@ def get_option(id: str=None) -> Option:
             )
     else:
         option = Option(
-            data_profiles=all_profiles.keys(),
+            data_profiles=all_profiles,
             bedrock_model_ids=all_model_list,
         )
     return option
@@ -95,7 +97,51 @@ def get_history_by_user_profile(user_id: str, profile_name: str):
     return chat_history
 
 
+def get_database_profile(selected_profile: str) -> dict:
+    database_profile = ProfileManagement.get_profile_info(selected_profile)
+
+    if database_profile['db_url'] == '':
+        conn_name = database_profile['conn_name']
+        db_url = ConnectionManagement.get_db_url_by_name(conn_name)
+        database_profile['db_url'] = db_url
+        database_profile['db_type'] = ConnectionManagement.get_db_type_by_name(conn_name)
+    return database_profile
+
+
+async def run_streaming(websocket: WebSocket, session_id: str, user_id: str, stage, func):
+    """
+    Run a handler on the worker pool with a stream callback, its messages are forwarded to the websocket in order
+    while the handler is still running
+    :param func: handler taking a callable(ContentEnum, content)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def stream_callback(content_type, content):
+        loop.call_soon_threadsafe(queue.put_nowait, (content_type, content))
+
+    async def forward():
+        while True:
+            message = await queue.get()
+            if message is None:
+                return
+            content_type, content = message
+            await response_websocket(websocket, session_id, content, content_type, user_id=user_id)
+
+    forwarder = asyncio.create_task(forward())
+    try:
+        await run_blocking(stage, func, stream_callback)
+    finally:
+        # messages of the handler were queued before its completion was delivered to the loop
+        queue.put_nowait(None)
+        await forwarder
+
+
 async def ask_websocket(websocket: WebSocket, question: Question):
+    """
+    Drive the query state machine for one question. Every handler does blocking boto3, OpenSearch or
+    SQLAlchemy work, so it runs on the shared worker pool and the event loop stays free for other sessions.
+    """
     logger.info(question)
     session_id = question.session_id
     user_id = question.user_id
@@ -115,20 +161,14 @@ async def ask_websocket(websocket: WebSocket, question: Question):
 
     log_id = generate_log_id()
 
-    all_profiles = ProfileManagement.get_all_profiles_with_info()
-    database_profile = all_profiles[selected_profile]
-
-    if database_profile['db_url'] == '':
-        conn_name = database_profile['conn_name']
-        db_url = ConnectionManagement.get_db_url_by_name(conn_name)
-        database_profile['db_url'] = db_url
-        database_profile['db_type'] = ConnectionManagement.get_db_type_by_name(conn_name)
+    database_profile = await run_blocking(STAGE_DEFAULT, get_database_profile, selected_profile)
 
     user_query_history = []
     if context_window > 0:
-        user_query_history = LogManagement.get_history_by_session(profile_name=selected_profile, user_id=user_id,
-                                                                  session_id=session_id, size=context_window,
-                                                                  log_type='chat_history')
+        user_query_history = await run_blocking(STAGE_DEFAULT, LogManagement.get_history_by_session,
+                                                profile_name=selected_profile, user_id=user_id,
+                                                session_id=session_id, size=context_window,
+                                                log_type='chat_history')
         user_query_history.append("user:" + search_box)
 
     if question.previous_intent == "entity_select":
@@ -156,7 +196,8 @@ async def ask_websocket(websocket: WebSocket, question: Question):
         entity_same_name_select={},
         user_query_history=user_query_history,
         opensearch_info=opensearch_info,
-        previous_state=previous_state)
+        previous_state=previous_state,
+        speculative_retrieval_flag=question.speculative_retrieval_flag)
 
     state_machine = QueryStateMachine(processing_context)
     if state_machine.previous_state == QueryState.USER_SELECT_ENTITY:
@@ -165,77 +206,80 @@ async def ask_websocket(websocket: WebSocket, question: Question):
         if state_machine.get_state() == QueryState.INITIAL:
             await response_websocket(websocket, session_id, "Query Rewrite", ContentEnum.STATE, "start",
                                      user_id)
-            state_machine.handle_initial()
+            await run_blocking(STAGE_LLM, state_machine.handle_initial)
             await response_websocket(websocket, session_id, "Query Rewrite", ContentEnum.STATE, "end",
                                      user_id)
         elif state_machine.get_state() == QueryState.REJECT_INTENT:
             await response_websocket(websocket, session_id, "Reject Intent", ContentEnum.STATE, "start",
                                      user_id)
-            state_machine.handle_reject_intent()
+            await run_blocking(STAGE_DEFAULT, state_machine.handle_reject_intent)
             await response_websocket(websocket, session_id, "Reject Intent", ContentEnum.STATE, "end",
                                      user_id)
         elif state_machine.get_state() == QueryState.KNOWLEDGE_SEARCH:
             await response_websocket(websocket, session_id, "Knowledge Search Intent", ContentEnum.STATE, "start",
                                      user_id)
-            state_machine.handle_knowledge_search()
+            await run_blocking(STAGE_LLM, state_machine.handle_knowledge_search)
             await response_websocket(websocket, session_id, "Knowledge Search Intent", ContentEnum.STATE, "end",
                                      user_id)
         elif state_machine.get_state() == QueryState.ENTITY_RETRIEVAL:
             await response_websocket(websocket, session_id, "Entity Info Retrieval", ContentEnum.STATE, "start",
                                      user_id)
-            state_machine.handle_entity_retrieval()
+            await run_blocking(STAGE_RETRIEVAL, state_machine.handle_entity_retrieval)
             await response_websocket(websocket, session_id, "Entity Info Retrieval", ContentEnum.STATE, "end",
                                      user_id)
         elif state_machine.get_state() == QueryState.QA_RETRIEVAL:
             await response_websocket(websocket, session_id, "QA Info Retrieval", ContentEnum.STATE, "start",
                                      user_id)
-            state_machine.handle_qa_retrieval()
+            await run_blocking(STAGE_RETRIEVAL, state_machine.handle_qa_retrieval)
             await response_websocket(websocket, session_id, "QA Info Retrieval", ContentEnum.STATE, "end",
                                      user_id)
         elif state_machine.get_state() == QueryState.SQL_GENERATION:
             await response_websocket(websocket, session_id, "Generating SQL", ContentEnum.STATE, "start", user_id)
-            state_machine.handle_sql_generation()
+            if question.sql_stream_flag:
+                await run_streaming(websocket, session_id, user_id, STAGE_LLM, state_machine.handle_sql_generation)
+            else:
+                await run_blocking(STAGE_LLM, state_machine.handle_sql_generation)
             await response_websocket(websocket, session_id, "Generating SQL", ContentEnum.STATE, "end", user_id)
         elif state_machine.get_state() == QueryState.INTENT_RECOGNITION:
             await response_websocket(websocket, session_id, "Query Intent Analyse", ContentEnum.STATE, "start", user_id)
-            state_machine.handle_intent_recognition()
+            await run_blocking(STAGE_LLM, state_machine.handle_intent_recognition)
             await response_websocket(websocket, session_id, "Query Intent Analyse", ContentEnum.STATE, "end", user_id)
         elif state_machine.get_state() == QueryState.EXECUTE_QUERY:
             await response_websocket(websocket, session_id, "Database SQL Execution", ContentEnum.STATE, "start",
                                      user_id)
-            state_machine.handle_execute_query()
+            await run_blocking(STAGE_DATABASE, state_machine.handle_execute_query)
             await response_websocket(websocket, session_id, "Database SQL Execution", ContentEnum.STATE, "end",
                                      user_id)
         elif state_machine.get_state() == QueryState.ANALYZE_DATA:
             await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
                                      "start", user_id)
-            state_machine.handle_analyze_data()
+            await run_blocking(STAGE_LLM, state_machine.handle_analyze_data)
             await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
                                      "end", user_id)
         elif state_machine.get_state() == QueryState.ASK_ENTITY_SELECT:
-            state_machine.handle_entity_selection()
+            await run_blocking(STAGE_DEFAULT, state_machine.handle_entity_selection)
         elif state_machine.get_state() == QueryState.AGENT_TASK:
             await response_websocket(websocket, session_id, "Agent Task Split", ContentEnum.STATE,
                                      "start", user_id)
-            state_machine.handle_agent_task()
+            await run_blocking(STAGE_LLM, state_machine.handle_agent_task)
             await response_websocket(websocket, session_id, "Agent Task Split", ContentEnum.STATE,
                                      "end", user_id)
         elif state_machine.get_state() == QueryState.AGENT_SEARCH:
             await response_websocket(websocket, session_id, "Agent SQL Generating", ContentEnum.STATE,
                                      "start", user_id)
-            state_machine.handle_agent_sql_generation()
+            await run_blocking(STAGE_LLM, state_machine.handle_agent_sql_generation)
             await response_websocket(websocket, session_id, "Agent SQL Generating", ContentEnum.STATE,
                                      "end", user_id)
         elif state_machine.get_state() == QueryState.AGENT_DATA_SUMMARY:
             await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
                                      "start", user_id)
-            state_machine.handle_agent_analyze_data()
+            await run_blocking(STAGE_LLM, state_machine.handle_agent_analyze_data)
             await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
                                      "end", user_id)
         elif state_machine.get_state() == QueryState.USER_SELECT_ENTITY:
             await response_websocket(websocket, session_id, "User Entity Select", ContentEnum.STATE,
                                      "start", user_id)
-            state_machine.handle_user_select_entity()
+            await run_blocking(STAGE_DEFAULT, state_machine.handle_user_select_entity)
             await response_websocket(websocket, session_id, "User Entity Select", ContentEnum.STATE,
                                      "end", user_id)
         else:
@@ -245,17 +289,17 @@ async def ask_websocket(websocket: WebSocket, question: Question):
         if state_machine.search_intent_flag or state_machine.agent_intent_flag:
             await response_websocket(websocket, session_id, "Generating Suggested Questions", ContentEnum.STATE,
                                      "start", user_id)
-            state_machine.handle_suggest_question()
+            await run_blocking(STAGE_LLM, state_machine.handle_suggest_question)
             await response_websocket(websocket, session_id, "Generating Suggested Questions", ContentEnum.STATE,
                                      "end", user_id)
 
     if state_machine.get_state() == QueryState.COMPLETE:
         await response_websocket(websocket, session_id, "Data Visualization", ContentEnum.STATE,
                                  "start", user_id)
-        state_machine.handle_data_visualization()
+        await run_blocking(STAGE_LLM, state_machine.handle_data_visualization)
         await response_websocket(websocket, session_id, "Data Visualization", ContentEnum.STATE,
                                  "end", user_id)
-        state_machine.handle_add_to_log(log_id=log_id)
+        await run_blocking(STAGE_DEFAULT, state_machine.handle_add_to_log, log_id=log_id)
 
     return state_machine.get_answer()
 
@@ -0,0 +1,112 @@
+"""
+Offline bulk indexer for SQL samples, entities and agent CoT examples.
+
+Streams a CSV, Excel, JSONL or Parquet file in chunks, embeds the chunks in parallel and writes them to the sql, ner
+or agent index. Progress is checkpointed after every chunk, rerunning the same command after a failure resumes
+after the last written chunk. Document ids are derived from the profile and text, so rows written twice overwrite
+the same document.
+
+    python bulk_index.py --kind sql --profile my_profile --file samples.csv
+    python bulk_index.py --kind entity --profile my_profile --file entities.parquet --embedding-workers 8
+
+Columns: sql: question, sql; entity: entity, comment, optional entity_type and entity_table_info (JSON list);
+agent: query, comment. The values of a dimension entity are added to the values already indexed for it.
+
+Against a local OpenSearch stand-in with a fake embedder, no AWS access needed:
+
+    python bulk_index.py --kind sql --profile demo --file samples.jsonl --index uba \
+        --host localhost --port 9200 --no-ssl --fake-embedding-dimension 1536
+"""
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+from nlq.business.bulk_indexer import DOCUMENT_KINDS, BulkIndexerError, fake_embed_texts, run_bulk_indexer
+
+
+def add_connection_arguments(parser):
+    parser.add_argument('--host', help='OpenSearch host, defaults to the configured cluster')
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--no-ssl', action='store_true')
+
+
+def get_opensearch_client(args):
+    if not args.host:
+        from utils.opensearch import get_opensearch_client as get_configured_client
+        return get_configured_client()
+    from opensearchpy import OpenSearch
+    http_auth = (args.username, args.password) if args.username else None
+    return OpenSearch(hosts=[{'host': args.host, 'port': args.port}], http_auth=http_auth, use_ssl=not args.no_ssl,
+                      verify_certs=False, ssl_show_warn=False, http_compress=True)
+
+
+def get_write_actions(client, bulk_size):
+    from opensearchpy.helpers import bulk
+
+    def write_actions(actions):
+        return bulk(client, actions, chunk_size=bulk_size, raise_on_error=False)
+
+    return write_actions
+
+
+def get_get_documents(client, source_includes=None):
+    def get_documents(index_name, doc_ids):
+        params = {'_source_includes': ','.join(source_includes)} if source_includes else {}
+        response = client.mget(body={'ids': doc_ids}, index=index_name, params=params)
+        return {doc['_id']: doc['_source'] for doc in response['docs'] if doc.get('found')}
+
+    return get_documents
+
+
+def get_embed_texts(args):
+    if args.fake_embedding_dimension:
+        return fake_embed_texts(args.fake_embedding_dimension)
+    from utils.llm import create_document_embedding_batch
+    return create_document_embedding_batch
+
+
+def get_index_name(args):
+    if args.index:
+        return args.index
+    from utils.env_var import opensearch_info
+    return opensearch_info[DOCUMENT_KINDS[args.kind][1]]
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kind', required=True, choices=list(DOCUMENT_KINDS))
+    parser.add_argument('--profile', required=True)
+    parser.add_argument('--file', required=True)
+    parser.add_argument('--index', help='defaults to AOS_INDEX, AOS_INDEX_NER or AOS_INDEX_AGENT')
+    parser.add_argument('--chunk-size', type=int, default=500, help='rows embedded and written together')
+    parser.add_argument('--bulk-size', type=int, default=500, help='documents per bulk request')
+    parser.add_argument('--embedding-workers', type=int, default=4, help='chunks embedded in parallel')
+    parser.add_argument('--checkpoint', help='defaults to <file>.checkpoint.json')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and index the whole file')
+    add_connection_arguments(parser)
+    parser.add_argument('--fake-embedding-dimension', type=int,
+                        help='use deterministic fake embeddings of this dimension instead of the embedding model')
+    args = parser.parse_args()
+
+    try:
+        client = get_opensearch_client(args)
+        stats = run_bulk_indexer(args.file, args.kind, args.profile, get_index_name(args), get_embed_texts(args),
+                                 get_write_actions(client, args.bulk_size),
+                                 chunk_size=args.chunk_size, embedding_workers=args.embedding_workers,
+                                 checkpoint_path=args.checkpoint, restart=args.restart,
+                                 get_documents=get_get_documents(client, ['entity_type', 'entity_table_info']))
+    except BulkIndexerError as e:
+        parser.error(str(e))
+    except Exception as e:
+        print(f'indexing stopped: {e}\nrerun the same command to resume after the last written chunk',
+              file=sys.stderr)
+        sys.exit(1)
+    print(f'indexed {args.file}: {stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ from api.main import router
 from fastapi.middleware.cors import CORSMiddleware
 from api import service
 from api.schemas import Option
+from utils.async_executor import run_blocking, STAGE_DEFAULT
 from utils.auth import authenticate, skipAuthentication
 
 MAX_CHAT_WINDOW_SIZE = 10 * 2
@@ -39,7 +40,7 @@ async def http_authenticate(request: Request, call_next):
         id_token = request.headers.get("X-Id-Token")
         refresh_token = request.headers.get("X-Refresh-Token")
 
-        response = authenticate(access_token, id_token, refresh_token)
+        response = await run_blocking(STAGE_DEFAULT, authenticate, access_token, id_token, refresh_token)
     else:
         response = {'X-Status-Code': status.HTTP_200_OK}
 
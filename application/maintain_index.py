@@ -0,0 +1,102 @@
+"""
+Maintenance jobs of the sql, ner and agent indexes.
+
+migrate-ids moves documents written with random ids to the id derived from their profile and text, collapsing
+exact duplicates. Run it once per index after upgrading, it is safe to rerun:
+
+    python maintain_index.py migrate-ids --kind sql --dry-run
+    python maintain_index.py migrate-ids --kind entity
+
+near-duplicates reports documents of a profile with nearly identical embeddings but different texts, which the
+ids do not catch, and optionally deletes them. Dimension entities are only reported, their values are not merged:
+
+    python maintain_index.py near-duplicates --kind sql --profile my_profile --min-similarity 0.99 --delete
+"""
+import argparse
+import json
+
+from dotenv import load_dotenv
+
+from bulk_index import add_connection_arguments, get_get_documents, get_index_name, get_opensearch_client, \
+    get_write_actions
+from nlq.business.bulk_indexer import DOCUMENT_KINDS
+from nlq.business.index_maintenance import DOCUMENT_TEXT_FIELDS, find_near_duplicates, is_dimension_entity, \
+    migrate_document_ids
+
+
+def scan_documents(client, index_name, profile_name, batch_size):
+    from opensearchpy.helpers import scan
+    query = {'match_phrase': {'profile': profile_name}} if profile_name else {'match_all': {}}
+    return scan(client, index=index_name, query={'query': query}, size=batch_size)
+
+
+def get_search_similar(client, index_name):
+    def search_similar(profile_name, embeddings, top_k):
+        body = []
+        for embedding in embeddings:
+            body.append({'index': index_name})
+            body.append({'size': top_k, 'query': {'bool': {
+                'filter': {'match_phrase': {'profile': profile_name}},
+                'must': [{'knn': {'vector_field': {'vector': embedding, 'k': top_k}}}]}}})
+        response = client.msearch(body=body)
+        return [sub_response.get('hits', {}).get('hits', []) for sub_response in response['responses']]
+
+    return search_similar
+
+
+def run_migrate_ids(args, client, index_name):
+    stats = migrate_document_ids(scan_documents(client, index_name, args.profile, args.batch_size), args.kind,
+                                 index_name, get_write_actions(client, args.bulk_size), get_get_documents(client),
+                                 batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"{'would migrate' if args.dry_run else 'migrated'} document ids of {index_name}: {stats}")
+
+
+def run_near_duplicates(args, client, index_name):
+    text_field = DOCUMENT_TEXT_FIELDS[args.kind]
+    groups = find_near_duplicates(scan_documents(client, index_name, args.profile, args.batch_size), args.kind,
+                                  get_search_similar(client, index_name), min_similarity=args.min_similarity,
+                                  top_k=args.top_k, batch_size=args.batch_size)
+    delete_actions = []
+    for kept, duplicates in groups:
+        print(json.dumps({'profile': kept['_source'].get('profile'), 'kept': kept['_source'].get(text_field),
+                          'duplicates': [duplicate['_source'].get(text_field) for duplicate in duplicates]},
+                         ensure_ascii=False))
+        delete_actions.extend({'_op_type': 'delete', '_index': index_name, '_id': duplicate['_id']}
+                              for duplicate in duplicates
+                              if not is_dimension_entity(args.kind, duplicate['_source']))
+    print(f'{len(groups)} groups of near duplicates, {sum(len(duplicates) for _, duplicates in groups)} duplicates')
+    if args.delete and delete_actions:
+        success, failed = get_write_actions(client, args.bulk_size)(delete_actions)
+        print(f'deleted {success} near duplicates, {len(failed)} failed')
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate-ids', help='move documents to deterministic ids')
+    migrate_parser.add_argument('--dry-run', action='store_true', help='only count the documents to migrate')
+    duplicates_parser = subparsers.add_parser('near-duplicates', help='find documents with nearly equal embeddings')
+    duplicates_parser.add_argument('--min-similarity', type=float, default=0.99,
+                                   help='cosine similarity from which two documents are near duplicates')
+    duplicates_parser.add_argument('--top-k', type=int, default=5, help='neighbours compared per document')
+    duplicates_parser.add_argument('--delete', action='store_true', help='delete the near duplicates found')
+    for subparser in (migrate_parser, duplicates_parser):
+        subparser.add_argument('--kind', required=True, choices=list(DOCUMENT_KINDS))
+        subparser.add_argument('--profile', help='only the documents of this profile, defaults to all profiles')
+        subparser.add_argument('--index', help='defaults to AOS_INDEX, AOS_INDEX_NER or AOS_INDEX_AGENT')
+        subparser.add_argument('--batch-size', type=int, default=500, help='documents scanned per batch')
+        subparser.add_argument('--bulk-size', type=int, default=500, help='documents per bulk request')
+        add_connection_arguments(subparser)
+    args = parser.parse_args()
+
+    client = get_opensearch_client(args)
+    index_name = get_index_name(args)
+    if args.command == 'migrate-ids':
+        run_migrate_ids(args, client, index_name)
+    else:
+        run_near_duplicates(args, client, index_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'false').lower() == 'true'
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', 0.95))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 2000))
+# re-run the cached SQL on a hit instead of returning the cached rows, LLM calls are still skipped
+ANSWER_CACHE_REEXECUTE_SQL = os.getenv('ANSWER_CACHE_REEXECUTE_SQL', 'false').lower() == 'true'
+
+
+def get_profile_fingerprint(database_profile) -> str:
+    """Hash of everything in a profile that changes the generated SQL or the rows a user may see"""
+    raw = json.dumps([database_profile.get('tables_info'), database_profile.get('prompt_map'),
+                      database_profile.get('row_level_security_config')], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get_rls_identity(database_profile, username) -> str:
+    """Answers of a row level security profile are only shared by the same user"""
+    if database_profile.get('row_level_security_config'):
+        return username or ''
+    return ''
+
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """Rows scaled to unit length, so a dot product is the cosine similarity"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class AnswerCacheEntry:
+    def __init__(self, query, embedding, answer, fingerprint, created_at):
+        self.query = query
+        self.embedding = embedding
+        self.answer = answer
+        self.fingerprint = fingerprint
+        self.created_at = created_at
+
+
+class AnswerCachePartition:
+    """
+    Entries of a partition with their normalized embeddings stacked in one matrix. A partition is replaced as a
+    whole on every change, so a lookup scores a snapshot outside the cache lock.
+    """
+
+    def __init__(self, entries, matrix):
+        self.entries = entries
+        self.matrix = matrix
+
+    def select(self, keep):
+        """:param keep: one bool per entry"""
+        return [entry for entry, kept in zip(self.entries, keep) if kept], self.matrix[np.asarray(keep, dtype=bool)]
+
+
+class AnswerCache:
+    """
+    Semantic cache of final answers, partitioned by (profile, model, embedding model, RLS identity, answer flags).
+    A lookup returns the most similar cached question of the partition above the similarity threshold.
+    """
+
+    def __init__(self, similarity_threshold, ttl, max_entries):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.partitions = OrderedDict()
+        self.entry_count = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, partition_key, fingerprint, embedding):
+        """
+        :return: a deep copy of the cached answer and its similarity, or (None, 0.0)
+        """
+        query_vector = normalize_embeddings(embedding)
+        now = time.time()
+        with self.lock:
+            partition = self.partitions.get(partition_key)
+            if partition is not None:
+                keep = [entry.fingerprint == fingerprint and now - entry.created_at <= self.ttl
+                        for entry in partition.entries]
+                if not all(keep):
+                    self._replace_entries(partition_key, *partition.select(keep))
+                    partition = self.partitions.get(partition_key)
+
+        best_entry = None
+        best_similarity = 0.0
+        if partition is not None and partition.matrix.shape[1] == query_vector.shape[0]:
+            similarities = partition.matrix @ query_vector
+            best_index = int(np.argmax(similarities))
+            if similarities[best_index] >= self.similarity_threshold:
+                best_entry = partition.entries[best_index]
+                best_similarity = float(similarities[best_index])
+
+        with self.lock:
+            if best_entry is None:
+                self.misses += 1
+                return None, 0.0
+            self.hits += 1
+            if partition_key in self.partitions:
+                self.partitions.move_to_end(partition_key)
+        return copy.deepcopy(best_entry.answer), best_similarity
+
+    def put(self, partition_key, fingerprint, query, embedding, answer):
+        entry = AnswerCacheEntry(query, list(embedding), copy.deepcopy(answer), fingerprint, time.time())
+        row = normalize_embeddings([entry.embedding])
+        with self.lock:
+            entries, matrix = [entry], row
+            partition = self.partitions.get(partition_key)
+            if partition is not None and partition.matrix.shape[1] == row.shape[1]:
+                kept_entries, kept_matrix = partition.select([each.query != query for each in partition.entries])
+                entries, matrix = kept_entries + entries, np.vstack([kept_matrix, row])
+            self._replace_entries(partition_key, entries, matrix)
+            self.partitions.move_to_end(partition_key)
+            while self.entry_count > self.max_entries:
+                oldest_key = next(iter(self.partitions))
+                oldest = self.partitions[oldest_key]
+                self._replace_entries(oldest_key, oldest.entries[1:], oldest.matrix[1:])
+
+    def _replace_entries(self, partition_key, entries, matrix):
+        partition = self.partitions.get(partition_key)
+        self.entry_count += len(entries) - (len(partition.entries) if partition is not None else 0)
+        if entries:
+            self.partitions[partition_key] = AnswerCachePartition(entries, matrix)
+        else:
+            self.partitions.pop(partition_key, None)
+
+    def invalidate_profile(self, profile_name):
+        with self.lock:
+            for partition_key in [key for key in self.partitions if key[0] == profile_name]:
+                self._replace_entries(partition_key, [], None)
+        logger.info(f"answer cache invalidated for profile {profile_name}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self.entry_count
+            }
+
+
+answer_cache = None
+answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global answer_cache
+    if answer_cache is None:
+        with answer_cache_lock:
+            if answer_cache is None:
+                answer_cache = AnswerCache(ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL,
+                                           ANSWER_CACHE_MAX_ENTRIES)
+    return answer_cache
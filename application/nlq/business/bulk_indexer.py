@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from nlq.data_access.opensearch_documents import build_sample_record, build_entity_record, build_agent_cot_record, \
+    get_dimension_comment, merge_entity_table_info
+from utils.logging import getLogger
+
+logger = getLogger()
+
+KIND_SQL = 'sql'
+KIND_ENTITY = 'entity'
+KIND_AGENT = 'agent'
+
+# text column that is embedded, and the opensearch_info key of the default index of each kind
+DOCUMENT_KINDS = {
+    KIND_SQL: ('question', 'sql_index'),
+    KIND_ENTITY: ('entity', 'ner_index'),
+    KIND_AGENT: ('query', 'agent_index'),
+}
+
+
+class BulkIndexerError(Exception):
+    pass
+
+
+def iter_file_rows(path, chunk_size, skip_rows=0):
+    """
+    Stream the rows of a CSV, Excel, JSONL or Parquet file in chunks of dicts, without the first skip_rows rows
+    """
+    file_type = path.rsplit('.', 1)[-1].lower()
+    if file_type in ('jsonl', 'ndjson'):
+        rows = iter_jsonl_rows(path)
+    elif file_type == 'csv':
+        rows = iter_csv_rows(path, chunk_size)
+    elif file_type == 'parquet':
+        rows = iter_parquet_rows(path, chunk_size)
+    elif file_type == 'xlsx':
+        rows = iter_xlsx_rows(path)
+    elif file_type == 'xls':
+        import pandas as pd
+        rows = iter(pd.read_excel(path, dtype=str, keep_default_na=False).to_dict('records'))
+    else:
+        raise BulkIndexerError(f'unsupported file type {file_type}, use csv, xls, xlsx, jsonl or parquet')
+
+    chunk = []
+    for row_number, row in enumerate(rows):
+        if row_number < skip_rows:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_jsonl_rows(path):
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_csv_rows(path, chunk_size):
+    import pandas as pd
+    for data_frame in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size):
+        yield from data_frame.to_dict('records')
+
+
+def iter_parquet_rows(path, chunk_size):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield from batch.to_pylist()
+
+
+def iter_xlsx_rows(path):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(column) for column in next(rows, [])]
+        for values in rows:
+            yield {column: '' if value is None else value for column, value in zip(header, values)}
+    finally:
+        workbook.close()
+
+
+def get_row_text(kind, row) -> str:
+    value = row.get(DOCUMENT_KINDS[kind][0])
+    return '' if value is None else str(value).strip()
+
+
+def build_document(kind, index_name, profile_name, row, embedding) -> dict:
+    """Document in the shape written by OpenSearchDao.add_sample, add_entity_sample or add_agent_cot_sample"""
+    text = get_row_text(kind, row)
+    if kind == KIND_SQL:
+        return build_sample_record(index_name, profile_name, text, str(row.get('sql') or ''), embedding)
+    if kind == KIND_ENTITY:
+        entity_table_info = row.get('entity_table_info') or []
+        if isinstance(entity_table_info, str):
+            entity_table_info = json.loads(entity_table_info)
+        return build_entity_record(index_name, profile_name, text, str(row.get('comment') or ''), embedding,
+                                   row.get('entity_type') or 'metrics', list(entity_table_info))
+    return build_agent_cot_record(index_name, profile_name, text, str(row.get('comment') or ''), embedding)
+
+
+def is_dimension_document(document) -> bool:
+    return document.get('entity_type') == 'dimension'
+
+
+def merge_dimension_documents(documents, index_name, get_documents=None) -> list:
+    """
+    Add the values of the indexed document and of earlier rows of the same entity to dimension entity documents, so
+    a dimension row adds values to an entity instead of replacing them. Other documents are returned as they are.
+    :param get_documents: callable (index_name, doc_ids) returning a dict of the _source of indexed documents by
+    id, without it the values of a dimension row replace the indexed values
+    """
+    dimension_ids = list(dict.fromkeys(document['_id'] for document in documents if is_dimension_document(document)))
+    if not dimension_ids:
+        return documents
+    indexed = get_documents(index_name, dimension_ids) if get_documents is not None else {}
+    values = {doc_id: source.get('entity_table_info') or [] for doc_id, source in indexed.items()
+              if is_dimension_document(source)}
+    merged_documents = []
+    for document in documents:
+        if is_dimension_document(document) and document['_id'] in values:
+            entity_table_info = merge_entity_table_info(document['entity_table_info'], values[document['_id']])
+            document = dict(document, entity_table_info=entity_table_info, entity_count=len(entity_table_info),
+                            comment=get_dimension_comment(document['entity'], entity_table_info))
+        if is_dimension_document(document):
+            values[document['_id']] = document['entity_table_info']
+        merged_documents.append(document)
+    return merged_documents
+
+
+def fake_embed_texts(dimension):
+    """Embedder returning a deterministic unit vector per text, to run the indexer without an embedding model"""
+
+    def embed_texts(texts):
+        embeddings = []
+        for text in texts:
+            generator = random.Random(hashlib.sha256(text.encode('utf-8')).hexdigest())
+            vector = [generator.gauss(0, 1) for _ in range(dimension)]
+            norm = sum(value * value for value in vector) ** 0.5
+            embeddings.append([value / norm for value in vector])
+        return embeddings
+
+    return embed_texts
+
+
+class IndexingCheckpoint:
+    """
+    Number of rows of a source file already written, saved after every chunk so that a failed run resumes after
+    the last written chunk. A changed file or different target starts from the beginning.
+    """
+
+    def __init__(self, path, source_path, kind, profile_name, index_name):
+        self.path = path
+        stat = os.stat(source_path)
+        self.source = {'source': os.path.abspath(source_path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'kind': kind, 'profile': profile_name, 'index': index_name}
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding='utf-8') as file:
+            checkpoint = json.load(file)
+        if checkpoint.get('source') != self.source:
+            logger.info(f'checkpoint {self.path} belongs to another file or target, starting from the beginning')
+            return {}
+        return checkpoint
+
+    def save(self, rows_done, stats):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'source': self.source, 'rows_done': rows_done, 'stats': stats}, file)
+        os.replace(temp_path, self.path)
+
+
+def run_bulk_indexer(source_path, kind, profile_name, index_name, embed_texts, write_actions, chunk_size=500,
+                     embedding_workers=4, checkpoint_path=None, restart=False, get_documents=None) -> dict:
+    """
+    Index a file of SQL samples, entities or agent CoT examples
+    :param kind: KIND_SQL (question, sql), KIND_ENTITY (entity, comment, optional entity_type and
+    entity_table_info) or KIND_AGENT (query, comment)
+    :param embed_texts: callable embedding a list of texts, e.g. create_document_embedding_batch or fake_embed_texts
+    :param write_actions: callable writing a list of bulk actions, returns (success count, failed items)
+    :param embedding_workers: chunks embedded in parallel; chunks are written in file order
+    :param checkpoint_path: defaults to the source path with .checkpoint.json appended
+    :param restart: ignore an existing checkpoint
+    :param get_documents: callable (index_name, doc_ids) returning a dict of the _source of indexed documents by id,
+    used to merge the values of dimension entities with the indexed values, see merge_dimension_documents
+    :return: stats with rows, indexed, failed and skipped counts
+    """
+    if kind not in DOCUMENT_KINDS:
+        raise BulkIndexerError(f'unknown kind {kind}, use one of {list(DOCUMENT_KINDS)}')
+    checkpoint = IndexingCheckpoint(checkpoint_path or source_path + '.checkpoint.json', source_path, kind,
+                                    profile_name, index_name)
+    saved = {} if restart else checkpoint.load()
+    rows_done = saved.get('rows_done', 0)
+    stats = saved.get('stats') or {'rows': 0, 'indexed': 0, 'failed': 0, 'skipped': 0}
+    if rows_done:
+        logger.info(f'resuming {source_path} after {rows_done} rows')
+    started_at = time.time()
+    rows_at_start = rows_done
+
+    def write_chunk(rows, texts, embedding_future):
+        nonlocal rows_done
+        embeddings = iter(embedding_future.result())
+        actions = [build_document(kind, index_name, profile_name, row, next(embeddings))
+                   for row, text in zip(rows, texts) if text]
+        if kind == KIND_ENTITY:
+            actions = merge_dimension_documents(actions, index_name, get_documents)
+        success, failed = write_actions(actions) if actions else (0, [])
+        for item in failed[:5]:
+            logger.error(f'failed to index document: {item}')
+        rows_done += len(rows)
+        stats['rows'] = rows_done
+        stats['indexed'] += success
+        stats['failed'] += len(failed)
+        stats['skipped'] += len(rows) - len(actions)
+        checkpoint.save(rows_done, stats)
+        elapsed = time.time() - started_at
+        logger.info(f'{rows_done} rows of {source_path} done, {stats}, '
+                    f'{(rows_done - rows_at_start) / elapsed if elapsed > 0 else 0.0:.1f} rows/s')
+
+    with ThreadPoolExecutor(max_workers=max(embedding_workers, 1), thread_name_prefix='genbi-indexer') as executor:
+        pending = deque()
+        for rows in iter_file_rows(source_path, chunk_size, rows_done):
+            texts = [get_row_text(kind, row) for row in rows]
+            pending.append((rows, texts, executor.submit(embed_texts, [text for text in texts if text])))
+            while len(pending) >= max(embedding_workers, 1):
+                write_chunk(*pending.popleft())
+        while pending:
+            write_chunk(*pending.popleft())
+    return stats
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from nlq.data_access.opensearch_documents import normalize_document_text
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# texts embedded and written to OpenSearch together, a SageMaker endpoint gets one multi-input call per chunk
+VECTOR_STORE_BULK_CHUNK_SIZE = int(os.getenv('VECTOR_STORE_BULK_CHUNK_SIZE', 64))
+# chunks written to OpenSearch in the background while the next chunk is embedded
+VECTOR_STORE_BULK_THREADS = int(os.getenv('VECTOR_STORE_BULK_THREADS', 4))
+
+
+def get_text_hash(text) -> str:
+    return hashlib.sha256(normalize_document_text(text).encode('utf-8')).hexdigest()
+
+
+def dedupe_by_text(items, get_text) -> list:
+    """
+    Drop repeated texts, the last item of a text wins but keeps the position of the first one, like the later
+    write of the same document id overwrites the earlier one
+    """
+    unique_items = {}
+    for item in items:
+        unique_items[get_text_hash(get_text(item))] = item
+    return list(unique_items.values())
+
+
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class IngestionReport:
+    def __init__(self, total):
+        self.total = total
+        self.duplicates = 0
+        self.processed = 0
+        self.indexed = 0
+        self.replaced = 0
+        self.failed = 0
+        self.started_at = time.time()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """processed documents per second"""
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.processed} of {self.total - self.duplicates} documents processed, {self.indexed} indexed, "
+                f"{self.replaced} replaced, {self.failed} failed, {self.duplicates} duplicates skipped, "
+                f"{self.throughput:.1f} docs/s")
+
+
+def ingest_in_chunks(items, get_text, embed_texts, write_chunk, chunk_size=None, on_progress=None) -> IngestionReport:
+    """
+    Embed and write documents chunk by chunk, writing up to VECTOR_STORE_BULK_THREADS chunks while the next
+    chunk is embedded
+    :param items: documents to ingest, repeated texts are written once
+    :param get_text: callable returning the text of an item that is embedded
+    :param embed_texts: callable embedding a list of texts, e.g. create_document_embedding_batch
+    :param write_chunk: callable (items, embeddings) returning (indexed count, replaced count, failed count)
+    :param chunk_size: defaults to VECTOR_STORE_BULK_CHUNK_SIZE
+    :param on_progress: optional callable receiving the report after every chunk, called on the calling thread
+    """
+    items = list(items)
+    report = IngestionReport(len(items))
+    unique_items = dedupe_by_text(items, get_text)
+    report.duplicates = len(items) - len(unique_items)
+
+    def collect(chunk, write_future):
+        try:
+            indexed, replaced, failed = write_future.result()
+        except Exception as e:
+            logger.error(f"bulk write of {len(chunk)} documents failed: {e}")
+            indexed, replaced, failed = 0, 0, len(chunk)
+        report.processed += len(chunk)
+        report.indexed += indexed
+        report.replaced += replaced
+        report.failed += failed
+        if on_progress is not None:
+            on_progress(report)
+
+    max_pending = max(VECTOR_STORE_BULK_THREADS, 1)
+    with ThreadPoolExecutor(max_workers=max_pending, thread_name_prefix='genbi-bulk') as writer:
+        pending = deque()
+        for chunk in iter_chunks(unique_items, chunk_size or VECTOR_STORE_BULK_CHUNK_SIZE):
+            try:
+                embeddings = embed_texts([str(get_text(item)).strip() for item in chunk])
+                write_future = writer.submit(write_chunk, chunk, embeddings)
+            except Exception as e:
+                logger.error(f"embedding of {len(chunk)} documents failed: {e}")
+                write_future = Future()
+                write_future.set_result((0, 0, len(chunk)))
+            pending.append((chunk, write_future))
+            while len(pending) >= max_pending:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+    logger.info(f"bulk ingestion finished: {report}")
+    return report
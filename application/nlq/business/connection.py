@@ -1,13 +1,31 @@
 
+import copy
+import os
+import threading
+import time
+
+from nlq.business.dimension_values import DIMENSION_VALUES_FETCH_SIZE, DIMENSION_VALUES_MAX_PER_COLUMN, \
+    group_dimension_values
 from nlq.data_access.dynamo_connection import ConnectConfigDao, ConnectConfigEntity
 from nlq.data_access.database import RelationDatabase
+from nlq.data_access.engine_registry import EngineRegistry
 from utils.logging import getLogger
+from utils.schema_metadata_cache import get_schema_metadata_cache
+from utils.sql_result_cache import get_sql_result_cache
 
 logger = getLogger()
 
+# seconds to keep a resolved connection config, including its Secrets Manager credentials, in memory
+CONNECTION_CACHE_TTL = int(os.getenv('CONNECTION_CACHE_TTL', 300))
+# driver messages of rejected credentials, e.g. after the secret of a connection was rotated
+AUTH_ERROR_MARKERS = ['access denied for user', 'password authentication failed', 'login failed',
+                      'authentication failed', 'invalid username/password', 'invalid password']
+
 
 class ConnectionManagement:
     connection_config_dao = ConnectConfigDao()
+    connection_cache: dict[str, tuple[ConnectConfigEntity, float]] = {}
+    connection_cache_lock = threading.Lock()
 
     @classmethod
     def get_all_connections(cls):
@@ -17,25 +35,77 @@ class ConnectionManagement:
     @classmethod
     def add_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
         cls.connection_config_dao.add_url_db(conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment)
+        cls.invalidate_connection(conn_name)
         logger.info(f"Connection {conn_name} added")
 
     @classmethod
     def get_conn_config_by_name(cls, conn_name):
-        return cls.connection_config_dao.get_by_name(conn_name)
+        """
+        Cached connection config lookup, the DynamoDB item and secret are loaded at most once per CONNECTION_CACHE_TTL
+        """
+        with cls.connection_cache_lock:
+            cached = cls.connection_cache.get(conn_name)
+        if cached is not None and time.monotonic() - cached[1] < CONNECTION_CACHE_TTL:
+            return copy.copy(cached[0])
+
+        conn_config = cls.connection_config_dao.get_by_name(conn_name)
+        if conn_config is None:
+            return None
+        with cls.connection_cache_lock:
+            cls.connection_cache[conn_name] = (conn_config, time.monotonic())
+        return copy.copy(conn_config)
+
+    @classmethod
+    def invalidate_connection(cls, conn_name):
+        with cls.connection_cache_lock:
+            cls.connection_cache.pop(conn_name, None)
+
+    @classmethod
+    def refresh_connection(cls, conn_name):
+        """
+        Reload the config and secret of a connection and drop its pooled engines, used when the database rejected
+        the cached credentials
+        :return: a new engine built from the reloaded config
+        """
+        cls.invalidate_connection(conn_name)
+        EngineRegistry.dispose(conn_name)
+        return cls.get_engine_by_name(conn_name)
+
+    @staticmethod
+    def is_auth_error(error: Exception) -> bool:
+        while error is not None:
+            message = str(error).lower()
+            if any(marker in message for marker in AUTH_ERROR_MARKERS):
+                return True
+            error = getattr(error, 'orig', None) or error.__cause__
+        return False
 
     @classmethod
     def update_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
         cls.connection_config_dao.update_db_info(conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name,
                                                  comment)
+        cls.invalidate_connection(conn_name)
+        EngineRegistry.dispose(conn_name)
+        get_sql_result_cache().invalidate_connection(conn_name)
+        get_schema_metadata_cache().invalidate_connection(conn_name)
         logger.info(f"Connection {conn_name} updated")
 
     @classmethod
     def delete_connection(cls, conn_name):
+        cls.invalidate_connection(conn_name)
+        EngineRegistry.dispose(conn_name)
+        get_sql_result_cache().invalidate_connection(conn_name)
+        get_schema_metadata_cache().invalidate_connection(conn_name)
         if cls.connection_config_dao.delete(conn_name):
             logger.info(f"Connection {conn_name} deleted")
         else:
             logger.warning(f"Failed to delete Connection {conn_name}")
 
+    @classmethod
+    def invalidate_schema_metadata(cls, conn_name):
+        """Drop the cached table lists and table metadata of a connection, the next lookup reflects again"""
+        get_schema_metadata_cache().invalidate_connection(conn_name)
+
     @classmethod
     def get_table_name_by_config(cls, conn_config: ConnectConfigEntity, schema_names):
         return RelationDatabase.get_all_tables_by_connection(conn_config, schema_names)
@@ -48,6 +118,30 @@ class ConnectionManagement:
     def get_table_definition_by_config(cls, conn_config: ConnectConfigEntity, schema_names, table_names):
         return RelationDatabase.get_table_definition_by_connection(conn_config, schema_names, table_names)
 
+    @classmethod
+    def get_column_names_by_config(cls, conn_config: ConnectConfigEntity, table_name):
+        return RelationDatabase.get_column_names_by_connection(conn_config, table_name)
+
+    @classmethod
+    def read_dimension_entities(cls, conn_name, columns):
+        """
+        Read the distinct values of dimension columns of a connection, grouped into entities
+        :param columns: list of (table name, column name)
+        :return: dict of entity_table_info by entity
+        """
+        conn_config = cls.get_conn_config_by_name(conn_name)
+
+        def iter_values(table_name, column_name):
+            return RelationDatabase.iter_distinct_values_by_connection(
+                conn_config, table_name, column_name, DIMENSION_VALUES_FETCH_SIZE, DIMENSION_VALUES_MAX_PER_COLUMN)
+
+        return group_dimension_values(columns, iter_values)
+
+    @classmethod
+    def get_engine_by_name(cls, conn_name):
+        conn_config = cls.get_conn_config_by_name(conn_name)
+        return RelationDatabase.get_engine_by_connection(conn_config)
+
     @classmethod
     def get_db_url_by_name(cls, conn_name):
         conn_config = cls.get_conn_config_by_name(conn_name)
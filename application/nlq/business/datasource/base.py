@@ -125,6 +125,32 @@ class DataSourceBase(ABC):
 {cte_sql}
 {sql_splits[1]}'''
 
+    def support_limit_injection(self) -> bool:
+        """Whether a trailing LIMIT clause can be appended to a query of this data source, dialects using TOP or
+        FETCH FIRST are only capped when fetching the rows"""
+        return False
+
+    def inject_row_limit(self, sql: str, limit: int) -> str:
+        """Method to cap the rows a single SELECT query returns, a smaller LIMIT of the query is kept"""
+        if not self.support_limit_injection():
+            return sql
+        stripped_sql = sql.strip().rstrip(';').rstrip()
+        if ';' in stripped_sql or not re.match(r'^(\s|/\*.*?\*/|--[^\n]*\n)*(select|with)\b', stripped_sql,
+                                              re.IGNORECASE | re.DOTALL):
+            return sql
+        limit_match = re.search(r'\blimit\s+(\d+)(\s*,\s*(\d+))?(\s+offset\s+\d+)?\s*$', stripped_sql,
+                                re.IGNORECASE)
+        if limit_match is None:
+            if re.search(r'\bfetch\s+(first|next)\b', stripped_sql, re.IGNORECASE):
+                return sql
+            return f'{stripped_sql}\nLIMIT {limit}'
+        # MySQL style LIMIT offset, count
+        count_group = 3 if limit_match.group(3) else 1
+        if int(limit_match.group(count_group)) <= limit:
+            return stripped_sql
+        start, end = limit_match.span(count_group)
+        return stripped_sql[:start] + str(limit) + stripped_sql[end:]
+
     def post_sql_generation(self, sql: str, rls_config: str = None, login_user: LoginUser = None) -> str:
         """Method to post-process SQL after generation"""
         if self.row_level_security_mode() != RowLevelSecurityMode.NONE and rls_config is not None:
@@ -9,5 +9,8 @@ class ClickHouseDataSource(DataSourceBase):
     def support_row_level_security(self) -> bool:
         return True
 
+    def support_limit_injection(self) -> bool:
+        return True
+
     def __init__(self):
         super().__init__()
\ No newline at end of file
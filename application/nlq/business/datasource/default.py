@@ -1,5 +1,8 @@
 from nlq.business.datasource.base import DataSourceBase, RowLevelSecurityMode
 
+# database types whose SQL dialect ends a query with LIMIT n
+LIMIT_CLAUSE_DB_TYPES = {'mysql', 'postgresql', 'redshift', 'starrocks', 'clickhouse', 'hive', 'athena', 'bigquery'}
+
 
 class DefaultDataSoruce(DataSourceBase):
 
@@ -9,5 +12,9 @@ class DefaultDataSoruce(DataSourceBase):
     def support_row_level_security(self) -> bool:
         return False
 
-    def __init__(self):
+    def support_limit_injection(self) -> bool:
+        return self.db_type in LIMIT_CLAUSE_DB_TYPES
+
+    def __init__(self, db_type=None):
         super().__init__()
+        self.db_type = db_type
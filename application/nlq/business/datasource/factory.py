@@ -14,7 +14,7 @@ class DataSourceFactory:
         elif data_source_type == "clickhouse":
             return ClickHouseDataSource()
         else:
-            return DefaultDataSoruce()
+            return DefaultDataSoruce(data_source_type)
 
     @staticmethod
     def apply_row_level_security_for_sql(db_type: str, sql: str, rls_config: str, username: str):
@@ -24,3 +24,8 @@ class DataSourceFactory:
             rls_config=rls_config,
             login_user=LoginUser(username))
         return post_sql
+
+    @staticmethod
+    def apply_row_limit_for_sql(db_type: str, sql: str, limit: int):
+        data_source = DataSourceFactory.get_data_source(db_type)
+        return data_source.inject_row_limit(sql, limit)
@@ -9,6 +9,9 @@ class MySQLDataSource(DataSourceBase):
     def support_row_level_security(self) -> bool:
         return True
 
+    def support_limit_injection(self) -> bool:
+        return True
+
     def __init__(self):
         super().__init__()
 
@@ -0,0 +1,86 @@
+import os
+
+from nlq.data_access.opensearch_documents import get_entity_value_id, merge_entity_table_info
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# rows fetched per round trip while streaming the distinct values of a column
+DIMENSION_VALUES_FETCH_SIZE = int(os.getenv('DIMENSION_VALUES_FETCH_SIZE', 1000))
+# distinct values read per column, a column with more values is an identifier rather than a dimension
+DIMENSION_VALUES_MAX_PER_COLUMN = int(os.getenv('DIMENSION_VALUES_MAX_PER_COLUMN', 10000))
+# longer values, e.g. free text, are not indexed as entities
+DIMENSION_VALUE_MAX_LENGTH = int(os.getenv('DIMENSION_VALUE_MAX_LENGTH', 100))
+
+
+def parse_dimension_column(name):
+    """
+    :param name: table.column or schema.table.column
+    :return: (table name, column name)
+    """
+    table_name, _, column_name = name.strip().rpartition('.')
+    if not table_name or not column_name:
+        raise ValueError(f'dimension column {name} is not in the format table.column')
+    return table_name, column_name
+
+
+def group_dimension_values(columns, iter_values) -> dict:
+    """
+    Read the distinct values of dimension columns and group the values of the same name across tables and columns
+    into the entity_table_info of one entity
+    :param columns: list of (table name, column name)
+    :param iter_values: callable (table name, column name) yielding chunks of distinct values
+    :return: dict of entity_table_info by entity, the entity is the value as text
+    """
+    entities = {}
+    for table_name, column_name in columns:
+        value_count = 0
+        for chunk in iter_values(table_name, column_name):
+            for value in chunk:
+                text = '' if value is None else str(value).strip()
+                if not text or len(text) > DIMENSION_VALUE_MAX_LENGTH:
+                    continue
+                value_count += 1
+                item = {'table_name': table_name, 'column_name': column_name, 'value': text}
+                entities.setdefault(text, {})[get_entity_value_id(item)] = item
+        logger.info(f'read {value_count} distinct values of {table_name}.{column_name}')
+    return {entity: list(items.values()) for entity, items in entities.items()}
+
+
+class DimensionRefreshPlan:
+    def __init__(self):
+        # (entity, entity_table_info) of entities that are not indexed yet and need an embedding
+        self.new = []
+        # (entity, merged entity_table_info) of indexed dimension entities with new values
+        self.updates = []
+        self.unchanged = 0
+        # entities indexed as another entity type, e.g. a metric of the same name, which are left alone
+        self.conflicts = []
+
+    def __str__(self):
+        return (f"{len(self.new)} new, {len(self.updates)} with new values, {self.unchanged} unchanged, "
+                f"{len(self.conflicts)} indexed as another entity type")
+
+
+def plan_dimension_refresh(entities, indexed) -> DimensionRefreshPlan:
+    """
+    Compare the dimension values read from the database with the index, so that only new entities are embedded.
+    Values no longer in the database are kept in the index.
+    :param entities: dict of entity_table_info by entity
+    :param indexed: dict of the _source of the indexed documents by entity, with entity_type and entity_table_info
+    """
+    plan = DimensionRefreshPlan()
+    for entity, entity_table_info in entities.items():
+        document = indexed.get(entity)
+        if document is None:
+            plan.new.append((entity, entity_table_info))
+        elif document.get('entity_type') != 'dimension':
+            plan.conflicts.append(entity)
+        else:
+            indexed_table_info = document.get('entity_table_info') or []
+            merged = merge_entity_table_info(indexed_table_info, entity_table_info)
+            if len(merged) == len(indexed_table_info):
+                plan.unchanged += 1
+            else:
+                plan.updates.append((entity, merged))
+    return plan
@@ -0,0 +1,159 @@
+import math
+import operator
+
+from nlq.business.bulk_indexer import KIND_ENTITY, KIND_SQL, KIND_AGENT
+from nlq.data_access.opensearch_documents import get_dimension_comment, get_document_id, merge_entity_table_info
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# field of the indexed documents of each kind their id is derived from
+DOCUMENT_TEXT_FIELDS = {
+    KIND_SQL: 'text',
+    KIND_ENTITY: 'entity',
+    KIND_AGENT: 'query',
+}
+
+
+def iter_batches(documents, batch_size):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def is_dimension_entity(kind, source) -> bool:
+    return kind == KIND_ENTITY and source.get('entity_type') == 'dimension'
+
+
+def migrate_document_ids(documents, kind, index_name, write_actions, get_documents, batch_size=500,
+                         dry_run=False) -> dict:
+    """
+    Move the documents of an index written with random ids to the deterministic id of their profile and text.
+    Documents of the same text collapse into one, the dimension values of dimension entities are merged. The old
+    document is only deleted after its copy is written, so an interrupted migration is safe to rerun.
+    :param documents: iterable of hits with _id and _source including vector_field, e.g. a scan of the index
+    :param write_actions: callable writing a list of bulk actions, returns (success count, failed items)
+    :param get_documents: callable (index_name, doc_ids) returning a dict of the _source of indexed documents by id
+    :param dry_run: only count the documents that would be migrated
+    :return: stats with documents, unchanged, migrated, merged, failed and skipped counts
+    """
+    text_field = DOCUMENT_TEXT_FIELDS[kind]
+    stats = {'documents': 0, 'unchanged': 0, 'migrated': 0, 'merged': 0, 'failed': 0, 'skipped': 0}
+    for batch in iter_batches(documents, batch_size):
+        stats['documents'] += len(batch)
+        # new id -> document, and the old ids it replaces
+        targets = {}
+        old_ids = {}
+        for hit in batch:
+            source = hit['_source']
+            text = source.get(text_field)
+            if not text or 'profile' not in source:
+                stats['skipped'] += 1
+                continue
+            doc_id = get_document_id(source['profile'], text)
+            if hit['_id'] == doc_id:
+                stats['unchanged'] += 1
+                continue
+            if doc_id in targets:
+                stats['merged'] += 1
+                if is_dimension_entity(kind, source):
+                    source = dict(source, entity_table_info=merge_entity_table_info(
+                        source.get('entity_table_info', []), targets[doc_id].get('entity_table_info')))
+            targets[doc_id] = source
+            old_ids.setdefault(doc_id, []).append(hit['_id'])
+        if not targets:
+            continue
+
+        # a document already at its new id was written after the switch to deterministic ids and is kept, only
+        # the dimension values of the old copies are merged into it
+        indexed = get_documents(index_name, list(targets))
+        writes = {}
+        for doc_id, source in targets.items():
+            if doc_id not in indexed:
+                writes[doc_id] = source
+                continue
+            stats['merged'] += 1
+            if is_dimension_entity(kind, source) and is_dimension_entity(kind, indexed[doc_id]):
+                writes[doc_id] = dict(source, entity_table_info=merge_entity_table_info(
+                    indexed[doc_id].get('entity_table_info', []), source.get('entity_table_info')))
+
+        if dry_run:
+            stats['migrated'] += sum(len(ids) for ids in old_ids.values())
+            continue
+        _, failed = write_actions([build_migrated_document(kind, index_name, doc_id, source)
+                                   for doc_id, source in writes.items()]) if writes else (0, [])
+        failed_ids = {item.get('index', {}).get('_id') for item in failed}
+        delete_actions = [{'_op_type': 'delete', '_index': index_name, '_id': old_id}
+                          for doc_id, ids in old_ids.items() if doc_id not in failed_ids for old_id in ids]
+        _, failed_deletes = write_actions(delete_actions) if delete_actions else (0, [])
+        for item in (failed + failed_deletes)[:5]:
+            logger.error(f'failed to migrate document: {item}')
+        stats['failed'] += sum(len(old_ids[doc_id]) for doc_id in failed_ids if doc_id in old_ids)
+        stats['failed'] += len(failed_deletes)
+        stats['migrated'] += len(delete_actions) - len(failed_deletes)
+        logger.info(f'migrating document ids of {index_name}: {stats}')
+    return stats
+
+
+def build_migrated_document(kind, index_name, doc_id, source) -> dict:
+    document = dict(source, _index=index_name, _id=doc_id)
+    if is_dimension_entity(kind, source):
+        # the comment and count are derived from the merged dimension values
+        entity_table_info = source.get('entity_table_info', [])
+        document.update(comment=get_dimension_comment(source['entity'], entity_table_info),
+                        entity_count=len(entity_table_info))
+    return document
+
+
+def cosine_similarity(vector, other) -> float:
+    if not vector or not other or len(vector) != len(other):
+        return 0.0
+    norm = math.sqrt(sum(value * value for value in vector)) * math.sqrt(sum(value * value for value in other))
+    return sum(map(operator.mul, vector, other)) / norm if norm else 0.0
+
+
+def find_near_duplicates(documents, kind, search_similar, min_similarity=0.99, top_k=5, batch_size=100) -> list:
+    """
+    Find documents of the same profile whose embeddings are nearly identical but whose texts differ, which the
+    deterministic ids do not catch, e.g. a question with different punctuation. Run as a batch job instead of a
+    kNN search on every insert.
+    :param documents: iterable of hits with _id and _source including vector_field, e.g. a scan of the index
+    :param search_similar: callable (profile_name, embeddings, top_k) returning a list of hits per embedding, the
+    hits with _source including vector_field
+    :param min_similarity: cosine similarity from which two documents are near duplicates
+    :return: list of (kept hit, list of near duplicate hits), the first document seen of a group is kept
+    """
+    text_field = DOCUMENT_TEXT_FIELDS[kind]
+    grouped_ids = set()
+    groups = []
+    for batch in iter_batches(documents, batch_size):
+        by_profile = {}
+        for hit in batch:
+            if hit['_id'] not in grouped_ids and hit['_source'].get('vector_field'):
+                by_profile.setdefault(hit['_source'].get('profile'), []).append(hit)
+        for profile_name, hits in by_profile.items():
+            similar_hits = search_similar(profile_name, [hit['_source']['vector_field'] for hit in hits], top_k)
+            for hit, similar in zip(hits, similar_hits):
+                if hit['_id'] in grouped_ids:
+                    continue
+                duplicates = []
+                for other in similar:
+                    if other['_id'] == hit['_id'] or other['_id'] in grouped_ids:
+                        continue
+                    if other['_source'].get(text_field) == hit['_source'].get(text_field):
+                        continue
+                    similarity = cosine_similarity(hit['_source']['vector_field'],
+                                                   other['_source'].get('vector_field'))
+                    if similarity >= min_similarity:
+                        duplicates.append(other)
+                        grouped_ids.add(other['_id'])
+                if duplicates:
+                    # a kept document is not reported again as the duplicate of a later one
+                    grouped_ids.add(hit['_id'])
+                    groups.append((hit, duplicates))
+    return groups
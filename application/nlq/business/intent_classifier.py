@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from nlq.business.answer_cache import normalize_embeddings
+from utils.async_executor import get_task_executor
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# off: always ask the LLM; shadow: classify locally but use the LLM intent, to measure the accuracy of the local
+# decision; on: confident reject, knowledge and agent decisions skip the intent LLM call, normal_search questions
+# still need the LLM to extract their entity slots
+INTENT_CLASSIFIER_MODE = os.getenv('INTENT_CLASSIFIER_MODE', 'off').lower()
+INTENT_CLASSIFIER_K = int(os.getenv('INTENT_CLASSIFIER_K', 5))
+# similarity of the nearest labelled question, and weighted vote share of the winning intent among the k nearest
+INTENT_CLASSIFIER_MIN_SIMILARITY = float(os.getenv('INTENT_CLASSIFIER_MIN_SIMILARITY', 0.9))
+INTENT_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv('INTENT_CLASSIFIER_MIN_CONFIDENCE', 0.8))
+# labelled questions mined from the query log of a profile, with fewer the LLM always decides
+INTENT_CLASSIFIER_MIN_EXAMPLES = int(os.getenv('INTENT_CLASSIFIER_MIN_EXAMPLES', 50))
+INTENT_CLASSIFIER_MAX_EXAMPLES = int(os.getenv('INTENT_CLASSIFIER_MAX_EXAMPLES', 1000))
+INTENT_CLASSIFIER_REFRESH_INTERVAL = int(os.getenv('INTENT_CLASSIFIER_REFRESH_INTERVAL', 3600))
+
+INTENTS = ['normal_search', 'agent_search', 'knowledge_search', 'reject_search']
+
+
+def is_intent_classifier_enabled() -> bool:
+    return INTENT_CLASSIFIER_MODE in ('shadow', 'on')
+
+
+class IntentPrediction:
+    def __init__(self, intent, confidence, similarity, confident):
+        self.intent = intent
+        # weighted vote share of the intent among the nearest neighbours
+        self.confidence = confidence
+        # similarity of the nearest neighbour
+        self.similarity = similarity
+        self.confident = confident
+
+    def __repr__(self):
+        return (f"IntentPrediction(intent={self.intent}, confidence={self.confidence:.3f}, "
+                f"similarity={self.similarity:.3f}, confident={self.confident})")
+
+
+class IntentClassifier:
+    """Weighted k nearest neighbour vote over the embeddings of labelled questions of one profile"""
+
+    def __init__(self, examples, embeddings):
+        """
+        :param examples: list of (question, intent)
+        :param embeddings: embeddings of the questions, in the same order
+        """
+        self.queries = [query for query, _ in examples]
+        self.intents = [intent for _, intent in examples]
+        # one normalized row per question, a prediction is a single matrix product
+        self.embeddings = normalize_embeddings(embeddings) if len(embeddings) else None
+
+    def __len__(self):
+        return len(self.queries)
+
+    def predict(self, embedding, k=None, min_similarity=None, min_confidence=None) -> IntentPrediction:
+        """
+        :param k: defaults to INTENT_CLASSIFIER_K
+        :param min_similarity: defaults to INTENT_CLASSIFIER_MIN_SIMILARITY
+        :param min_confidence: defaults to INTENT_CLASSIFIER_MIN_CONFIDENCE
+        :return: the prediction, or None without examples or for an embedding of another dimension
+        """
+        k = INTENT_CLASSIFIER_K if k is None else k
+        min_similarity = INTENT_CLASSIFIER_MIN_SIMILARITY if min_similarity is None else min_similarity
+        min_confidence = INTENT_CLASSIFIER_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        if self.embeddings is None or self.embeddings.shape[1] != len(embedding):
+            return None
+        similarities = self.embeddings @ normalize_embeddings(embedding)
+        k = max(min(k, len(similarities)), 1)
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+        nearest = nearest[np.argsort(-similarities[nearest])]
+        votes = Counter()
+        for index in nearest:
+            votes[self.intents[index]] += max(float(similarities[index]), 0.0)
+        intent, vote = votes.most_common(1)[0]
+        total = sum(votes.values())
+        confidence = vote / total if total else 0.0
+        similarity = float(similarities[nearest[0]])
+        confident = similarity >= min_similarity and confidence >= min_confidence
+        return IntentPrediction(intent, confidence, similarity, confident)
+
+
+def build_intent_classifier(examples, embed_texts) -> IntentClassifier:
+    """
+    :param examples: list of (question, intent), newest first; the newest label of a repeated question is kept
+    and unknown intents are skipped
+    :param embed_texts: callable embedding a list of texts, e.g. create_vector_embedding_batch
+    """
+    labelled = {}
+    for query, intent in examples:
+        query = (query or '').strip()
+        if query and intent in INTENTS and query not in labelled:
+            labelled[query] = intent
+    labelled_examples = list(labelled.items())
+    embeddings = embed_texts([query for query, _ in labelled_examples]) if labelled_examples else []
+    return IntentClassifier(labelled_examples, embeddings)
+
+
+class IntentClassifierRegistry:
+    """
+    Classifier per profile, rebuilt in the background from the query log every refresh interval so that no
+    question waits on embedding the examples
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self.classifiers = {}
+        self.building = set()
+        self.lock = threading.Lock()
+
+    def get(self, profile_name, load_examples, embed_texts):
+        """
+        :param load_examples: callable (profile_name, size) returning a list of (question, intent), newest first
+        :param embed_texts: callable embedding a list of texts
+        :return: the classifier of the profile, or None while it is built or has too few examples
+        """
+        now = time.time()
+        with self.lock:
+            classifier, built_at = self.classifiers.get(profile_name, (None, 0.0))
+            rebuild = now - built_at > self.refresh_interval and profile_name not in self.building
+            if rebuild:
+                self.building.add(profile_name)
+        if rebuild:
+            get_task_executor().submit(self._build, profile_name, load_examples, embed_texts, classifier)
+        if classifier is None or len(classifier) < INTENT_CLASSIFIER_MIN_EXAMPLES:
+            return None
+        return classifier
+
+    def _build(self, profile_name, load_examples, embed_texts, previous_classifier):
+        classifier = previous_classifier
+        try:
+            classifier = build_intent_classifier(load_examples(profile_name, INTENT_CLASSIFIER_MAX_EXAMPLES),
+                                                 embed_texts)
+            logger.info(f"intent classifier of profile {profile_name} built from {len(classifier)} examples")
+        except Exception as e:
+            # keep the previous classifier until the next refresh
+            logger.error(f"failed to build the intent classifier of profile {profile_name}: {e}")
+        finally:
+            with self.lock:
+                self.classifiers[profile_name] = (classifier, time.time())
+                self.building.discard(profile_name)
+
+
+class IntentClassifierStats:
+    """Coverage of the local classifier and, in shadow mode, its agreement with the LLM intent"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.predictions = 0
+        self.confident = 0
+        self.compared = 0
+        self.agreements = 0
+        # (local intent, LLM intent) -> count
+        self.confusion = Counter()
+
+    def record_prediction(self, prediction):
+        with self.lock:
+            self.predictions += 1
+            if prediction is not None and prediction.confident:
+                self.confident += 1
+
+    def record_comparison(self, local_intent, llm_intent):
+        with self.lock:
+            self.compared += 1
+            if local_intent == llm_intent:
+                self.agreements += 1
+            self.confusion[(local_intent, llm_intent)] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "predictions": self.predictions,
+                "confident": self.confident,
+                "coverage": self.confident / self.predictions if self.predictions else 0.0,
+                "compared": self.compared,
+                "accuracy": self.agreements / self.compared if self.compared else 0.0,
+                "confusion": {f"{local}->{llm}": count for (local, llm), count in self.confusion.items()}
+            }
+
+
+intent_classifier_registry = IntentClassifierRegistry(INTENT_CLASSIFIER_REFRESH_INTERVAL)
+intent_classifier_stats = IntentClassifierStats()
+
+
+def classify_intent(profile_name, embedding, load_examples, embed_texts):
+    """
+    Local intent of a question
+    :param embedding: embedding of the question
+    :return: IntentPrediction, or None if the profile has no usable classifier yet
+    """
+    classifier = intent_classifier_registry.get(profile_name, load_examples, embed_texts)
+    if classifier is None:
+        return None
+    prediction = classifier.predict(embedding)
+    intent_classifier_stats.record_prediction(prediction)
+    logger.info(f"local intent of profile {profile_name}: {prediction}")
+    return prediction
@@ -12,16 +12,26 @@ class LogManagement:
 
     @classmethod
     def add_log_to_database(cls, log_id, user_id, session_id, profile_name, sql, query, intent, log_info, time_str,
-                            log_type='chat_history'):
+                            log_type='chat_history', query_rewrite=None, intent_source=None):
         cls.query_log_dao.add_log(log_id=log_id, profile_name=profile_name, user_id=user_id, session_id=session_id,
                                   sql=sql, query=query, intent=intent, log_info=log_info, time_str=time_str,
-                                  log_type=log_type)
+                                  log_type=log_type, query_rewrite=query_rewrite, intent_source=intent_source)
 
     @classmethod
     def get_history(cls, user_id, profile_name, log_type="chat_history"):
         history_list = cls.query_log_dao.get_history_by_user_profile(user_id, profile_name, log_type)
         return history_list
 
+    @classmethod
+    def get_intent_examples(cls, profile_name, size):
+        """
+        Labelled questions for the local intent classifier, the rewritten question is used as it is what the
+        classifier is asked to predict
+        :return: list of (rewritten question, intent), newest first
+        """
+        logs = cls.query_log_dao.get_intent_examples(profile_name, size)
+        return [(log.get('query_rewrite'), log.get('intent')) for log in logs if log.get('query_rewrite')]
+
     @classmethod
     def get_history_by_session(cls, session_id, user_id, profile_name, size, log_type):
         user_query_history = []
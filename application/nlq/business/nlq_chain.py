@@ -3,6 +3,7 @@ import re
 import logging
 from nlq.business.connection import ConnectionManagement
 from utils.apis import query_from_sql_pd
+from utils.sql_result_cache import get_result_cache_ttl
 logger = logging.getLogger(__name__)
 
 class NLQChain:
@@ -75,7 +76,9 @@ class NLQChain:
                 return pd.DataFrame()
             self.executed_result_df = query_from_sql_pd(
                 p_db_url=db_url,
-                query=self.get_generated_sql())
+                query=self.get_generated_sql(),
+                conn_name=profile.get('conn_name', ''),
+                result_cache_ttl=get_result_cache_ttl(profile))
 
         return self.executed_result_df
 
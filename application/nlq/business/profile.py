@@ -1,77 +1,165 @@
+import copy
+import os
+import threading
+import time
 
+from nlq.business.answer_cache import get_answer_cache
 from nlq.data_access.dynamo_profile import ProfileConfigDao, ProfileConfigEntity
 from utils.logging import getLogger
 
 logger = getLogger()
 
+# a cached profile is reloaded after PROFILE_CACHE_TTL seconds at the latest, and its updated_at is compared with
+# DynamoDB every PROFILE_CACHE_CHECK_INTERVAL seconds, so edits made by another process show up quickly
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 300))
+PROFILE_CACHE_CHECK_INTERVAL = int(os.getenv('PROFILE_CACHE_CHECK_INTERVAL', 10))
+
+
+class ProfileCacheEntry:
+    def __init__(self, profile: ProfileConfigEntity):
+        self.profile = profile
+        self.loaded_at = time.monotonic()
+        self.checked_at = self.loaded_at
+
+
 class ProfileManagement:
     profile_config_dao = ProfileConfigDao()
+    profile_cache: dict[str, ProfileCacheEntry] = {}
+    profile_names_cache = None
+    profile_cache_lock = threading.Lock()
 
     @classmethod
     def get_all_profiles(cls):
         logger.info('get all profiles...')
-        return [conn.profile_name for conn in cls.profile_config_dao.get_profile_list()]
+        with cls.profile_cache_lock:
+            profile_names_cache = cls.profile_names_cache
+        if profile_names_cache is not None and time.monotonic() - profile_names_cache[1] < PROFILE_CACHE_TTL:
+            return list(profile_names_cache[0])
+        profile_names = cls.profile_config_dao.get_profile_name_list()
+        with cls.profile_cache_lock:
+            cls.profile_names_cache = (profile_names, time.monotonic())
+        return list(profile_names)
 
     @classmethod
     def get_all_profiles_with_info(cls):
         logger.info('get all profiles with info...')
         profile_list = cls.profile_config_dao.get_profile_list()
         profile_map = {}
+        with cls.profile_cache_lock:
+            for profile in profile_list:
+                cls.profile_cache[profile.profile_name] = ProfileCacheEntry(profile)
         for profile in profile_list:
-            profile_map[profile.profile_name] = {
-                'db_url': '',
-                'db_type': profile.db_type,
-                'conn_name': profile.conn_name,
-                'tables_info': profile.tables_info,
-                'hints': '',
-                'search_samples': [],
-                'comments':  profile.comments,
-                'prompt_map': profile.prompt_map,
-                'row_level_security_config': profile.row_level_security_config if profile.enable_row_level_security else None
-            }
+            profile_map[profile.profile_name] = cls.to_profile_info(copy.deepcopy(profile))
 
         return profile_map
 
+    @staticmethod
+    def to_profile_info(profile: ProfileConfigEntity):
+        return {
+            'db_url': '',
+            'db_type': profile.db_type,
+            'conn_name': profile.conn_name,
+            'tables_info': profile.tables_info,
+            'hints': '',
+            'search_samples': [],
+            'comments':  profile.comments,
+            'prompt_map': profile.prompt_map,
+            'row_level_security_config': profile.row_level_security_config if profile.enable_row_level_security else None,
+            'result_cache_ttl': profile.result_cache_ttl,
+            'result_max_rows': profile.result_max_rows,
+            'result_max_bytes': profile.result_max_bytes,
+            'chart_recommender': profile.chart_recommender,
+            # identifies this revision of the profile, e.g. to memoize compiled prompts
+            'profile_version': f'{profile.profile_name}:{profile.updated_at}' if profile.updated_at else None
+        }
+
+    @classmethod
+    def get_profile_info(cls, profile_name):
+        """
+        Get one profile in the format of get_all_profiles_with_info, served from the profile cache
+        :return: profile info dict, or None if the profile does not exist
+        """
+        profile = cls.get_profile_by_name(profile_name)
+        if profile is None:
+            return None
+        return cls.to_profile_info(profile)
+
     @classmethod
     def add_profile(cls, profile_name, conn_name, schemas, tables, comment, db_type: str):
         entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment, db_type=db_type)
         cls.profile_config_dao.add(entity)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Profile {profile_name} added")
 
     @classmethod
     def get_profile_by_name(cls, profile_name):
-        return cls.profile_config_dao.get_by_name(profile_name)
+        """
+        Read-through cached profile lookup. Callers get their own copy and may modify it.
+        """
+        now = time.monotonic()
+        with cls.profile_cache_lock:
+            entry = cls.profile_cache.get(profile_name)
+        if entry is not None and now - entry.loaded_at < PROFILE_CACHE_TTL:
+            if now - entry.checked_at < PROFILE_CACHE_CHECK_INTERVAL:
+                return copy.deepcopy(entry.profile)
+            if cls.profile_config_dao.get_updated_at(profile_name) == entry.profile.updated_at:
+                entry.checked_at = now
+                return copy.deepcopy(entry.profile)
+
+        profile = cls.profile_config_dao.get_by_name(profile_name)
+        with cls.profile_cache_lock:
+            if profile is None:
+                cls.profile_cache.pop(profile_name, None)
+                return None
+            cls.profile_cache[profile_name] = ProfileCacheEntry(profile)
+        return copy.deepcopy(profile)
+
+    @classmethod
+    def invalidate_profile(cls, profile_name):
+        with cls.profile_cache_lock:
+            cls.profile_cache.pop(profile_name, None)
+            cls.profile_names_cache = None
+        get_answer_cache().invalidate_profile(profile_name)
 
     @classmethod
-    def update_profile(cls, profile_name, conn_name, schemas, tables, comment, tables_info, db_type, rls_enable, rls_config):
-        all_profiles = ProfileManagement.get_all_profiles_with_info()
-        prompt_map = all_profiles[profile_name]["prompt_map"]
+    def update_profile(cls, profile_name, conn_name, schemas, tables, comment, tables_info, db_type, rls_enable, rls_config,
+                       result_cache_ttl=None, result_max_rows=None, result_max_bytes=None, chart_recommender=None):
+        prompt_map = cls.profile_config_dao.get_by_name(profile_name).prompt_map
         entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment, tables_info, prompt_map,
                                      db_type=db_type,
-                                     enable_row_level_security=rls_enable, row_level_security_config=rls_config)
+                                     enable_row_level_security=rls_enable, row_level_security_config=rls_config,
+                                     result_cache_ttl=result_cache_ttl, result_max_rows=result_max_rows,
+                                     result_max_bytes=result_max_bytes, chart_recommender=chart_recommender)
         cls.profile_config_dao.update(entity)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
     def update_prompt_map(cls, profile_name, prompt_map):
-        profile_info = ProfileManagement.get_profile_by_name(profile_name)
+        profile_info = cls.profile_config_dao.get_by_name(profile_name)
         entity = ProfileConfigEntity(profile_name, profile_info.conn_name, profile_info.schemas, profile_info.tables, profile_info.comments,
                                      tables_info=profile_info.tables_info, prompt_map=prompt_map,
                                      db_type=profile_info.db_type,
                                      enable_row_level_security=profile_info.enable_row_level_security,
-                                     row_level_security_config=profile_info.row_level_security_config)
+                                     row_level_security_config=profile_info.row_level_security_config,
+                                     result_cache_ttl=profile_info.result_cache_ttl,
+                                     result_max_rows=profile_info.result_max_rows,
+                                     result_max_bytes=profile_info.result_max_bytes,
+                                     chart_recommender=profile_info.chart_recommender)
         cls.profile_config_dao.update(entity)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
     def delete_profile(cls, profile_name):
         cls.profile_config_dao.delete(profile_name)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
     def update_table_def(cls, profile_name, tables_info, merge_before_update=False):
         if merge_before_update:
-            old_profile = cls.get_profile_by_name(profile_name)
+            old_profile = cls.profile_config_dao.get_by_name(profile_name)
             old_tables_info = old_profile.tables_info
             if old_tables_info is not None:
                 # print(old_tables_info)
@@ -84,9 +172,11 @@ class ProfileManagement:
                 logger.info('tables info merged', tables_info)
 
         cls.profile_config_dao.update_table_def(profile_name, tables_info)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Table definition updated")
 
     @classmethod
     def update_table_prompt_map(cls, profile_name, prompt_map):
         cls.profile_config_dao.update_table_prompt_map(profile_name, prompt_map)
+        cls.invalidate_profile(profile_name)
         logger.info(f"System and user prompt updated")
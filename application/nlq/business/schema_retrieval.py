@@ -0,0 +1,218 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from nlq.business.answer_cache import normalize_embeddings
+from utils.logging import getLogger
+
+logger = getLogger()
+
+SCHEMA_PRUNING_ENABLED = os.getenv('SCHEMA_PRUNING_ENABLED', 'false').lower() == 'true'
+# profiles with fewer tables always get the full schema
+SCHEMA_PRUNING_MIN_TABLES = int(os.getenv('SCHEMA_PRUNING_MIN_TABLES', 20))
+SCHEMA_PRUNING_TOP_N = int(os.getenv('SCHEMA_PRUNING_TOP_N', 8))
+# the selection is only trusted when the best table has a raw BM25 score or a cosine similarity to the question of
+# at least these values, otherwise the full schema is used. A term shared by most tables, e.g. id, scores close to 0.
+SCHEMA_PRUNING_MIN_BM25 = float(os.getenv('SCHEMA_PRUNING_MIN_BM25', 2.0))
+SCHEMA_PRUNING_MIN_SIMILARITY = float(os.getenv('SCHEMA_PRUNING_MIN_SIMILARITY', 0.5))
+SCHEMA_PRUNING_EMBEDDING_WEIGHT = float(os.getenv('SCHEMA_PRUNING_EMBEDDING_WEIGHT', 0.6))
+SCHEMA_INDEX_MAX_PROFILES = int(os.getenv('SCHEMA_INDEX_MAX_PROFILES', 32))
+# seconds a profile uses a lexical only index after embedding its tables failed, before embedding them again
+SCHEMA_INDEX_RETRY_INTERVAL = int(os.getenv('SCHEMA_INDEX_RETRY_INTERVAL', 300))
+
+REFERENCES_PATTERN = re.compile(r'\bREFERENCES\s+[`"\[]?(?:\w+[`"\]]?\.)?[`"\[]?(\w+)', re.IGNORECASE)
+
+
+def tokenize(text) -> list:
+    """Lower case word tokens, snake_case and camelCase identifiers are also split into their parts"""
+    tokens = []
+    for word in re.findall(r'\w+', str(text)):
+        parts = re.findall(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+|[^\W_a-zA-Z\d]+', word)
+        tokens.append(word.lower())
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+
+def get_table_document(table_name, table_data) -> str:
+    """Text of a table used for retrieval: name, description or annotation, and column DDL or annotation"""
+    description = table_data.get('tbl_a') or table_data.get('description') or ''
+    columns = table_data.get('col_a') or table_data.get('ddl') or ''
+    return f"{table_name}\n{description}\n{columns}"
+
+
+def get_foreign_key_neighbours(tables_info) -> dict:
+    """Tables linked by a REFERENCES clause in either direction"""
+    table_names = {name.lower(): name for name in tables_info}
+    neighbours = {name: set() for name in tables_info}
+    for table_name, table_data in tables_info.items():
+        ddl = f"{table_data.get('ddl') or ''}\n{table_data.get('col_a') or ''}"
+        for referenced in REFERENCES_PATTERN.findall(ddl):
+            referenced_name = table_names.get(referenced.lower())
+            if referenced_name is not None and referenced_name != table_name:
+                neighbours[table_name].add(referenced_name)
+                neighbours[referenced_name].add(table_name)
+    return neighbours
+
+
+def get_tables_info_fingerprint(tables_info) -> str:
+    return hashlib.sha256(json.dumps(tables_info, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Bm25Index:
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        document_count = len(documents)
+        self.idf = {term: math.log(1 + (document_count - frequency + 0.5) / (frequency + 0.5))
+                    for term, frequency in document_frequency.items()}
+
+    def score(self, query) -> list:
+        query_terms = set(tokenize(query))
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            for term in query_terms:
+                frequency = counts.get(term)
+                if not frequency:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / self.average_length) if self.average_length else 0
+                score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+
+class SchemaIndex:
+    """
+    Hybrid lexical and embedding index over the tables of one profile, used to pick the tables that are
+    relevant to a question
+    """
+
+    def __init__(self, tables_info, embed_texts=None):
+        """
+        :param tables_info: tables_info of a profile, table name -> {ddl, description, tbl_a, col_a}
+        :param embed_texts: callable embedding a list of texts, None uses the lexical scores only
+        """
+        self.table_names = list(tables_info)
+        documents = [get_table_document(name, tables_info[name]) for name in self.table_names]
+        self.bm25 = Bm25Index(documents)
+        self.embeddings = normalize_embeddings(embed_texts(documents)) if embed_texts is not None else None
+        self.neighbours = get_foreign_key_neighbours(tables_info)
+        # set on a lexical only index built after embedding the tables failed
+        self.retry_at = None
+
+    def get_similarities(self, question_embedding):
+        """:return: cosine similarity of the question to each table, or None without embeddings"""
+        if self.embeddings is None or question_embedding is None or len(self.table_names) == 0:
+            return None
+        return self.embeddings @ normalize_embeddings(question_embedding)
+
+    def score(self, question, question_embedding=None) -> dict:
+        """
+        :return: table name -> score in [0, 1], a weighted sum of the max-normalized BM25 score and the cosine
+        similarity of the embeddings. The scores rank the tables, they are relative and not a confidence.
+        """
+        return self._score(self.bm25.score(question), self.get_similarities(question_embedding))
+
+    def _score(self, bm25_scores, similarities) -> dict:
+        max_bm25 = max(bm25_scores, default=0.0)
+        lexical_scores = [score / max_bm25 if max_bm25 > 0 else 0.0 for score in bm25_scores]
+        if similarities is None:
+            return dict(zip(self.table_names, lexical_scores))
+        weight = SCHEMA_PRUNING_EMBEDDING_WEIGHT
+        return {name: weight * max(float(similarity), 0.0) + (1 - weight) * lexical
+                for name, similarity, lexical in zip(self.table_names, similarities, lexical_scores)}
+
+    def select(self, question, question_embedding=None, top_n=None, min_bm25=None, min_similarity=None):
+        """
+        Pick the top_n matching tables and their foreign key neighbours
+        :param top_n: defaults to SCHEMA_PRUNING_TOP_N
+        :param min_bm25: defaults to SCHEMA_PRUNING_MIN_BM25
+        :param min_similarity: defaults to SCHEMA_PRUNING_MIN_SIMILARITY
+        :return: list of table names, or None if neither the best raw BM25 score nor the best cosine similarity
+        reaches its minimum
+        """
+        top_n = SCHEMA_PRUNING_TOP_N if top_n is None else top_n
+        min_bm25 = SCHEMA_PRUNING_MIN_BM25 if min_bm25 is None else min_bm25
+        min_similarity = SCHEMA_PRUNING_MIN_SIMILARITY if min_similarity is None else min_similarity
+        bm25_scores = self.bm25.score(question)
+        similarities = self.get_similarities(question_embedding)
+        lexical_match = max(bm25_scores, default=0.0) >= min_bm25
+        semantic_match = similarities is not None and float(np.max(similarities)) >= min_similarity
+        if not lexical_match and not semantic_match:
+            return None
+        scores = self._score(bm25_scores, similarities)
+        ranked = sorted(self.table_names, key=lambda name: scores[name], reverse=True)
+        selected = [name for name in ranked[:top_n] if scores[name] > 0]
+        for table_name in list(selected):
+            for neighbour in sorted(self.neighbours[table_name]):
+                if neighbour not in selected:
+                    selected.append(neighbour)
+        return selected
+
+
+schema_indexes = OrderedDict()
+schema_indexes_lock = threading.Lock()
+
+
+def get_schema_index(profile_name, tables_info, embed_texts=None) -> SchemaIndex:
+    """
+    Schema index of a profile, rebuilt when its tables_info changes. When embedding the tables fails, a lexical
+    only index is cached and the tables are embedded again after SCHEMA_INDEX_RETRY_INTERVAL.
+    """
+    key = (profile_name, get_tables_info_fingerprint(tables_info))
+    with schema_indexes_lock:
+        schema_index = schema_indexes.get(key)
+        if schema_index is not None and (schema_index.retry_at is None or time.monotonic() < schema_index.retry_at):
+            schema_indexes.move_to_end(key)
+            return schema_index
+    try:
+        schema_index = SchemaIndex(tables_info, embed_texts)
+    except Exception as e:
+        logger.error(f'embedding the tables of profile {profile_name} failed, using lexical schema pruning: {e}')
+        schema_index = SchemaIndex(tables_info)
+        schema_index.retry_at = time.monotonic() + SCHEMA_INDEX_RETRY_INTERVAL
+    with schema_indexes_lock:
+        for stale_key in [stale_key for stale_key in schema_indexes if stale_key[0] == profile_name]:
+            del schema_indexes[stale_key]
+        schema_indexes[key] = schema_index
+        while len(schema_indexes) > SCHEMA_INDEX_MAX_PROFILES:
+            schema_indexes.popitem(last=False)
+    return schema_index
+
+
+def prune_tables_info(profile_name, tables_info, question, embed_texts=None, embed_documents=None):
+    """
+    Keep the tables of a profile that are relevant to the question, falling back to the full tables_info when
+    pruning is disabled, the profile is small, or no table is a confident match
+    :param embed_texts: callable embedding a list of questions, e.g. create_vector_embedding_batch
+    :param embed_documents: callable embedding the table documents, e.g. create_document_embedding_batch which
+    keeps them out of the question embedding cache, defaults to embed_texts
+    :return: tables_info restricted to the selected tables
+    """
+    if not SCHEMA_PRUNING_ENABLED or not tables_info or len(tables_info) < SCHEMA_PRUNING_MIN_TABLES:
+        return tables_info
+    try:
+        schema_index = get_schema_index(profile_name, tables_info, embed_documents or embed_texts)
+        question_embedding = embed_texts([question])[0] \
+            if embed_texts is not None and schema_index.embeddings is not None else None
+        selected = schema_index.select(question, question_embedding)
+    except Exception as e:
+        logger.error(f'schema pruning failed, using the full schema: {e}')
+        return tables_info
+    if selected is None:
+        logger.info(f'no confident table match for {question=}, using the full schema')
+        return tables_info
+    logger.info(f'schema pruned to {len(selected)} of {len(tables_info)} tables: {selected}')
+    return {table_name: tables_info[table_name] for table_name in selected}
@@ -1,9 +1,14 @@
 import boto3
 import json
+from nlq.business.bulk_ingestion import ingest_in_chunks, iter_chunks
+from nlq.business.dimension_values import plan_dimension_refresh
 from nlq.data_access.opensearch import OpenSearchDao
+from nlq.data_access.opensearch_documents import build_sample_record, build_entity_record, get_document_id, \
+    merge_entity_table_info, build_dimension_values_update
 from utils.env_var import BEDROCK_REGION, AOS_HOST, AOS_PORT, AOS_USER, AOS_PASSWORD, opensearch_info, embedding_info
 from utils.env_var import bedrock_ak_sk_info
-from utils.llm import invoke_model_sagemaker_endpoint
+from utils.embedding_cache import get_embedding_cache
+from utils.llm import invoke_model_sagemaker_endpoint, create_document_embedding_batch
 from utils.logging import getLogger
 
 logger = getLogger()
@@ -76,9 +81,7 @@ class VectorStore:
     def add_sample(cls, profile_name, question, answer):
         logger.info(f'add sample question: {question} to profile {profile_name}')
         embedding = cls.create_vector_embedding(question)
-        has_same_sample = cls.search_same_query(profile_name, 1, opensearch_info['sql_index'], embedding)
-        if has_same_sample:
-            logger.info(f'delete sample sample entity: {question} to profile {profile_name}')
+        # the document id is derived from the question, a sample with the same question is overwritten
         if cls.opensearch_dao.add_sample(opensearch_info['sql_index'], profile_name, question, answer, embedding):
             logger.info('Sample added')
 
@@ -86,29 +89,16 @@ class VectorStore:
     def add_entity_sample(cls, profile_name, entity, comment, entity_type="metrics"):
         logger.info(f'add sample entity: {entity} to profile {profile_name}')
         embedding = cls.create_vector_embedding(entity)
-        has_same_sample = cls.search_same_query(profile_name, 5, opensearch_info['ner_index'], embedding)
-        if has_same_sample:
-            logger.info(f'delete sample sample entity: {entity} to profile {profile_name}')
         if cls.opensearch_dao.add_entity_sample(opensearch_info['ner_index'], profile_name, entity, comment, embedding,
                                                 entity_type):
             logger.info('Sample added')
 
     @classmethod
     def add_entity_dimension_batch_sample(cls, profile_name, entity, comment, entity_type="dimension", entity_info=[]):
-        entity_value_set = set()
-        for entity_table in entity_info:
-            entity_value_set.add(
-                entity_table["table_name"] + "#" + entity_table["column_name"] + "#" + entity_table["value"])
         logger.info(f'add sample entity: {entity} to profile {profile_name}')
         embedding = cls.create_vector_embedding(entity)
-        same_dimension_value = cls.search_same_dimension_entity(profile_name, 5, opensearch_info['ner_index'],
-                                                                embedding)
-        if len(same_dimension_value) > 0:
-            for dimension_value in same_dimension_value:
-                entity_special_id = dimension_value["table_name"] + "#" + dimension_value["column_name"] + "#" + \
-                                    dimension_value["value"]
-                if entity_special_id not in entity_value_set:
-                    entity_info.append(dimension_value)
+        indexed_entities = cls.get_indexed_dimension_values(profile_name, [entity])
+        entity_info = merge_entity_table_info(entity_info, indexed_entities.get(entity))
         logger.info("entity_table_info: " + str(entity_info))
         if cls.opensearch_dao.add_entity_sample(opensearch_info['ner_index'], profile_name, entity, comment, embedding,
                                                 entity_type, entity_info):
@@ -118,20 +108,149 @@ class VectorStore:
     def add_agent_cot_sample(cls, profile_name, entity, comment):
         logger.info(f'add agent sample query: {entity} to profile {profile_name}')
         embedding = cls.create_vector_embedding(entity)
-        has_same_sample = cls.search_same_query(profile_name, 1, opensearch_info['agent_index'], embedding)
-        if has_same_sample:
-            logger.info(f'delete agent sample sample query: {entity} to profile {profile_name}')
         if cls.opensearch_dao.add_agent_cot_sample(opensearch_info['agent_index'], profile_name, entity, comment,
                                                    embedding):
             logger.info('Sample added')
 
+    @classmethod
+    def add_samples_bulk(cls, profile_name, samples, on_progress=None):
+        """
+        Add many question and SQL samples with batched embeddings and bulk writes. Like add_sample, a sample with
+        the same question overwrites the indexed one.
+        :param samples: list of (question, sql)
+        :param on_progress: optional callable receiving the IngestionReport after every chunk
+        :return: IngestionReport
+        """
+        index_name = opensearch_info['sql_index']
+
+        def write_chunk(chunk, embeddings):
+            records = [build_sample_record(index_name, profile_name, question, sql, embedding)
+                       for (question, sql), embedding in zip(chunk, embeddings)]
+            return cls.write_documents(records)
+
+        logger.info(f'add {len(samples)} samples to profile {profile_name}')
+        return ingest_in_chunks(samples, lambda sample: sample[0], create_document_embedding_batch, write_chunk,
+                                on_progress=on_progress)
+
+    @classmethod
+    def add_entity_samples_bulk(cls, profile_name, entities, entity_type="metrics", on_progress=None):
+        """
+        Bulk version of add_entity_sample
+        :param entities: list of (entity, comment)
+        :return: IngestionReport
+        """
+        index_name = opensearch_info['ner_index']
+
+        def write_chunk(chunk, embeddings):
+            records = [build_entity_record(index_name, profile_name, entity, comment, embedding, entity_type)
+                       for (entity, comment), embedding in zip(chunk, embeddings)]
+            return cls.write_documents(records)
+
+        logger.info(f'add {len(entities)} entities to profile {profile_name}')
+        return ingest_in_chunks(entities, lambda entity: entity[0], create_document_embedding_batch, write_chunk,
+                                on_progress=on_progress)
+
+    @classmethod
+    def add_entity_dimension_samples_bulk(cls, profile_name, entities, entity_type="dimension", on_progress=None):
+        """
+        Bulk version of add_entity_dimension_batch_sample, the dimension values of the indexed document of an
+        entity are merged into the new one
+        :param entities: list of (entity, entity_table_info)
+        :return: IngestionReport
+        """
+        index_name = opensearch_info['ner_index']
+
+        def write_chunk(chunk, embeddings):
+            indexed_entities = cls.get_indexed_dimension_values(profile_name, [entity for entity, _ in chunk])
+            records = [build_entity_record(index_name, profile_name, entity, "", embedding, entity_type,
+                                           merge_entity_table_info(entity_info, indexed_entities.get(entity)))
+                       for (entity, entity_info), embedding in zip(chunk, embeddings)]
+            return cls.write_documents(records)
+
+        logger.info(f'add {len(entities)} dimension entities to profile {profile_name}')
+        return ingest_in_chunks(entities, lambda entity: entity[0], create_document_embedding_batch, write_chunk,
+                                on_progress=on_progress)
+
+    @classmethod
+    def refresh_entity_dimension_values(cls, profile_name, entities, on_progress=None):
+        """
+        Incremental version of add_entity_dimension_samples_bulk for values read from the database: only entities
+        that are not indexed yet are embedded, new values of indexed dimension entities are added with partial
+        updates that keep the embedding
+        :param entities: dict of entity_table_info by entity, see group_dimension_values
+        :param on_progress: optional callable receiving the IngestionReport of the new entities after every chunk
+        :return: summary dict of the refresh
+        """
+        index_name = opensearch_info['ner_index']
+        plan = plan_dimension_refresh(entities, cls.get_indexed_entities(profile_name, list(entities)))
+        logger.info(f'refresh dimension values of profile {profile_name}: {plan}')
+
+        update_actions = [build_dimension_values_update(index_name, profile_name, entity, entity_info)
+                          for entity, entity_info in plan.updates]
+        updated, failed_updates, _ = cls.opensearch_dao.bulk_write(update_actions)
+
+        def write_chunk(chunk, embeddings):
+            records = [build_entity_record(index_name, profile_name, entity, "", embedding, "dimension", entity_info)
+                       for (entity, entity_info), embedding in zip(chunk, embeddings)]
+            return cls.write_documents(records)
+
+        report = ingest_in_chunks(plan.new, lambda entity: entity[0], create_document_embedding_batch, write_chunk,
+                                  on_progress=on_progress)
+        return {
+            'entities': len(entities),
+            'indexed': report.indexed,
+            'updated': updated,
+            'unchanged': plan.unchanged,
+            'conflicts': len(plan.conflicts),
+            'failed': report.failed + len(failed_updates)
+        }
+
+    @classmethod
+    def get_indexed_entities(cls, profile_name, entities, chunk_size=1000):
+        """
+        Indexed documents of entities, looked up by document id
+        :return: dict of the _source with entity_type and entity_table_info by entity
+        """
+        indexed_entities = {}
+        for chunk in iter_chunks(entities, chunk_size):
+            doc_ids = {get_document_id(profile_name, entity): entity for entity in chunk}
+            documents = cls.opensearch_dao.get_documents(opensearch_info['ner_index'], list(doc_ids),
+                                                         ['entity_type', 'entity_table_info'])
+            for doc_id, document in documents.items():
+                indexed_entities[doc_ids[doc_id]] = document
+        return indexed_entities
+
+    @classmethod
+    def get_indexed_dimension_values(cls, profile_name, entities):
+        """
+        Dimension values of the indexed documents of entities
+        :return: dict of entity_table_info by entity, only for indexed dimension entities
+        """
+        return {entity: document.get('entity_table_info', [])
+                for entity, document in cls.get_indexed_entities(profile_name, entities).items()
+                if document.get('entity_type') == 'dimension'}
+
+    @classmethod
+    def write_documents(cls, records):
+        """
+        Write records with their deterministic ids, a record overwrites the indexed document of the same text
+        :return: indexed count, replaced count, failed count
+        """
+        success, failed, updated = cls.opensearch_dao.bulk_write(records)
+        return success, updated, len(failed)
+
     @classmethod
     def create_vector_embedding(cls, text):
         model_name = embedding_info["embedding_name"]
-        if embedding_info["embedding_platform"] == "bedrock":
-            return cls.create_vector_embedding_with_bedrock(text, model_name)
-        else:
-            return cls.create_vector_embedding_with_sagemaker(text, model_name)
+
+        def create_embedding(input_text):
+            if embedding_info["embedding_platform"] == "bedrock":
+                return cls.create_vector_embedding_with_bedrock(input_text, model_name)
+            else:
+                return cls.create_vector_embedding_with_sagemaker(input_text, model_name)
+
+        return get_embedding_cache().get_or_create(model_name, embedding_info["embedding_dimension"], text,
+                                                   create_embedding)
 
     @classmethod
     def create_vector_embedding_with_bedrock(cls, text, model_name):
@@ -193,41 +312,3 @@ class VectorStore:
     def search_sample_with_embedding(cls, profile_name, top_k, index_name, query_embedding):
         sample_list = cls.opensearch_dao.search_sample_with_embedding(profile_name, top_k, index_name, query_embedding)
         return sample_list
-
-    @classmethod
-    def search_same_query(cls, profile_name, top_k, index_name, embedding):
-        search_res = cls.search_sample_with_embedding(profile_name, top_k, index_name, embedding)
-        if len(search_res) > 0:
-            similarity_sample = search_res[0]
-            similarity_score = similarity_sample["_score"]
-            similarity_id = similarity_sample['_id']
-            if similarity_score == 1.0:
-                if index_name == opensearch_info['sql_index']:
-                    cls.delete_sample(profile_name, similarity_id)
-                    return True
-                elif index_name == opensearch_info['ner_index']:
-                    cls.delete_entity_sample(profile_name, similarity_id)
-                    return True
-                elif index_name == opensearch_info['agent_index']:
-                    cls.delete_agent_cot_sample(profile_name, similarity_id)
-                    return True
-                else:
-                    return False
-        return False
-
-    @classmethod
-    def search_same_dimension_entity(cls, profile_name, top_k, index_name, embedding):
-        search_res = cls.search_sample_with_embedding(profile_name, top_k, index_name, embedding)
-        same_dimension_value = []
-        if len(search_res) > 0:
-            for i in range(len(search_res)):
-                similarity_sample = search_res[i]
-                similarity_score = similarity_sample["_score"]
-                if similarity_score == 1.0:
-                    if similarity_sample["_source"]["entity_type"] == "dimension":
-                        entity_table_info = similarity_sample["_source"]["entity_table_info"]
-                        for each in entity_table_info:
-                            same_dimension_value.append(each)
-                    sample_id = similarity_sample['_id']
-                    VectorStore.delete_entity_sample(profile_name, sample_id)
-        return same_dimension_value
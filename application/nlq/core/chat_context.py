@@ -26,3 +26,4 @@ class ProcessingContext:
     previous_state: str = "INITIAL"
     entity_retrieval: List[str] = field(default_factory=list)
     entity_user_select: List[str] = field(default_factory=list)
+    speculative_retrieval_flag: bool = False
@@ -3,18 +3,31 @@ import string
 import functools
 import pandas as pd
 
+from api.enum import ContentEnum
 from api.schemas import Answer, KnowledgeSearchResult, SQLSearchResult, AgentSearchResult, AskReplayResult, \
     AskEntitySelect, ChartEntity, TaskSQLSearchResult
+from nlq.business.answer_cache import ANSWER_CACHE_ENABLED, ANSWER_CACHE_REEXECUTE_SQL, get_answer_cache, \
+    get_profile_fingerprint, get_rls_identity
 from nlq.business.datasource.factory import DataSourceFactory
+from nlq.business.intent_classifier import INTENT_CLASSIFIER_MODE, classify_intent, intent_classifier_stats, \
+    is_intent_classifier_enabled
 from nlq.business.log_store import LogManagement
+from nlq.business.schema_retrieval import prune_tables_info
 from nlq.core.chat_context import ProcessingContext
 from nlq.core.state import QueryState
 from utils.apis import get_sql_result_tool
+from utils.async_executor import get_task_executor, get_model_semaphore, map_in_order
+from utils.bedrock_prompt_cache import add_token_info
+from utils.chart_recommender import is_chart_recommender_enabled
 from utils.llm import get_query_intent, get_query_rewrite, knowledge_search, text_to_sql, data_analyse_tool, \
-    generate_suggested_question, get_agent_cot_task, data_visualization
+    generate_suggested_question, get_agent_cot_task, data_visualization, create_vector_embedding, \
+    create_vector_embedding_batch, create_document_embedding_batch
+from utils.env_var import embedding_info
 from utils.logging import getLogger
 from utils.opensearch import get_retrieve_opensearch
-from utils.text_search import entity_retrieve_search, qa_retrieve_search, agent_text_search
+from utils.text_search import entity_retrieve_search, entity_qa_retrieve_search, qa_retrieve_search, \
+    agent_text_search, speculative_retrieve_search, dedupe_entity_retrieve
+from utils.sql_stream import SqlStreamParser, SQL_OVERLAPPED_EXECUTION
 from utils.tool import get_generated_sql, get_generated_sql_explain, change_class_to_str, get_current_time
 
 logger = getLogger()
@@ -72,9 +85,15 @@ class QueryStateMachine:
 
         self.intent_search_result = {}
         self.intent_response = {}
+        # llm, classifier or cache, logged so that only LLM decided intents train the local classifier
+        self.intent_source = ""
         self.entity_slot = []
         self.normal_search_entity_slot = []
         self.normal_search_qa_retrival = []
+        self.prefetched_qa_retrival = None
+        self.speculative_entity_retrieval = None
+        self.answer_cache_embedding = None
+        self.answer_cache_hit = False
         self.agent_cot_retrieve = []
         self.agent_task_split = {}
         self.agent_search_result = []
@@ -82,6 +101,7 @@ class QueryStateMachine:
         self.agent_valid_data = []
         self.use_auto_correction_flag = False
         self.first_sql_execute_info = {}
+        self.early_sql_execution = None
         self.token_info = {}
 
     def transition(self, new_state):
@@ -222,7 +242,19 @@ class QueryStateMachine:
 
     def _perform_entity_retrieval(self):
         if self.context.use_rag_flag:
-            return entity_retrieve_search(self.entity_slot, self.context.opensearch_info, self.context.selected_profile)
+            matched_entity = []
+            entity_slot = self.entity_slot
+            if self.speculative_entity_retrieval is not None:
+                matched_entity, entity_slot = self._match_speculative_entity(self.entity_slot)
+            if self.prefetched_qa_retrival is None:
+                # QA samples are fetched in the same round trip and reused by handle_qa_retrieval
+                entity_slot_retrieve, self.prefetched_qa_retrival = entity_qa_retrieve_search(
+                    entity_slot, self.context.query_rewrite, self.context.opensearch_info,
+                    self.context.selected_profile)
+            else:
+                entity_slot_retrieve = entity_retrieve_search(entity_slot, self.context.opensearch_info,
+                                                              self.context.selected_profile)
+            return dedupe_entity_retrieve([matched_entity, entity_slot_retrieve])
         else:
             return []
 
@@ -237,14 +269,20 @@ class QueryStateMachine:
             self.transition(QueryState.ERROR)
 
     def _perform_qa_retrieval(self):
+        if self.prefetched_qa_retrival is not None:
+            return self.prefetched_qa_retrival
         if self.context.use_rag_flag:
             return qa_retrieve_search(self.context.query_rewrite, self.context.opensearch_info,
                                       self.context.selected_profile)
         return []
 
     @log_execution
-    def handle_sql_generation(self):
-        sql, response, original_sql = self._generate_sql()
+    def handle_sql_generation(self, stream_callback=None):
+        """
+        :param stream_callback: callable(ContentEnum, content), when given the completion is streamed as SQL_STREAM
+        text deltas, followed by a SQL message as soon as the SQL block is closed
+        """
+        sql, response, original_sql = self._generate_sql(stream_callback)
         self.intent_search_result["sql"] = sql
         self.intent_search_result["response"] = response
         self.intent_search_result["original_sql"] = original_sql
@@ -264,16 +302,51 @@ class QueryStateMachine:
         )
         return post_sql
 
-    def _generate_sql(self):
+    def _get_prompt_tables_info(self):
+        """Tables of the profile that are relevant to the question, see prune_tables_info"""
+        return prune_tables_info(self.context.selected_profile, self.context.database_profile['tables_info'],
+                                 self.context.query_rewrite, create_vector_embedding_batch,
+                                 create_document_embedding_batch)
+
+    def _get_sql_stream_handler(self, stream_callback, overlapped_execution):
+        """
+        :param stream_callback: forwards the stream to the client, may be None
+        :param overlapped_execution: execute the SQL on the task pool as soon as its block is closed
+        """
+        parser = SqlStreamParser()
+
+        def on_text(text):
+            if stream_callback is not None:
+                stream_callback(ContentEnum.SQL_STREAM, text)
+            sql = parser.feed(text)
+            if sql is None:
+                return
+            post_sql = self._apply_row_level_security_for_sql(sql)
+            if overlapped_execution and post_sql.strip() != "":
+                logger.info("sql block closed, executing while the explanation is generated")
+                self.early_sql_execution = (post_sql, get_task_executor().submit(self._execute_sql, post_sql))
+            if stream_callback is not None:
+                stream_callback(ContentEnum.SQL, post_sql.strip())
+
+        return on_text
+
+    def _generate_sql(self, stream_callback=None):
         try:
-            response, model_response = text_to_sql(self.context.database_profile['tables_info'],
+            overlapped_execution = SQL_OVERLAPPED_EXECUTION and self.context.visualize_results_flag
+            on_text = None
+            if stream_callback is not None or overlapped_execution:
+                on_text = self._get_sql_stream_handler(stream_callback, overlapped_execution)
+            response, model_response = text_to_sql(self._get_prompt_tables_info(),
                                                    self.context.database_profile['hints'],
                                                    self.context.database_profile['prompt_map'],
                                                    self.context.query_rewrite,
                                                    model_id=self.context.model_type,
                                                    sql_examples=self.normal_search_qa_retrival,
                                                    ner_example=self.normal_search_entity_slot,
-                                                   dialect=self.context.database_profile['db_type'])
+                                                   dialect=self.context.database_profile['db_type'],
+                                                   profile_version=self.context.database_profile.get('profile_version'),
+                                                   with_response_stream=on_text is not None,
+                                                   on_text=on_text)
             self.token_info[QueryState.SQL_GENERATION.name] = model_response.token_info
             sql = get_generated_sql(response)
             # post-processing the sql
@@ -286,7 +359,7 @@ class QueryStateMachine:
 
     def _generate_sql_again(self):
         try:
-            response, model_response = text_to_sql(self.context.database_profile['tables_info'],
+            response, model_response = text_to_sql(self._get_prompt_tables_info(),
                                                    self.context.database_profile['hints'],
                                                    self.context.database_profile['prompt_map'],
                                                    self.context.query_rewrite,
@@ -295,6 +368,7 @@ class QueryStateMachine:
                                                    ner_example=self.normal_search_entity_slot,
                                                    dialect=self.context.database_profile['db_type'],
                                                    model_provider=None,
+                                                   profile_version=self.context.database_profile.get('profile_version'),
                                                    additional_info='''\n NOTE: when I try to write a SQL <sql>{sql_statement}</sql>, I got an error <error>{error}</error>. Please consider and avoid this problem. '''.format(
                                                        sql_statement=self.intent_search_result["original_sql"],
                                                        error=self.intent_search_result["sql_execute_result"][
@@ -323,21 +397,164 @@ class QueryStateMachine:
     @log_execution
     def handle_intent_recognition(self):
         try:
+            if self._lookup_answer_cache():
+                return
             if self.context.intent_ner_recognition_flag:
+                speculative_future = self._start_speculative_retrieval()
+                local_prediction = self._classify_intent_locally()
+                if local_prediction is not None and local_prediction.confident and INTENT_CLASSIFIER_MODE == 'on' \
+                        and self._can_skip_intent_llm(local_prediction.intent):
+                    self._apply_local_intent(local_prediction.intent, speculative_future)
+                    return
                 intent_response, model_response = get_query_intent(self.context.model_type, self.context.query_rewrite,
                                                                    self.context.database_profile['prompt_map'])
                 self.token_info[QueryState.INTENT_RECOGNITION.name] = model_response.token_info
                 self.intent_response = intent_response
+                self.intent_source = "llm"
+                if local_prediction is not None and local_prediction.confident:
+                    intent_classifier_stats.record_comparison(local_prediction.intent,
+                                                              intent_response.get("intent", "normal_search"))
+                    logger.info(f"intent classifier shadow stats: {intent_classifier_stats.stats()}")
                 self._process_intent_response(intent_response)
+                self._transition_based_on_intent()
+                self._resolve_speculative_retrieval(speculative_future)
             else:
                 self.search_intent_flag = True
-            self._transition_based_on_intent()
+                self._transition_based_on_intent()
         except Exception as e:
             self.answer.error_log[QueryState.INTENT_RECOGNITION.name] = str(e)
             logger.error(
                 f"The context is {self.context.search_box}, handle_intent_recognition encountered an error: {e}")
             self.transition(QueryState.ERROR)
 
+    def _classify_intent_locally(self):
+        """
+        Nearest neighbour intent of the question among the labelled questions of the query log of the profile
+        :return: IntentPrediction, or None when the classifier is off, not built yet or fails
+        """
+        if not is_intent_classifier_enabled():
+            return None
+        try:
+            embedding = create_vector_embedding(self.context.query_rewrite,
+                                                index_name=self.context.opensearch_info['sql_index'])['vector_field']
+            return classify_intent(self.context.selected_profile, embedding, LogManagement.get_intent_examples,
+                                   create_vector_embedding_batch)
+        except Exception as e:
+            logger.warning(f"local intent classification failed, fall back to the LLM: {e}")
+            return None
+
+    def _can_skip_intent_llm(self, intent):
+        """
+        Only intents that do not continue with entity retrieval skip the intent LLM call, the LLM also extracts
+        the entity slots of a search question
+        """
+        if intent == "agent_search":
+            return self.context.agent_cot_flag
+        return intent in ("reject_search", "knowledge_search")
+
+    def _apply_local_intent(self, intent, speculative_future):
+        """Route a confidently classified reject, knowledge or agent question without the intent LLM call"""
+        logger.info(f"intent {intent} of {self.context.query_rewrite} resolved locally")
+        self.intent_response = {"intent": intent, "slot": []}
+        self.intent_source = "classifier"
+        self._process_intent_response(self.intent_response)
+        self._transition_based_on_intent()
+        self._resolve_speculative_retrieval(speculative_future)
+
+    def _get_answer_cache_key(self):
+        partition_key = (self.context.selected_profile, self.context.model_type, embedding_info["embedding_name"],
+                         get_rls_identity(self.context.database_profile, self.context.username),
+                         self.context.visualize_results_flag, self.context.data_with_analyse,
+                         self.context.use_rag_flag, self.context.agent_cot_flag)
+        return partition_key, get_profile_fingerprint(self.context.database_profile)
+
+    def _lookup_answer_cache(self):
+        """
+        Serve the answer of a semantically equal earlier question, skipping intent, retrieval, SQL generation
+        and visualization. The query embedding is kept to store the answer of this question on a miss.
+        """
+        if not ANSWER_CACHE_ENABLED:
+            return False
+        try:
+            self.answer_cache_embedding = create_vector_embedding(
+                self.context.query_rewrite, index_name=self.context.opensearch_info['sql_index'])['vector_field']
+            partition_key, fingerprint = self._get_answer_cache_key()
+            cached_answer, similarity = get_answer_cache().lookup(partition_key, fingerprint,
+                                                                  self.answer_cache_embedding)
+        except Exception as e:
+            logger.warning(f"answer cache lookup failed: {e}")
+            return False
+        if cached_answer is None:
+            return False
+
+        logger.info(f"answer cache hit for {self.context.query_rewrite}, similarity {similarity:.4f}")
+        cached_answer.query = self.context.search_box
+        cached_answer.query_rewrite = self.context.query_rewrite
+        self.answer = cached_answer
+        self.answer_cache_hit = True
+        self.intent_source = "cache"
+        self.search_intent_flag = True
+        if ANSWER_CACHE_REEXECUTE_SQL and cached_answer.sql_search_result.sql:
+            # same keys as SQL generation fills, the auto correction of a failed query reads them
+            self.intent_search_result["sql"] = cached_answer.sql_search_result.sql
+            self.intent_search_result["original_sql"] = cached_answer.sql_search_result.sql
+            self.intent_search_result["response"] = cached_answer.sql_search_result.sql_gen_process or ""
+            self.transition(QueryState.EXECUTE_QUERY)
+        else:
+            self.transition(QueryState.COMPLETE)
+        return True
+
+    def _store_answer_cache(self):
+        if self.answer_cache_hit or self.answer_cache_embedding is None or len(self.answer.error_log) > 0:
+            return
+        try:
+            partition_key, fingerprint = self._get_answer_cache_key()
+            get_answer_cache().put(partition_key, fingerprint, self.context.query_rewrite,
+                                   self.answer_cache_embedding, self.answer)
+        except Exception as e:
+            logger.warning(f"answer cache store failed: {e}")
+
+    def _start_speculative_retrieval(self):
+        """
+        Most questions are normal_search, so in speculative mode QA retrieval and an entity guess for the whole
+        question run while the intent LLM call is in flight
+        """
+        if not (self.context.speculative_retrieval_flag and self.context.use_rag_flag):
+            return None
+        return get_task_executor().submit(speculative_retrieve_search, self.context.query_rewrite,
+                                          self.context.opensearch_info, self.context.selected_profile)
+
+    def _resolve_speculative_retrieval(self, speculative_future):
+        if speculative_future is None:
+            return
+        if self.get_state() != QueryState.ENTITY_RETRIEVAL:
+            # reject, knowledge and agent intents do not use the normal search retrieval
+            speculative_future.cancel()
+            logger.info(f"discard speculative retrieval for intent {self.answer.query_intent}")
+            return
+        try:
+            self.speculative_entity_retrieval, self.prefetched_qa_retrival = speculative_future.result()
+        except Exception as e:
+            logger.warning(f"speculative retrieval failed, fall back to sequential retrieval: {e}")
+
+    def _match_speculative_entity(self, entity_slot):
+        """
+        Split the slots into those already found by the speculative entity guess and those still to retrieve
+        :return: matched entity retrieve, remaining slots
+        """
+        guess_by_name = {}
+        for each_entity in self.speculative_entity_retrieval:
+            guess_by_name.setdefault(each_entity['_source']['entity'].strip().lower(), each_entity)
+        matched_entity = []
+        remaining_slot = []
+        for each_slot in entity_slot:
+            each_entity = guess_by_name.get(str(each_slot).strip().lower())
+            if each_entity is not None:
+                matched_entity.append(each_entity)
+            else:
+                remaining_slot.append(each_slot)
+        return matched_entity, remaining_slot
+
     def _process_intent_response(self, intent_response):
         intent = intent_response.get("intent", "normal_search")
         self.entity_slot = intent_response.get("slot", [])
@@ -414,9 +631,11 @@ class QueryStateMachine:
     def handle_execute_query(self):
         try:
             sql = self.intent_search_result.get("sql", "")
-            sql_execute_result = self._execute_sql(sql)
+            sql_execute_result = self._get_early_sql_execute_result(sql)
+            if sql_execute_result is None:
+                sql_execute_result = self._execute_sql(sql)
             self.intent_search_result["sql_execute_result"] = sql_execute_result
-            self.answer.sql_search_result.sql_data = sql_execute_result["data"]
+            self._set_sql_execute_result(sql_execute_result)
             if self.context.data_with_analyse and sql_execute_result["status_code"] == 200:
                 self.transition(QueryState.ANALYZE_DATA)
             elif sql_execute_result["status_code"] == 200:
@@ -429,7 +648,7 @@ class QueryStateMachine:
                 self.answer.sql_search_result.sql = sql
                 self.answer.sql_search_result.sql_gen_process = get_generated_sql_explain(response)
                 self.intent_search_result["sql_execute_result"] = sql_execute_result
-                self.answer.sql_search_result.sql_data = sql_execute_result["data"]
+                self._set_sql_execute_result(sql_execute_result)
                 if self.context.data_with_analyse and sql_execute_result["status_code"] == 200:
                     self.transition(QueryState.ANALYZE_DATA)
                 elif sql_execute_result["status_code"] == 200:
@@ -445,6 +664,22 @@ class QueryStateMachine:
             logger.error(f"The context is {self.context.search_box}, handle_execute_query encountered an error: {e}")
             self.transition(QueryState.ERROR)
 
+    def _set_sql_execute_result(self, sql_execute_result):
+        self.answer.sql_search_result.sql_data = sql_execute_result["data"]
+        self.answer.sql_search_result.truncated = sql_execute_result.get("truncated", False)
+        self.answer.sql_search_result.total_row_estimate = sql_execute_result.get("total_row_estimate")
+
+    def _get_early_sql_execute_result(self, sql):
+        """Result of the execution started while the SQL explanation was still generating, None if there is none"""
+        early_sql_execution, self.early_sql_execution = self.early_sql_execution, None
+        if early_sql_execution is None:
+            return None
+        early_sql, future = early_sql_execution
+        if early_sql != sql:
+            logger.warning("the final sql differs from the streamed sql block, executing it again")
+            return None
+        return future.result()
+
     def _execute_sql(self, sql):
         if sql == "":
             return {"data": pd.DataFrame(), "sql": sql, "status_code": 500, "error_info": "The SQL is empty."}
@@ -482,7 +717,9 @@ class QueryStateMachine:
                                                                        self.context.database_profile["prompt_map"],
                                                                        self.context.query_rewrite,
                                                                        self.context.database_profile['tables_info'],
-                                                                       self.agent_cot_retrieve)
+                                                                       self.agent_cot_retrieve,
+                                                                       self.context.database_profile.get(
+                                                                           'profile_version'))
             self.token_info[QueryState.AGENT_TASK.name] = model_response.token_info
             self.agent_task_split = agent_cot_task_result
             self.transition(QueryState.AGENT_SEARCH)
@@ -497,24 +734,28 @@ class QueryStateMachine:
         try:
             filter_deep_dive_sql_result = []
             agent_sql_search_result = []
-            for i in range(len(self.agent_search_result)):
-                each_task_res = get_sql_result_tool(
-                    self.context.database_profile,
-                    self.agent_search_result[i]["sql"])
+            task_results = map_in_order(
+                lambda each_task: get_sql_result_tool(self.context.database_profile, each_task["sql"]),
+                self.agent_search_result)
+            for each_task, (each_task_res, error) in zip(self.agent_search_result, task_results):
+                if error is not None:
+                    logger.error(f"agent sub-task SQL {each_task['sql']} failed: {error}")
+                    continue
                 if each_task_res["status_code"] == 200 and len(each_task_res["data"]) > 0:
-                    self.agent_search_result[i]["data_result"] = each_task_res["data"].to_json(
-                        orient='records')
-                    filter_deep_dive_sql_result.append(self.agent_search_result[i])
+                    each_task["data_result"] = each_task_res["data"].to_json(orient='records')
+                    filter_deep_dive_sql_result.append(each_task)
 
                     show_select_data = [list(each_task_res["data"].columns)] + each_task_res["data"].values.tolist()
-                    each_task_sql_response = get_generated_sql_explain(self.agent_search_result[i]["response"])
+                    each_task_sql_response = get_generated_sql_explain(each_task["response"])
                     sub_task_sql_result = SQLSearchResult(sql_data=show_select_data,
-                                                          sql=self.agent_search_result[i]["sql"],
+                                                          sql=each_task["sql"],
                                                           data_show_type="table",
                                                           sql_gen_process=each_task_sql_response,
-                                                          data_analyse="", sql_data_chart=[])
+                                                          data_analyse="", sql_data_chart=[],
+                                                          truncated=each_task_res["truncated"],
+                                                          total_row_estimate=each_task_res["total_row_estimate"])
                     each_task_sql_search_result = TaskSQLSearchResult(
-                        sub_task_query=self.agent_search_result[i]["query"],
+                        sub_task_query=each_task["query"],
                         sql_search_result=sub_task_sql_result)
                     agent_sql_search_result.append(each_task_sql_search_result)
 
@@ -555,12 +796,16 @@ class QueryStateMachine:
 
     def handle_data_visualization(self):
         try:
+            if self.answer_cache_hit and not ANSWER_CACHE_REEXECUTE_SQL:
+                # the cached answer is already visualized
+                return
             if self.answer.query_intent == "normal_search":
                 model_select_type, show_select_data, select_chart_type, show_chart_data, model_response = data_visualization(
                     self.context.model_type,
                     self.context.query_rewrite,
                     self.get_answer().sql_search_result.sql_data,
-                    self.context.database_profile['prompt_map'])
+                    self.context.database_profile['prompt_map'],
+                    is_chart_recommender_enabled(self.context.database_profile))
                 self.token_info[QueryState.DATA_VISUALIZATION.name] = model_response.token_info
                 if select_chart_type != "-1":
                     sql_chart_data = ChartEntity(chart_type="", chart_data=[])
@@ -569,30 +814,29 @@ class QueryStateMachine:
                     self.get_answer().sql_search_result.sql_data_chart = [sql_chart_data]
                 self.get_answer().sql_search_result.data_show_type = model_select_type
                 self.get_answer().sql_search_result.sql_data = show_select_data
+                self._store_answer_cache()
             elif self.answer.query_intent == "agent_search":
                 agent_sql_search_result = self.answer.agent_search_result.agent_sql_search_result
                 agent_sql_search_result_with_visualization = []
-                for each in agent_sql_search_result:
-                    model_select_type, show_select_data, select_chart_type, show_chart_data, model_response = data_visualization(
-                        self.context.model_type,
-                        each.sub_task_query,
-                        each.sql_search_result.sql_data,
-                        self.context.database_profile['prompt_map'])
-                    if QueryState.DATA_VISUALIZATION.name not in self.token_info:
-                        self.token_info[QueryState.DATA_VISUALIZATION.name] = model_response.token_info
-                    else:
-                        if "input_tokens" in model_response.token_info:
-                            self.token_info[QueryState.DATA_VISUALIZATION.name]["input_tokens"] = self.token_info[
-                                                                                                     QueryState.DATA_VISUALIZATION.name][
-                                                                                                     "input_tokens"] + \
-                                                                                                 model_response.token_info[
-                                                                                                     "input_tokens"]
-                        if "output_tokens" in model_response.token_info:
-                            self.token_info[QueryState.DATA_VISUALIZATION.name]["output_tokens"] = self.token_info[
-                                                                                                      QueryState.DATA_VISUALIZATION.name][
-                                                                                                      "output_tokens"] + \
-                                                                                                  model_response.token_info[
-                                                                                                      "output_tokens"]
+
+                def visualize_task(each):
+                    with get_model_semaphore(self.context.model_type):
+                        return data_visualization(self.context.model_type, each.sub_task_query,
+                                                  each.sql_search_result.sql_data,
+                                                  self.context.database_profile['prompt_map'],
+                                                  is_chart_recommender_enabled(self.context.database_profile))
+
+                token_info = {}
+                task_results = map_in_order(visualize_task, agent_sql_search_result)
+                for each, (visualization, error) in zip(agent_sql_search_result, task_results):
+                    if error is not None:
+                        # keep the sub-task as a table
+                        logger.error(f"agent sub-task visualization of {each.sub_task_query} failed: {error}")
+                        agent_sql_search_result_with_visualization.append(each)
+                        continue
+                    model_select_type, show_select_data, select_chart_type, show_chart_data, model_response = \
+                        visualization
+                    add_token_info(token_info, model_response.token_info)
                     if select_chart_type != "-1":
                         sql_chart_data = ChartEntity(chart_type="", chart_data=[])
                         sql_chart_data.chart_type = select_chart_type
@@ -601,6 +845,7 @@ class QueryStateMachine:
                     each.sql_search_result.data_show_type = model_select_type
                     each.sql_search_result.sql_data = show_select_data
                     agent_sql_search_result_with_visualization.append(each)
+                self.token_info[QueryState.DATA_VISUALIZATION.name] = token_info
                 self.answer.agent_search_result.agent_sql_search_result = agent_sql_search_result_with_visualization
         except Exception as e:
             self.answer.error_log[QueryState.DATA_VISUALIZATION.name] = str(e)
@@ -651,4 +896,6 @@ class QueryStateMachine:
                                           intent=self.answer.query_intent,
                                           log_info=answer_info,
                                           log_type="chat_history",
-                                          time_str=current_time)
+                                          time_str=current_time,
+                                          query_rewrite=self.context.query_rewrite,
+                                          intent_source=self.intent_source)
@@ -1,13 +1,33 @@
 import json
 
 import sqlalchemy as db
-from sqlalchemy import text, Column, inspect
+from sqlalchemy import text, inspect
 
 from nlq.data_access.dynamo_connection import ConnectConfigEntity
+from nlq.data_access.engine_registry import EngineRegistry
+from utils.async_executor import map_in_order
 from utils.logging import getLogger
+from utils.schema_metadata_cache import SCHEMA_REFLECTION_CONCURRENCY, get_schema_fingerprint, \
+    get_schema_metadata_cache
 
 logger = getLogger()
 
+# columns of a schema read to detect changes before its cached metadata is reused, databases without an entry
+# only rely on SCHEMA_METADATA_CACHE_TTL
+SCHEMA_FINGERPRINT_QUERIES = {
+    'mysql': "SELECT table_name, column_name, column_type, column_comment FROM information_schema.columns "
+             "WHERE table_schema = :schema",
+    'postgresql': "SELECT table_name, column_name, data_type FROM information_schema.columns "
+                  "WHERE table_schema = :schema",
+    'redshift': "SELECT table_name, column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = :schema",
+    'starrocks': "SELECT table_name, column_name, column_type, column_comment FROM information_schema.columns "
+                 "WHERE table_schema = :schema",
+    'clickhouse': "SELECT table, name, type, comment FROM system.columns WHERE database = :schema",
+    'presto': "SELECT table_name, column_name, data_type FROM information_schema.columns "
+              "WHERE table_schema = :schema",
+}
+
 class RelationDatabase():
     db_mapping = {
         'mysql': 'mysql+pymysql',
@@ -92,13 +112,7 @@ class RelationDatabase():
     @classmethod
     def get_all_schema_names_by_connection(cls, connection: ConnectConfigEntity):
         db_type = connection.db_type
-        db_url = cls.get_db_url(db_type, connection.db_user, connection.db_pwd, connection.db_host, connection.db_port,
-                                connection.db_name)
-        if db_type == "bigquery":
-            password = json.loads(connection.db_pwd)
-            engine = db.create_engine(url=connection.db_host, credentials_info=password)
-        else:
-            engine = db.create_engine(db_url)
+        engine = cls.get_engine_by_connection(connection)
         inspector = inspect(engine)
 
         if db_type == 'postgresql':
@@ -113,39 +127,109 @@ class RelationDatabase():
 
     @classmethod
     def get_all_tables_by_connection(cls, connection: ConnectConfigEntity, schemas=None):
+        """Names of the tables and views of the schemas, listed without reflecting them"""
         if schemas is None:
             schemas = []
-        metadata = cls.get_metadata_by_connection(connection, schemas)
-        return metadata.tables.keys()
+        table_names = []
+        for schema_tables in cls.map_schemas(lambda schema: cls.get_schema_table_names(connection, schema),
+                                             cls.get_cache_schemas(connection, schemas)):
+            table_names.extend(schema_tables)
+        return table_names
 
     @classmethod
-    def get_metadata_by_connection(cls, connection, schemas):
-        db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
-                                connection.db_port, connection.db_name)
-        if connection.db_type == "bigquery":
-            password = json.loads(connection.db_pwd)
-            engine = db.create_engine(url=connection.db_host, credentials_info=password)
-        else:
-            engine = db.create_engine(db_url)
-        # connection = engine.connect()
+    def get_table_metadata_by_connection(cls, connection: ConnectConfigEntity, schemas, table_names):
+        """
+        Metadata of tables, from the schema metadata cache or reflected per schema in parallel
+        :param table_names: schema qualified table names, all tables of the schemas if empty
+        :return: dict of {'name', 'comment', 'columns': [{'name', 'type', 'comment'}]} by table name
+        """
+        if len(table_names) == 0:
+            table_names = cls.get_all_tables_by_connection(connection, schemas)
+        tables_by_schema = {}
+        for table_name in table_names:
+            schema = None if connection.db_type == 'bigquery' else cls.split_table_name(table_name)[0]
+            tables_by_schema.setdefault(schema, []).append(table_name)
+
+        def get_schema_tables(schema):
+            return get_schema_metadata_cache().get_tables(
+                connection.conn_name, schema, tables_by_schema[schema],
+                lambda: cls.get_schema_fingerprint(connection, schema),
+                lambda names: cls.reflect_tables_by_connection(connection, schema, names))
+
+        tables = {}
+        for schema_tables in cls.map_schemas(get_schema_tables, list(tables_by_schema)):
+            tables.update(schema_tables)
+        return tables
+
+    @staticmethod
+    def get_cache_schemas(connection: ConnectConfigEntity, schemas):
+        # BigQuery is reflected as a whole, its table names include the dataset
+        return [None] if connection.db_type == 'bigquery' else list(schemas)
+
+    @staticmethod
+    def map_schemas(func, schemas):
+        """Run func for every schema on the task pool, raising the first error"""
+        results = []
+        for result, error in map_in_order(func, schemas, SCHEMA_REFLECTION_CONCURRENCY):
+            if error is not None:
+                raise error
+            results.append(result)
+        return results
+
+    @classmethod
+    def get_schema_table_names(cls, connection: ConnectConfigEntity, schema):
+        def list_tables():
+            inspector = inspect(cls.get_engine_by_connection(connection))
+            if schema is None:
+                return inspector.get_table_names()
+            names = inspector.get_table_names(schema=schema)
+            if connection.db_type != 'presto':
+                names += inspector.get_view_names(schema=schema)
+            return [f'{schema}.{name}' for name in names]
+
+        return get_schema_metadata_cache().get_table_names(connection.conn_name, schema,
+                                                           lambda: cls.get_schema_fingerprint(connection, schema),
+                                                           list_tables)
+
+    @classmethod
+    def reflect_tables_by_connection(cls, connection: ConnectConfigEntity, schema, table_names):
+        """
+        Reflect only the given tables of a schema
+        :return: dict of table metadata by table name
+        """
+        engine = cls.get_engine_by_connection(connection)
         metadata = db.MetaData()
-        if connection.db_type == 'bigquery':
-            metadata.reflect(bind=engine)
-            return metadata
-        elif connection.db_type == 'presto':
-            for s in schemas:
-                metadata.reflect(bind=engine, schema=s)
-            return metadata
+        logger.info(f'reflecting {len(table_names)} tables of schema {schema}')
+        if schema is None:
+            wanted = set(table_names)
+            metadata.reflect(bind=engine, only=lambda name, _: name in wanted)
         else:
-            for s in schemas:
-                metadata.reflect(bind=engine, schema=s, views=True)
-            # metadata.reflect(bind=engine)
-            return metadata
+            wanted = {cls.split_table_name(table_name)[1] for table_name in table_names}
+            metadata.reflect(bind=engine, schema=schema, views=connection.db_type != 'presto',
+                             only=lambda name, _: name in wanted)
+        return {table_name: {
+            'name': table_name,
+            'comment': table.comment,
+            'columns': [{'name': column.name, 'type': column.type.__visit_name__, 'comment': column.comment}
+                        for column in table.columns]
+        } for table_name, table in metadata.tables.items()}
+
+    @classmethod
+    def get_schema_fingerprint(cls, connection: ConnectConfigEntity, schema):
+        """Digest of the columns of a schema from information_schema, None where it is not available"""
+        query = SCHEMA_FINGERPRINT_QUERIES.get(connection.db_type)
+        if query is None or schema is None:
+            return None
+        try:
+            with cls.get_engine_by_connection(connection).connect() as db_connection:
+                return get_schema_fingerprint(db_connection.execute(text(query), {'schema': schema}).fetchall())
+        except Exception as e:
+            logger.warning(f'change detection of schema {schema} failed, the cached metadata is kept: {e}')
+            return None
 
     @classmethod
     def get_table_definition_by_connection(cls, connection: ConnectConfigEntity, schemas, table_names):
-        metadata = cls.get_metadata_by_connection(connection, schemas)
-        tables = metadata.tables
+        tables = cls.get_table_metadata_by_connection(connection, schemas, table_names)
         table_info = {}
         if connection.db_type == 'hive':
             tables_comment = cls.get_hive_table_comment(connection, table_names)
@@ -153,40 +237,68 @@ class RelationDatabase():
             tables_comment = {}
 
         for table_name, table in tables.items():
-            # If table name is provided, only generate DDL for those tables. Otherwise, generate DDL for all tables.
-            if len(table_names) > 0 and table_name not in table_names:
-                continue
             # Start the DDL statement
-            table_comment = f'-- {table.comment}' if table.comment else ''
+            table_comment = f'-- {table["comment"]}' if table['comment'] else ''
             ddl = f"CREATE TABLE {table_name} {table_comment} \n (\n"
 
             if table_name in tables_comment:
                 column_comment_value = tables_comment[table_name]
             else:
                 column_comment_value = {}
-            for column in table.columns:
-                column: Column
+            for column in table['columns']:
                 # get column description
-                if column.comment is None:
-                    if column.name in column_comment_value:
-                        column.comment = column_comment_value[column.name]
-                column_comment = f'COMMENT {column.comment}' if column.comment else ''
-                ddl += f"  {column.name} {column.type.__visit_name__} {column_comment},\n"
+                comment = column['comment']
+                if comment is None:
+                    comment = column_comment_value.get(column['name'])
+                column_comment = f'COMMENT {comment}' if comment else ''
+                ddl += f"  {column['name']} {column['type']} {column_comment},\n"
             ddl = ddl.rstrip(',\n') + "\n)"  # Remove the last comma and close the CREATE TABLE statement
             table_info[table_name] = {}
             table_info[table_name]['ddl'] = ddl
-            table_info[table_name]['description'] = table.comment
+            table_info[table_name]['description'] = table['comment']
             logger.info(f'added table {table_name} to table_info dict')
 
         return table_info
 
+    @staticmethod
+    def split_table_name(table_name):
+        """:return: (schema or None, table) of a schema qualified table name"""
+        schema, _, name = table_name.rpartition('.')
+        return schema or None, name
+
+    @classmethod
+    def get_column_names_by_connection(cls, connection: ConnectConfigEntity, table_name):
+        schema, name = cls.split_table_name(table_name)
+        inspector = inspect(cls.get_engine_by_connection(connection))
+        return [column['name'] for column in inspector.get_columns(name, schema=schema)]
+
+    @classmethod
+    def iter_distinct_values_by_connection(cls, connection: ConnectConfigEntity, table_name, column_name,
+                                           fetch_size=1000, max_values=None):
+        """
+        Stream the distinct non-null values of a column in chunks, with a server side cursor where the driver
+        supports it
+        :param max_values: at most this many values are read
+        """
+        schema, name = cls.split_table_name(table_name)
+        column = db.column(column_name)
+        query = db.select(column).select_from(db.table(name, schema=schema)).where(column.isnot(None)).distinct()
+        if max_values:
+            query = query.limit(max_values)
+        engine = cls.get_engine_by_connection(connection)
+        with engine.connect() as db_connection:
+            result = db_connection.execution_options(stream_results=True).execute(query)
+            while True:
+                rows = result.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+
     @classmethod
     def get_hive_table_comment(cls, connection, table_names):
         table_name_comment = {}
         try:
-            db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
-                                    connection.db_port, connection.db_name)
-            engine = db.create_engine(db_url)
+            engine = cls.get_engine_by_connection(connection)
             for each_table in table_names:
                 table_name_comment[each_table] = {}
                 with engine.connect() as connection:
@@ -200,6 +312,16 @@ class RelationDatabase():
             logger.error(f"Failed to get table comment: {str(e)}")
             return table_name_comment
 
+    @classmethod
+    def get_engine_by_connection(cls, connection: ConnectConfigEntity):
+        """Get the shared, pooled engine of a connection from the engine registry"""
+        if connection.db_type == "bigquery":
+            password = json.loads(connection.db_pwd)
+            return EngineRegistry.get_engine(connection.db_host, conn_name=connection.conn_name,
+                                             conn_config=connection, credentials_info=password)
+        db_url = cls.get_db_url_by_connection(connection)
+        return EngineRegistry.get_engine(db_url, conn_name=connection.conn_name, conn_config=connection)
+
     @classmethod
     def get_db_url_by_connection(cls, connection: ConnectConfigEntity):
         db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
@@ -15,12 +15,14 @@ logger = getLogger()
 # DynamoDB 表名
 CONNECT_CONFIG_TABLE_NAME = 'NlqConnectConfig'
 DYNAMODB_AWS_REGION = os.environ.get('DYNAMODB_AWS_REGION')
+POOL_CONFIG_KEYS = ['pool_size', 'pool_max_overflow', 'pool_recycle', 'pool_pre_ping', 'pool_idle_timeout']
 
 
 class ConnectConfigEntity:
     """Connect config entity mapped to DynamoDB item"""
 
-    def __init__(self, conn_name, db_type, db_name, db_host, db_port, db_user, db_pwd,comment, db_sm=None, id=None):
+    def __init__(self, conn_name, db_type, db_name, db_host, db_port, db_user, db_pwd,comment, db_sm=None, id=None,
+                 **kwargs):
         self.id = id
         self.conn_name = conn_name
         self.db_type = db_type
@@ -31,6 +33,21 @@ class ConnectConfigEntity:
         self.db_pwd = db_pwd
         self.db_sm = db_sm
         self.comment = comment
+        # optional connection pool settings, fall back to the process-wide defaults when not set
+        self.pool_size = kwargs.get('pool_size', None)
+        self.pool_max_overflow = kwargs.get('pool_max_overflow', None)
+        self.pool_recycle = kwargs.get('pool_recycle', None)
+        self.pool_pre_ping = kwargs.get('pool_pre_ping', None)
+        self.pool_idle_timeout = kwargs.get('pool_idle_timeout', None)
+
+    def get_pool_config(self):
+        return {
+            'pool_size': self.pool_size,
+            'pool_max_overflow': self.pool_max_overflow,
+            'pool_recycle': self.pool_recycle,
+            'pool_pre_ping': self.pool_pre_ping,
+            'pool_idle_timeout': self.pool_idle_timeout
+        }
 
     def to_dict(self):
         """Convert to DynamoDB item format"""
@@ -44,7 +61,8 @@ class ConnectConfigEntity:
             'db_user': self.db_user,
             'db_pwd': self.db_pwd,
             'db_sm': self.db_sm,
-            'comment': self.comment
+            'comment': self.comment,
+            **{k: v for k, v in self.get_pool_config().items() if v is not None}
         }
 
     def get_secrets_manager_name(self):
@@ -163,7 +181,8 @@ class ConnectConfigDao:
                 db_user=db_user,
                 db_pwd=db_pwd,
                 db_sm=db_sm,
-                comment=item.get('comment', '')
+                comment=item.get('comment', ''),
+                **{k: item[k] for k in POOL_CONFIG_KEYS if k in item}
             )
 
     def add(self, entity):
@@ -242,6 +261,7 @@ class ConnectConfigDao:
                 'db_pwd': entity.db_pwd
             }
 
+        dynamodb_item.update({k: v for k, v in entity.get_pool_config().items() if v is not None})
         # 将新字典保存到 DynamoDB 表中
         self.table.put_item(Item=dynamodb_item)
 
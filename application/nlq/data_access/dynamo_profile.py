@@ -1,4 +1,5 @@
 import os
+import time
 
 import boto3
 from typing import List
@@ -13,6 +14,11 @@ logger = getLogger()
 PROFILE_CONFIG_TABLE_NAME = 'NlqProfileConfig'
 DYNAMODB_AWS_REGION = os.environ.get('DYNAMODB_AWS_REGION')
 
+
+def get_current_millis():
+    return int(time.time() * 1000)
+
+
 class ProfileConfigEntity:
 
     def __init__(self, profile_name: str, conn_name: str, schemas: List[str], tables: List[str], comments: str,
@@ -27,6 +33,15 @@ class ProfileConfigEntity:
         self.db_type = kwargs.get('db_type', None)
         self.enable_row_level_security = kwargs.get('enable_row_level_security', False)
         self.row_level_security_config = kwargs.get('row_level_security_config', None)
+        # seconds to cache SQL results of this profile, None falls back to SQL_RESULT_CACHE_TTL
+        self.result_cache_ttl = kwargs.get('result_cache_ttl', None)
+        # caps of a fetched SQL result, None falls back to SQL_RESULT_MAX_ROWS and SQL_RESULT_MAX_BYTES
+        self.result_max_rows = kwargs.get('result_max_rows', None)
+        self.result_max_bytes = kwargs.get('result_max_bytes', None)
+        # pick chart types with rules before asking the LLM, None falls back to CHART_RECOMMENDER_ENABLED
+        self.chart_recommender = kwargs.get('chart_recommender', None)
+        # epoch milliseconds of the last write, lets readers detect changes with a cheap projected get_item
+        self.updated_at = kwargs.get('updated_at', None)
 
     def to_dict(self):
         """Convert to DynamoDB item format"""
@@ -39,7 +54,12 @@ class ProfileConfigEntity:
             'prompt_map': self.prompt_map,
             'db_type': self.db_type,
             'enable_row_level_security':  self.enable_row_level_security,
-            'row_level_security_config': self.row_level_security_config
+            'row_level_security_config': self.row_level_security_config,
+            'result_cache_ttl': self.result_cache_ttl,
+            'result_max_rows': self.result_max_rows,
+            'result_max_bytes': self.result_max_bytes,
+            'chart_recommender': self.chart_recommender,
+            'updated_at': self.updated_at
         }
         if self.tables_info:
             base_props['tables_info'] = self.tables_info
@@ -114,26 +134,44 @@ class ProfileConfigDao:
         if 'Item' in response:
             return ProfileConfigEntity(**response['Item'])
 
+    def get_updated_at(self, profile_name):
+        response = self.table.get_item(Key={'profile_name': profile_name}, ProjectionExpression='updated_at')
+        if 'Item' in response:
+            return response['Item'].get('updated_at')
+
     def add(self, entity):
+        entity.updated_at = get_current_millis()
         self.table.put_item(Item=entity.to_dict())
 
     def update(self, entity):
+        entity.updated_at = get_current_millis()
         self.table.put_item(Item=entity.to_dict())
 
     def delete(self, profile_name):
         self.table.delete_item(Key={'profile_name': profile_name})
         return True
 
+    def scan_all(self, **scan_kwargs):
+        items = []
+        response = self.table.scan(**scan_kwargs)
+        items.extend(response['Items'])
+        while 'LastEvaluatedKey' in response:
+            response = self.table.scan(ExclusiveStartKey=response['LastEvaluatedKey'], **scan_kwargs)
+            items.extend(response['Items'])
+        return items
+
     def get_profile_list(self):
-        response = self.table.scan()
-        return [ProfileConfigEntity(**item) for item in response['Items']]
+        return [ProfileConfigEntity(**item) for item in self.scan_all()]
+
+    def get_profile_name_list(self):
+        return [item['profile_name'] for item in self.scan_all(ProjectionExpression='profile_name')]
 
     def update_table_def(self, profile_name, tables_info):
         try:
             response = self.table.update_item(
                 Key={"profile_name": profile_name},
-                UpdateExpression="set tables_info=:info",
-                ExpressionAttributeValues={":info": tables_info},
+                UpdateExpression="set tables_info=:info, updated_at=:ua",
+                ExpressionAttributeValues={":info": tables_info, ":ua": get_current_millis()},
                 ReturnValues="UPDATED_NEW",
             )
         except ClientError as err:
@@ -152,8 +190,8 @@ class ProfileConfigDao:
         try:
             response = self.table.update_item(
                 Key={"profile_name": profile_name},
-                UpdateExpression="set prompt_map=:pm",
-                ExpressionAttributeValues={":pm": prompt_map},
+                UpdateExpression="set prompt_map=:pm, updated_at=:ua",
+                ExpressionAttributeValues={":pm": prompt_map, ":ua": get_current_millis()},
                 ReturnValues="UPDATED_NEW",
             )
         except ClientError as err:
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+import sqlalchemy as db
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# Process-wide defaults, can be overridden per connection through ConnectConfigEntity
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_POOL_IDLE_TIMEOUT = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 3600))
+
+
+class EngineEntry:
+    """A cached engine together with the time it was last handed out"""
+
+    def __init__(self, engine, idle_timeout):
+        self.engine = engine
+        self.idle_timeout = idle_timeout
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def is_idle(self, now):
+        return self.idle_timeout > 0 and now - self.last_used > self.idle_timeout
+
+
+class EngineRegistry:
+    """
+    Process-wide registry of SQLAlchemy engines, keyed by connection name and resolved URL,
+    so that every query reuses the same connection pool instead of opening a new one.
+    """
+    _engines: dict[tuple, EngineEntry] = {}
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_pool_options(cls, conn_config=None) -> dict:
+        def pick(attr, default):
+            value = getattr(conn_config, attr, None) if conn_config is not None else None
+            return default if value is None or value == '' else value
+
+        return {
+            'pool_size': int(pick('pool_size', DB_POOL_SIZE)),
+            'max_overflow': int(pick('pool_max_overflow', DB_POOL_MAX_OVERFLOW)),
+            'pool_recycle': int(pick('pool_recycle', DB_POOL_RECYCLE)),
+            'pool_pre_ping': str(pick('pool_pre_ping', DB_POOL_PRE_PING)).lower() == 'true',
+            'idle_timeout': int(pick('pool_idle_timeout', DB_POOL_IDLE_TIMEOUT)),
+        }
+
+    @staticmethod
+    def get_registry_key(db_url, conn_name: str = '') -> tuple:
+        url_key = db_url.render_as_string(hide_password=False) if isinstance(db_url, db.engine.URL) else str(db_url)
+        return conn_name or '', url_key
+
+    @classmethod
+    def lookup(cls, db_url, conn_name: str = ''):
+        """Return the cached engine for the url, or None if it has not been created yet"""
+        with cls._lock:
+            entry = cls._engines.get(cls.get_registry_key(db_url, conn_name))
+            if entry is None:
+                return None
+            entry.touch()
+            return entry.engine
+
+    @classmethod
+    def get_engine(cls, db_url, conn_name: str = '', conn_config=None, **engine_kwargs):
+        """
+        Get a pooled engine for the url, creating it on first use.
+        :param db_url: str or sqlalchemy URL
+        :param conn_name: connection name, part of the registry key
+        :param conn_config: ConnectConfigEntity carrying optional pool settings
+        :param engine_kwargs: extra create_engine arguments, e.g. credentials_info for BigQuery
+        :return: sqlalchemy Engine
+        """
+        key = cls.get_registry_key(db_url, conn_name)
+        with cls._lock:
+            cls.evict_idle()
+            entry = cls._engines.get(key)
+            if entry is None:
+                pool_options = cls.get_pool_options(conn_config)
+                idle_timeout = pool_options.pop('idle_timeout')
+                engine = cls._create_engine(db_url, pool_options, engine_kwargs)
+                entry = EngineEntry(engine, idle_timeout)
+                cls._engines[key] = entry
+                logger.info(f'created pooled engine for connection {conn_name or engine.url.host}, {pool_options=}')
+            entry.touch()
+            return entry.engine
+
+    @classmethod
+    def _create_engine(cls, db_url, pool_options, engine_kwargs):
+        try:
+            return db.create_engine(db_url, **pool_options, **engine_kwargs)
+        except TypeError:
+            # some dialects (e.g. NullPool / SingletonThreadPool based ones) reject queue pool sizing
+            logger.warning(f'pool sizing not supported for {db.engine.make_url(db_url).drivername}, using defaults')
+            return db.create_engine(db_url, pool_pre_ping=pool_options['pool_pre_ping'],
+                                    pool_recycle=pool_options['pool_recycle'], **engine_kwargs)
+
+    @classmethod
+    def evict_idle(cls):
+        now = time.monotonic()
+        with cls._lock:
+            idle_keys = [key for key, entry in cls._engines.items() if entry.is_idle(now)]
+            for key in idle_keys:
+                entry = cls._engines.pop(key)
+                entry.engine.dispose()
+                logger.info(f'disposed idle engine for connection {key[0] or entry.engine.url.host}')
+
+    @classmethod
+    def dispose(cls, conn_name: str = None):
+        """Dispose engines of one connection, or all engines when conn_name is None"""
+        with cls._lock:
+            keys = [key for key in cls._engines if conn_name is None or key[0] == conn_name]
+            for key in keys:
+                cls._engines.pop(key).engine.dispose()
@@ -1,8 +1,10 @@
 
-from opensearchpy import OpenSearch
-from opensearchpy.helpers import bulk
+from opensearchpy.helpers import bulk, streaming_bulk
+from nlq.data_access.opensearch_documents import build_sample_record, build_entity_record, build_agent_cot_record
+from utils.env_var import opensearch_info
 from utils.llm import create_vector_embedding
 from utils.logging import getLogger
+from utils.opensearch import get_opensearch_cluster_client
 
 logger = getLogger()
 
@@ -11,21 +13,12 @@ def put_bulk_in_opensearch(list, client):
     success, failed = bulk(client, list)
     return success, failed
 
+
 class OpenSearchDao:
 
     def __init__(self, host, port, opensearch_user, opensearch_password):
-        auth = (opensearch_user, opensearch_password)
-
-        # Create the client with SSL/TLS enabled, but hostname verification disabled.
-        self.opensearch_client = OpenSearch(
-            hosts=[{'host': host, 'port': port}],
-            http_compress=True,  # enables gzip compression for request bodies
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=False,
-            ssl_assert_hostname=False,
-            ssl_show_warn=False
-        )
+        self.opensearch_client = get_opensearch_cluster_client(opensearch_info['domain'], host, port, opensearch_user,
+                                                               opensearch_password, opensearch_info['region'])
 
     def retrieve_samples(self, index_name, profile_name):
         # search all docs in the index filtered by profile_name
@@ -150,58 +143,51 @@ class OpenSearchDao:
         return response['hits']['hits']
 
     def add_sample(self, index_name, profile_name, question, answer, embedding):
-        record = {
-            '_index': index_name,
-            'text': question,
-            'sql': answer,
-            'profile': profile_name,
-            'vector_field': embedding
-        }
-
+        record = build_sample_record(index_name, profile_name, question, answer, embedding)
         success, failed = put_bulk_in_opensearch([record], self.opensearch_client)
         return success == 1
 
     def add_entity_sample(self, index_name, profile_name, entity, comment, embedding, entity_type="", entity_table_info=[]):
-        entity_count = len(entity_table_info)
-        comment_value = []
-        item_comment_format = "{entity} is located in table {table_name}, column {column_name},  the dimension value is {value}."
-        if entity_type == "dimension":
-            if entity_count > 0:
-                for item in entity_table_info:
-                    table_name = item["table_name"]
-                    column_name = item["column_name"]
-                    value = item["value"]
-                    comment_format = item_comment_format.format(entity=entity, table_name=table_name,
-                                                                column_name=column_name, value=value)
-                    comment_value.append(comment_format)
-            comment = ";".join(comment_value)
-
-        record = {
-            '_index': index_name,
-            'entity': entity,
-            'comment': comment,
-            'profile': profile_name,
-            'vector_field': embedding,
-            'entity_type': entity_type,
-            'entity_count': entity_count,
-            'entity_table_info': entity_table_info
-        }
-
+        record = build_entity_record(index_name, profile_name, entity, comment, embedding, entity_type,
+                                     entity_table_info)
         success, failed = put_bulk_in_opensearch([record], self.opensearch_client)
         return success == 1
 
     def add_agent_cot_sample(self, index_name, profile_name, query, comment, embedding):
-        record = {
-            '_index': index_name,
-            'query': query,
-            'comment': comment,
-            'profile': profile_name,
-            'vector_field': embedding
-        }
-
+        record = build_agent_cot_record(index_name, profile_name, query, comment, embedding)
         success, failed = put_bulk_in_opensearch([record], self.opensearch_client)
         return success == 1
 
+    def bulk_write(self, actions, chunk_size=500):
+        """
+        Write index and delete actions in chunked bulk requests
+        :return: success count, list of failed items, count of index actions that overwrote a document with the
+        same id
+        """
+        if len(actions) == 0:
+            return 0, [], 0
+        logger.info(f"Putting {len(actions)} bulk actions in OpenSearch")
+        success, failed, updated = 0, [], 0
+        for ok, item in streaming_bulk(self.opensearch_client, actions, chunk_size=chunk_size, raise_on_error=False):
+            if not ok:
+                failed.append(item)
+                continue
+            success += 1
+            if item.get('index', {}).get('result') == 'updated':
+                updated += 1
+        return success, failed, updated
+
+    def get_documents(self, index_name, doc_ids, source_includes=None):
+        """
+        Get documents by id in one _mget request
+        :return: dict of the _source of the found documents by id
+        """
+        if len(doc_ids) == 0:
+            return {}
+        params = {'_source_includes': ','.join(source_includes)} if source_includes else {}
+        response = self.opensearch_client.mget(body={'ids': list(doc_ids)}, index=index_name, params=params)
+        return {doc['_id']: doc['_source'] for doc in response['docs'] if doc.get('found')}
+
     def delete_sample(self, index_name, profile_name, doc_id):
         return self.opensearch_client.delete(index=index_name, id=doc_id)
 
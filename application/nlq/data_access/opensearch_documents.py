@@ -0,0 +1,96 @@
+# documents of the sql, ner and agent indexes, shared by OpenSearchDao, VectorStore bulk ingestion and the offline
+# bulk indexer. Kept free of AWS client imports so the indexer can run without them.
+import hashlib
+import unicodedata
+
+ENTITY_COMMENT_FORMAT = "{entity} is located in table {table_name}, column {column_name},  the dimension value is {value}."
+
+
+
+def normalize_document_text(text) -> str:
+    """Text of a document as its id is derived from: NFKC normalized, runs of whitespace collapsed"""
+    return " ".join(unicodedata.normalize("NFKC", str(text)).split())
+
+
+def get_document_id(profile_name, text) -> str:
+    """
+    Deterministic id of the document of a text in a profile, writing the same text again overwrites the indexed
+    document instead of adding a duplicate
+    """
+    key = f"{profile_name}\n{normalize_document_text(text)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_entity_value_id(item) -> str:
+    return item["table_name"] + "#" + item["column_name"] + "#" + item["value"]
+
+
+def merge_entity_table_info(entity_table_info, indexed_entity_table_info) -> list:
+    """Dimension values of an entity, followed by the values of the indexed document it replaces that are missing"""
+    merged = list(entity_table_info)
+    value_ids = {get_entity_value_id(item) for item in merged}
+    for item in indexed_entity_table_info or []:
+        value_id = get_entity_value_id(item)
+        if value_id not in value_ids:
+            value_ids.add(value_id)
+            merged.append(item)
+    return merged
+
+
+def get_dimension_comment(entity, entity_table_info) -> str:
+    return ";".join(ENTITY_COMMENT_FORMAT.format(entity=entity, table_name=item["table_name"],
+                                                 column_name=item["column_name"], value=item["value"])
+                    for item in entity_table_info)
+
+
+def build_sample_record(index_name, profile_name, question, answer, embedding):
+    return {
+        '_index': index_name,
+        '_id': get_document_id(profile_name, question),
+        'text': question,
+        'sql': answer,
+        'profile': profile_name,
+        'vector_field': embedding
+    }
+
+
+def build_entity_record(index_name, profile_name, entity, comment, embedding, entity_type="", entity_table_info=[]):
+    entity_count = len(entity_table_info)
+    if entity_type == "dimension":
+        comment = get_dimension_comment(entity, entity_table_info)
+    return {
+        '_index': index_name,
+        '_id': get_document_id(profile_name, entity),
+        'entity': entity,
+        'comment': comment,
+        'profile': profile_name,
+        'vector_field': embedding,
+        'entity_type': entity_type,
+        'entity_count': entity_count,
+        'entity_table_info': entity_table_info
+    }
+
+
+def build_agent_cot_record(index_name, profile_name, query, comment, embedding):
+    return {
+        '_index': index_name,
+        '_id': get_document_id(profile_name, query),
+        'query': query,
+        'comment': comment,
+        'profile': profile_name,
+        'vector_field': embedding
+    }
+
+
+def build_dimension_values_update(index_name, profile_name, entity, entity_table_info):
+    """Partial update of the values of an indexed dimension entity, its embedding is kept"""
+    return {
+        '_op_type': 'update',
+        '_index': index_name,
+        '_id': get_document_id(profile_name, entity),
+        'doc': {
+            'comment': get_dimension_comment(entity, entity_table_info),
+            'entity_count': len(entity_table_info),
+            'entity_table_info': entity_table_info
+        }
+    }
@@ -1,8 +1,7 @@
 
 import os
-from utils.env_var import opensearch_info
 from utils.logging import getLogger
-from utils.opensearch import check_opensearch_index, get_opensearch_cluster_client
+from utils.opensearch import check_opensearch_index, get_opensearch_client
 
 logger = getLogger()
 
@@ -12,7 +11,7 @@ QUERY_LOG_TABLE_NAME = os.getenv("QUERY_LOG_TABLE_NAME", "genbi_query_logging")
 class QueryLogEntity:
 
     def __init__(self, log_id, profile_name, user_id, session_id, sql, query, intent, log_info, time_str,
-                 log_type='sql'):
+                 log_type='sql', query_rewrite=None, intent_source=None):
         self.log_id = log_id
         self.profile_name = profile_name
         self.user_id = user_id
@@ -23,6 +22,9 @@ class QueryLogEntity:
         self.log_info = log_info
         self.time_str = time_str
         self.log_type = log_type
+        self.query_rewrite = query_rewrite
+        # who decided the intent: llm, classifier or cache, empty when intent recognition is off
+        self.intent_source = intent_source
 
     def to_dict(self):
         """Convert to DynamoDB item format"""
@@ -36,17 +38,16 @@ class QueryLogEntity:
             'intent': self.intent,
             'log_info': self.log_info,
             'time_str': self.time_str,
-            'log_type': self.log_type
+            'log_type': self.log_type,
+            'query_rewrite': self.query_rewrite,
+            'intent_source': self.intent_source
         }
 
 
 class OpenSearchQueryLogDao:
     def __init__(self):
 
-        self.opensearch_client = get_opensearch_cluster_client(opensearch_info["domain"], opensearch_info["host"],
-                                                               opensearch_info["port"],
-                                                               opensearch_info["username"], opensearch_info["password"],
-                                                               opensearch_info["region"])
+        self.opensearch_client = get_opensearch_client()
         # if not self.exists():
         #     self.create_index()
 
@@ -88,6 +89,12 @@ class OpenSearchQueryLogDao:
                     },
                     "log_type": {
                         "type": "keyword"
+                    },
+                    "query_rewrite": {
+                        "type": "text"
+                    },
+                    "intent_source": {
+                        "type": "keyword"
                     }
                 }
             }
@@ -101,9 +108,9 @@ class OpenSearchQueryLogDao:
             logger.error("add log entity is error {}", e)
 
     def add_log(self, log_id, profile_name, user_id, session_id, sql, query, intent, log_info, time_str,
-                log_type='sql'):
+                log_type='sql', query_rewrite=None, intent_source=None):
         entity = QueryLogEntity(log_id, profile_name, user_id, session_id, sql, query, intent, log_info, time_str,
-                                log_type)
+                                log_type, query_rewrite, intent_source)
         self.add(entity)
 
     def get_logs_by_session(self, profile_name, user_id, session_id, size=3, log_type='sql'):
@@ -129,6 +136,30 @@ class OpenSearchQueryLogDao:
             history_list.append(hit.get('_source'))
         return history_list
 
+    def get_intent_examples(self, profile_name, size=1000, log_type="chat_history"):
+        """
+        Rewritten question and intent of the latest answers of a profile whose intent the LLM decided, newest first.
+        Intents predicted by the local classifier are left out, so it is never trained on its own predictions.
+        """
+        query = {
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"term": {"profile_name": profile_name}},
+                        {"term": {"log_type": log_type}},
+                        {"term": {"intent_source": "llm"}}
+                    ]
+                }
+            },
+            "_source": ["query_rewrite", "intent"],
+            "sort": [
+                {"time_str": {"order": "desc"}}
+            ],
+            "size": size
+        }
+        response = self.opensearch_client.search(index=QUERY_LOG_TABLE_NAME, body=query)
+        return [hit.get('_source') for hit in response.get('hits', {}).get('hits', [])]
+
     def get_history_by_user_profile(self, user_id, profile_name, log_type="chat_history"):
         # 目前暂时最多返回10000条历史记录
         query = {
@@ -264,6 +264,7 @@ def main():
         data_with_analyse = st.checkbox("Answer With Insights", False)
         gen_suggested_question_flag = st.checkbox("Generate Suggested Questions", False)
         auto_correction_flag = st.checkbox("Auto Correcting SQL", True)
+        speculative_retrieval_flag = st.checkbox("Speculative Retrieval", False)
         show_token_cost = st.checkbox("Show Token Cost", False)
         context_window = st.slider("Multiple Rounds of Context Window", 0, 10, 5)
 
@@ -359,7 +360,8 @@ def main():
                     entity_same_name_select={},
                     user_query_history=user_query_history,
                     opensearch_info=opensearch_info,
-                    previous_state=previous_state)
+                    previous_state=previous_state,
+                    speculative_retrieval_flag=speculative_retrieval_flag)
                 st.session_state.previous_state[selected_profile] = "INITIAL"
                 state_machine = QueryStateMachine(processing_context)
                 while state_machine.get_state() != QueryState.COMPLETE and state_machine.get_state() != QueryState.ERROR:
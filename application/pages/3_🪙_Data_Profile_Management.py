@@ -6,6 +6,9 @@ from nlq.business.datasource.factory import DataSourceFactory
 from nlq.business.profile import ProfileManagement
 from utils.logging import getLogger
 from utils.navigation import make_sidebar
+from utils.apis import SQL_RESULT_MAX_ROWS, SQL_RESULT_MAX_BYTES
+from utils.sql_result_cache import SQL_RESULT_CACHE_TTL
+from utils.chart_recommender import is_chart_recommender_enabled
 
 
 logger = getLogger()
@@ -152,6 +155,10 @@ def main():
             intersection_tables = None
         selected_tables = st.multiselect("Select tables included in this profile", tables_from_db,
                                          default=intersection_tables)
+        if st.button('Reload tables from database',
+                     help='Table lists and definitions are cached, reload them after changing the database schema'):
+            ConnectionManagement.invalidate_schema_metadata(selected_conn_name)
+            st.rerun()
         comments = st.text_area("Comments (add sample questions after Examples:, one question one line)",
                                 value=current_profile.comments,
                                 placeholder="Your comments for this data profile.\n"
@@ -174,6 +181,27 @@ def main():
       - column_name: username
         column_value: $login_user.username""", disabled=not st_enable_rls, height=240)
 
+        result_cache_ttl = st.number_input("SQL Result Cache TTL (seconds)", min_value=0, step=60,
+                                           value=int(current_profile.result_cache_ttl
+                                                     if current_profile.result_cache_ttl is not None
+                                                     else SQL_RESULT_CACHE_TTL),
+                                           help="How long identical SQL results of this profile are served from "
+                                                "cache, 0 always queries the database.")
+        result_max_rows = st.number_input("Max Result Rows", min_value=1, step=1000,
+                                          value=int(current_profile.result_max_rows
+                                                    if current_profile.result_max_rows is not None
+                                                    else SQL_RESULT_MAX_ROWS),
+                                          help="Larger results are truncated, LIMIT is added to the SQL where possible.")
+        result_max_mb = st.number_input("Max Result Size (MB)", min_value=1, step=8,
+                                        value=int(current_profile.result_max_bytes
+                                                  if current_profile.result_max_bytes is not None
+                                                  else SQL_RESULT_MAX_BYTES) // (1024 * 1024))
+        chart_recommender = st.checkbox("Rule-based chart selection",
+                                        value=is_chart_recommender_enabled(
+                                            {'chart_recommender': current_profile.chart_recommender}),
+                                        help="Pick the chart type of common results from their column types, the "
+                                             "LLM is only asked when the rules cannot decide.")
+
         if st.button('Update Profile', type='primary'):
             st.session_state.update_profile = True
             if not selected_tables:
@@ -188,7 +216,8 @@ def main():
                         return
                 ProfileManagement.update_profile(profile_name, selected_conn_name, schema_names, selected_tables,
                                                  comments, old_tables_info, conn_config.db_type, st_enable_rls,
-                                                 rls_config)
+                                                 rls_config, result_cache_ttl, result_max_rows,
+                                                 result_max_mb * 1024 * 1024, chart_recommender)
                 st.success('Profile updated. Please click "Fetch table definition" button to continue.')
                 st.cache_data.clear()
 
@@ -254,6 +254,14 @@ def delete_sample(profile_name, id):
     st.success(f'Sample {id} deleted.')
 
 
+def get_progress_callback(progress_bar, file_name):
+    def show_progress(report):
+        progress_text = "batch insert {} in progress: {}".format(file_name, report)
+        progress_bar.progress(report.processed / max(report.total - report.duplicates, 1), text=progress_text)
+
+    return show_progress
+
+
 def read_file(uploaded_file):
     """
     read upload csv file
@@ -391,17 +399,13 @@ def main():
                         status_text.text(f"Processing file {i + 1} of {len(uploaded_files)}: {uploaded_file.name}")
                         each_upload_data = read_file(uploaded_file)
                         if each_upload_data is not None:
-                            total_rows = len(each_upload_data)
                             progress_bar = st.progress(0)
-                            progress_text = "batch insert {} entity  in progress. Please wait.".format(
-                                uploaded_file.name)
-                            for j, item in enumerate(each_upload_data.itertuples(), 1):
-                                question = str(item.question)
-                                sql = str(item.sql)
-                                VectorStore.add_sample(current_profile, question, sql)
-                                progress = (j * 1.0) / total_rows
-                                progress_bar.progress(progress, text=progress_text)
+                            samples = [(str(item.question), str(item.sql)) for item in each_upload_data.itertuples()]
+                            report = VectorStore.add_samples_bulk(
+                                current_profile, samples,
+                                on_progress=get_progress_callback(progress_bar, uploaded_file.name))
                             progress_bar.empty()
+                            status_text.text(f"{uploaded_file.name}: {report}")
                         st.success("{uploaded_file} uploaded successfully!".format(uploaded_file=uploaded_file.name))
 
         with reg_testing:
@@ -4,6 +4,7 @@ import time
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
+from nlq.business.connection import ConnectionManagement
 from nlq.business.profile import ProfileManagement
 from nlq.business.vector_store import VectorStore
 from utils.logging import getLogger
@@ -97,6 +98,56 @@ def delete_entity_sample(profile_name, id):
     st.success(f'Sample {id} deleted.')
 
 
+def get_progress_callback(progress_bar):
+    def show_progress(report):
+        upload_text = "Batch insert in progress: {}. Please wait.".format(report)
+        progress_bar.progress(report.processed / max(report.total - report.duplicates, 1), text=upload_text)
+
+    return show_progress
+
+
+def get_table_columns(conn_name, table_name):
+    column_cache = st.session_state.setdefault("dimension_table_columns", {})
+    if (conn_name, table_name) not in column_cache:
+        conn_config = ConnectionManagement.get_conn_config_by_name(conn_name)
+        column_cache[(conn_name, table_name)] = ConnectionManagement.get_column_names_by_config(conn_config,
+                                                                                                table_name)
+    return column_cache[(conn_name, table_name)]
+
+
+def show_database_dimension_entity(profile_name):
+    """
+    Read the distinct values of dimension columns from the database of the profile and index the values that are
+    not indexed yet, rerun it to pick up new values
+    """
+    st.write("Index the distinct values of dimension columns as dimension entities. "
+             "Running it again only embeds values that are not indexed yet.")
+    profile = st.session_state['profiles'][profile_name]
+    table_names = st.multiselect("Tables", list((profile.get('tables_info') or {}).keys()),
+                                 key="dimension_tables")
+    columns = []
+    for table_name in table_names:
+        try:
+            column_names = get_table_columns(profile['conn_name'], table_name)
+        except Exception as e:
+            st.error(f"Failed to read the columns of {table_name}: {e}")
+            continue
+        for column_name in st.multiselect(f"Dimension columns of {table_name}", column_names,
+                                          key=f"dimension_columns_{table_name}"):
+            columns.append((table_name, column_name))
+    if st.button("Index Dimension Values", type='primary', disabled=len(columns) == 0):
+        with st.spinner('Reading distinct values ...'):
+            entities = ConnectionManagement.read_dimension_entities(profile['conn_name'], columns)
+        progress_bar = st.progress(0)
+        summary = VectorStore.refresh_entity_dimension_values(profile_name, entities,
+                                                              on_progress=get_progress_callback(progress_bar))
+        progress_bar.empty()
+        st.success(f"{summary['entities']} dimension entities read, {summary['indexed']} indexed, "
+                   f"{summary['updated']} with new values, {summary['unchanged']} unchanged, "
+                   f"{summary['conflicts']} already indexed as metrics, {summary['failed']} failed")
+        st.session_state.ner_refresh_view = True
+
+
 def read_file(uploaded_file):
     """
     read upload csv file
@@ -177,9 +228,9 @@ def main():
                 current_profile)
             st.session_state.ner_refresh_view = False
 
-    tab_view, tab_add, tab_dimension, tab_search, batch_insert, batch_dimension_entity = st.tabs(
-        ['View Entity Info', 'Add Metrics Entity', 'Add Dimension Entity', 'Entity Search', 'Batch Metrics Entity',
-         'Batch Dimension Entity'])
+    tab_view, tab_add, tab_dimension, tab_search, batch_insert, batch_dimension_entity, database_dimension_entity = \
+        st.tabs(['View Entity Info', 'Add Metrics Entity', 'Add Dimension Entity', 'Entity Search',
+                 'Batch Metrics Entity', 'Batch Dimension Entity', 'Dimension Entity from Database'])
     if current_profile is not None:
         st.session_state['current_profile'] = current_profile
         with tab_view:
@@ -277,14 +328,11 @@ def main():
                                 unique_batch_data[entity] = comment
 
                             progress_bar = st.progress(0)
-                            unique_total_row = len(unique_batch_data)
-                            for k, (key, value) in enumerate(unique_batch_data.items(), 1):
-                                VectorStore.add_entity_sample(current_profile, key, value)
-                                progress = (k * 1.0) / unique_total_row
-                                upload_text = "Batch insert in progress. {} entities have been uploaded. Please wait.".format(
-                                    str(k))
-                                progress_bar.progress(progress, text=upload_text)
+                            report = VectorStore.add_entity_samples_bulk(
+                                current_profile, list(unique_batch_data.items()),
+                                on_progress=get_progress_callback(progress_bar))
                             progress_bar.empty()
+                            status_text.text(f"{uploaded_file.name}: {report}")
                         st.session_state.ner_refresh_view = True
                         st.success("{uploaded_file} uploaded successfully!".format(uploaded_file=uploaded_file.name))
                     with st.spinner('Update Index ...'):
@@ -329,16 +377,11 @@ def main():
                                     unique_batch_data[entity]["value_list"].append(entity_item_table_info)
 
                             progress_bar = st.progress(0)
-                            unique_total_row = len(unique_batch_data)
-                            for k, (key, value) in enumerate(unique_batch_data.items(), 1):
-                                VectorStore.add_entity_dimension_batch_sample(current_profile, key, "", DIMENSION_VALUE,
-                                                                              value["value_list"])
-                                progress = (k * 1.0) / unique_total_row
-                                upload_text = "Batch insert in progress. {} entities have been uploaded. Please wait.".format(
-                                    str(k))
-                                progress_bar.progress(progress, text=upload_text)
-
+                            report = VectorStore.add_entity_dimension_samples_bulk(
+                                current_profile, [(key, value["value_list"]) for key, value in unique_batch_data.items()],
+                                DIMENSION_VALUE, on_progress=get_progress_callback(progress_bar))
                             progress_bar.empty()
+                            status_text.text(f"{uploaded_file.name}: {report}")
                         st.session_state.ner_refresh_view = True
                         st.success("{uploaded_file} uploaded successfully!".format(uploaded_file=uploaded_file.name))
                     with st.spinner('Update Index ...'):
@@ -347,6 +390,10 @@ def main():
                         current_profile)
                     st.rerun()
 
+        with database_dimension_entity:
+            if current_profile is not None:
+                show_database_dimension_entity(current_profile)
+
     else:
         st.info('Please select data profile in the left sidebar.')
 
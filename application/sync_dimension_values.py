@@ -0,0 +1,40 @@
+"""
+Index the distinct values of dimension columns of a profile's database as dimension entities.
+
+Values that are already indexed are skipped, new values of an indexed entity are added without embedding it again,
+so the job can run on a schedule to pick up new values:
+
+    python sync_dimension_values.py --profile my_profile --column orders.city --column customers.city
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+from nlq.business.connection import ConnectionManagement
+from nlq.business.dimension_values import parse_dimension_column
+from nlq.business.profile import ProfileManagement
+from nlq.business.vector_store import VectorStore
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', required=True)
+    parser.add_argument('--column', action='append', required=True,
+                        help='dimension column as table.column or schema.table.column, can be repeated')
+    args = parser.parse_args()
+
+    try:
+        columns = [parse_dimension_column(name) for name in args.column]
+    except ValueError as e:
+        parser.error(str(e))
+    profile = ProfileManagement.get_profile_by_name(args.profile)
+    if profile is None:
+        parser.error(f'profile {args.profile} does not exist')
+    entities = ConnectionManagement.read_dimension_entities(profile.conn_name, columns)
+    summary = VectorStore.refresh_entity_dimension_values(args.profile, entities)
+    print(f'dimension values of profile {args.profile}: {summary}')
+
+
+if __name__ == '__main__':
+    main()
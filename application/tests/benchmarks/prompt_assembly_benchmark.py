@@ -0,0 +1,73 @@
+"""
+Micro-benchmark of text2sql prompt assembly on a large profile, comparing a full render per question (before)
+with the compiled prompt served from the prompt cache (after).
+
+    python -m tests.benchmarks.prompt_assembly_benchmark --tables 150 --columns 30 --iterations 200
+"""
+import argparse
+import time
+
+from utils.prompts.generate_prompt import prompt_map_dict, generate_llm_prompt, prompt_cache
+
+MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
+
+
+def build_tables_info(table_count, column_count):
+    tables_info = {}
+    for table_index in range(table_count):
+        columns = ",\n".join(f"  column_{column_index} varchar(255) COMMENT 'attribute {column_index} of the table'"
+                             for column_index in range(column_count))
+        tables_info[f"table_{table_index}"] = {
+            "ddl": f"CREATE TABLE table_{table_index} (\n  id bigint PRIMARY KEY,\n{columns}\n)",
+            "description": f"fact table number {table_index}"
+        }
+    return tables_info
+
+
+def build_examples(count):
+    sql_examples = [{"_source": {"text": f"question {index}", "sql": f"SELECT * FROM table_{index} LIMIT 10"}}
+                    for index in range(count)]
+    ner_examples = [{"_source": {"entity": f"entity {index}", "comment": f"table_{index}.column_1"}}
+                    for index in range(count)]
+    return sql_examples, ner_examples
+
+
+def measure(name, iterations, assemble):
+    assemble(0)
+    start = time.perf_counter()
+    for index in range(iterations):
+        assemble(index)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {elapsed / iterations * 1000:8.3f} ms per prompt")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", type=int, default=150)
+    parser.add_argument("--columns", type=int, default=30)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    tables_info = build_tables_info(args.tables, args.columns)
+    sql_examples, ner_examples = build_examples(3)
+
+    def assemble_uncached(index):
+        # without a profile version every prompt is rendered in full
+        return generate_llm_prompt(tables_info, '', prompt_map_dict, f"question {index}", sql_examples,
+                                   ner_examples, MODEL_ID, 'mysql')
+
+    def assemble_versioned(index):
+        return generate_llm_prompt(tables_info, '', prompt_map_dict, f"question {index}", sql_examples,
+                                   ner_examples, MODEL_ID, 'mysql', profile_version='benchmark:1')
+
+    user_prompt, _ = assemble_uncached(0)
+    print(f"{args.tables} tables, {len(user_prompt) / 1024:.0f} KB user prompt, {args.iterations} iterations")
+    before = measure("before", args.iterations, assemble_uncached)
+    after = measure("versioned", args.iterations, assemble_versioned)
+    print(f"speedup with a profile version: {before / after:.1f}x, cache {prompt_cache.hits} hits "
+          f"{prompt_cache.misses} misses")
+
+
+if __name__ == "__main__":
+    main()
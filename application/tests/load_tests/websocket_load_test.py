@@ -0,0 +1,160 @@
+"""
+Load test for the /qa/ws websocket, measuring how many question sessions one uvicorn worker serves concurrently.
+
+simulate: runs in process without AWS access, replaying the stage latencies of a normal_search question
+          with handlers called inline on the event loop (before) and through run_blocking (after).
+
+    python -m tests.load_tests.websocket_load_test simulate --sessions 50
+
+websocket: opens concurrent websocket sessions against a running API, run it once per build to compare.
+
+    python -m tests.load_tests.websocket_load_test websocket --url ws://localhost:8000/qa/ws \
+        --profile my_profile --query "top 10 products by revenue" --sessions 20
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from utils.async_executor import run_blocking, STAGE_LLM, STAGE_RETRIEVAL, STAGE_DATABASE
+
+# seconds spent in each handler of a typical normal_search question
+SIMULATED_STAGES = [
+    (STAGE_LLM, 1.0),  # query rewrite
+    (STAGE_LLM, 1.5),  # intent recognition
+    (STAGE_RETRIEVAL, 0.3),  # entity retrieval
+    (STAGE_RETRIEVAL, 0.2),  # qa retrieval
+    (STAGE_LLM, 4.0),  # sql generation
+    (STAGE_DATABASE, 0.8),  # sql execution
+]
+
+
+class SessionTracker:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.latencies = []
+
+    def start(self):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+    def stop(self):
+        self.active -= 1
+
+    def end(self, latency):
+        self.latencies.append(latency)
+
+
+async def monitor_loop_lag(stop_event, interval=0.05):
+    """Largest delay of a periodic timer, i.e. how long the event loop was blocked"""
+    max_lag = 0.0
+    while not stop_event.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.monotonic() - start - interval)
+    return max_lag
+
+
+async def simulated_session(tracker, offload, time_scale):
+    start = time.monotonic()
+    for stage, duration in SIMULATED_STAGES:
+        # peak_concurrent counts handlers in flight at the same time, 1 when the event loop is blocked
+        tracker.start()
+        if offload:
+            await run_blocking(stage, time.sleep, duration * time_scale)
+        else:
+            time.sleep(duration * time_scale)
+        tracker.stop()
+        await asyncio.sleep(0)
+    tracker.end(time.monotonic() - start)
+
+
+async def run_simulation(sessions, offload, time_scale):
+    tracker = SessionTracker()
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(stop_event))
+    start = time.monotonic()
+    await asyncio.gather(*[simulated_session(tracker, offload, time_scale) for _ in range(sessions)])
+    wall_time = time.monotonic() - start
+    stop_event.set()
+    return tracker, wall_time, await lag_task
+
+
+async def websocket_session(tracker, url, profile_name, query, model_id):
+    import websockets
+
+    question = {
+        "query": query,
+        "profile_name": profile_name,
+        "bedrock_model_id": model_id,
+        "session_id": str(uuid.uuid4()),
+        "user_id": "load_test",
+        "context_window": 0,
+    }
+    start = time.monotonic()
+    started = False
+    async with websockets.connect(url, max_size=None, open_timeout=60) as websocket:
+        await websocket.send(json.dumps(question))
+        while True:
+            message = json.loads(await websocket.recv())
+            if not started:
+                started = True
+                tracker.start()
+            if message["content_type"] in ("end", "exception"):
+                break
+    if started:
+        tracker.stop()
+    tracker.end(time.monotonic() - start)
+    return message["content_type"]
+
+
+async def run_websocket(sessions, url, profile_name, query, model_id):
+    tracker = SessionTracker()
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *[websocket_session(tracker, url, profile_name, query, model_id) for _ in range(sessions)],
+        return_exceptions=True)
+    wall_time = time.monotonic() - start
+    failures = [result for result in results if result != "end"]
+    return tracker, wall_time, failures
+
+
+def report(title, sessions, tracker, wall_time, extra=""):
+    latencies = sorted(tracker.latencies)
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+    print(f"{title:<12} sessions={sessions:<4} peak_concurrent={tracker.peak:<4} wall={wall_time:7.2f}s "
+          f"p50={p50:6.2f}s p95={p95:6.2f}s throughput={len(latencies) / wall_time:6.2f}/s {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    simulate_parser = subparsers.add_parser("simulate")
+    simulate_parser.add_argument("--sessions", type=int, default=50)
+    simulate_parser.add_argument("--time-scale", type=float, default=0.1,
+                                 help="multiplier applied to the simulated stage latencies")
+
+    websocket_parser = subparsers.add_parser("websocket")
+    websocket_parser.add_argument("--url", default="ws://localhost:8000/qa/ws")
+    websocket_parser.add_argument("--profile", required=True)
+    websocket_parser.add_argument("--query", required=True)
+    websocket_parser.add_argument("--model-id", default="anthropic.claude-3-sonnet-20240229-v1:0")
+    websocket_parser.add_argument("--sessions", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.mode == "simulate":
+        for title, offload in (("before", False), ("after", True)):
+            tracker, wall_time, max_lag = asyncio.run(run_simulation(args.sessions, offload, args.time_scale))
+            report(title, args.sessions, tracker, wall_time, f"max_loop_lag={max_lag:.2f}s")
+    else:
+        tracker, wall_time, failures = asyncio.run(
+            run_websocket(args.sessions, args.url, args.profile, args.query, args.model_id))
+        report("websocket", args.sessions, tracker, wall_time, f"failures={len(failures)}")
+
+
+if __name__ == '__main__':
+    main()
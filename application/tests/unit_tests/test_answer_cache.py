@@ -0,0 +1,79 @@
+import unittest
+
+from nlq.business.answer_cache import AnswerCache, get_profile_fingerprint, get_rls_identity
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = AnswerCache(similarity_threshold=0.95, ttl=3600, max_entries=3)
+        self.profile = {'tables_info': {'orders': 'CREATE TABLE orders (id int)'}, 'prompt_map': {},
+                        'row_level_security_config': None}
+        self.fingerprint = get_profile_fingerprint(self.profile)
+        self.partition_key = ('sales', 'claude', 'titan', '')
+
+    def test_similar_question_hits(self):
+        self.cache.put(self.partition_key, self.fingerprint, 'top 10 orders', [1.0, 0.0, 0.1],
+                       {'sql': 'SELECT * FROM orders LIMIT 10'})
+
+        answer, similarity = self.cache.lookup(self.partition_key, self.fingerprint, [0.99, 0.01, 0.1])
+        self.assertEqual(answer, {'sql': 'SELECT * FROM orders LIMIT 10'})
+        self.assertGreaterEqual(similarity, 0.95)
+
+        answer, _ = self.cache.lookup(self.partition_key, self.fingerprint, [0.0, 1.0, 0.0])
+        self.assertIsNone(answer)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_most_similar_entry_of_partition_wins(self):
+        self.cache.put(self.partition_key, self.fingerprint, 'orders by month', [1.0, 0.2, 0.0], {'sql': 'month'})
+        self.cache.put(self.partition_key, self.fingerprint, 'orders by day', [1.0, 0.0, 0.2], {'sql': 'day'})
+        self.cache.put(self.partition_key, self.fingerprint, 'orders by month', [1.0, 0.2, 0.0], {'sql': 'month2'})
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+        answer, _ = self.cache.lookup(self.partition_key, self.fingerprint, [1.0, 0.01, 0.19])
+        self.assertEqual(answer, {'sql': 'day'})
+        answer, _ = self.cache.lookup(self.partition_key, self.fingerprint, [1.0, 0.2, 0.0])
+        self.assertEqual(answer, {'sql': 'month2'})
+        answer, _ = self.cache.lookup(self.partition_key, self.fingerprint, [1.0, 0.2])
+        self.assertIsNone(answer)
+
+    def test_profile_change_and_invalidation_miss(self):
+        self.cache.put(self.partition_key, self.fingerprint, 'top 10 orders', [1.0, 0.0], {'sql': 'a'})
+        changed_profile = dict(self.profile, prompt_map={'text2sql': 'new prompt'})
+
+        answer, _ = self.cache.lookup(self.partition_key, get_profile_fingerprint(changed_profile), [1.0, 0.0])
+        self.assertIsNone(answer)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+        self.cache.put(self.partition_key, self.fingerprint, 'top 10 orders', [1.0, 0.0], {'sql': 'a'})
+        self.cache.invalidate_profile('sales')
+        answer, _ = self.cache.lookup(self.partition_key, self.fingerprint, [1.0, 0.0])
+        self.assertIsNone(answer)
+
+    def test_rls_identity_partitions_users(self):
+        rls_profile = dict(self.profile, row_level_security_config='tables: []')
+        self.assertEqual(get_rls_identity(self.profile, 'alice'), '')
+        self.assertEqual(get_rls_identity(rls_profile, 'alice'), 'alice')
+
+        alice_key = ('sales', 'claude', 'titan', get_rls_identity(rls_profile, 'alice'))
+        bob_key = ('sales', 'claude', 'titan', get_rls_identity(rls_profile, 'bob'))
+        fingerprint = get_profile_fingerprint(rls_profile)
+        self.cache.put(alice_key, fingerprint, 'my orders', [1.0, 0.0], {'sql': 'alice'})
+
+        answer, _ = self.cache.lookup(bob_key, fingerprint, [1.0, 0.0])
+        self.assertIsNone(answer)
+
+    def test_cached_answer_is_copied_and_bounded(self):
+        answer = {'rows': [1, 2]}
+        self.cache.put(self.partition_key, self.fingerprint, 'q1', [1.0, 0.0], answer)
+        answer['rows'].append(3)
+        cached_answer, _ = self.cache.lookup(self.partition_key, self.fingerprint, [1.0, 0.0])
+        cached_answer['rows'].append(4)
+        self.assertEqual(self.cache.lookup(self.partition_key, self.fingerprint, [1.0, 0.0])[0], {'rows': [1, 2]})
+
+        for index in range(5):
+            self.cache.put(('other', 'claude', 'titan', ''), self.fingerprint, f'q{index}', [0.0, 1.0], {})
+        self.assertLessEqual(self.cache.stats()['entries'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
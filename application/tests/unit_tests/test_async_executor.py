@@ -0,0 +1,50 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from utils import async_executor
+from utils.async_executor import get_model_semaphore, map_in_order
+from utils.bedrock_prompt_cache import add_token_info
+
+
+class TestAgentTaskExecutor(unittest.TestCase):
+    def test_results_keep_order_and_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def run_task(item):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.02 * (5 - item))
+            with lock:
+                in_flight[0] -= 1
+            if item == 3:
+                raise ValueError('invalid sql')
+            return item * 10
+
+        results = map_in_order(run_task, range(5), max_concurrency=2)
+        self.assertEqual([0, 10, 20, None, 40], [result for result, _ in results])
+        self.assertIsInstance(results[3][1], ValueError)
+        self.assertEqual(2, in_flight[1])
+
+    def test_model_semaphore_limits(self):
+        with mock.patch.object(async_executor, 'model_semaphores', {}), \
+                mock.patch.object(async_executor, 'LLM_MODEL_CONCURRENCY_OVERRIDES', {'slow-model': 1}):
+            semaphore = get_model_semaphore('slow-model')
+            self.assertIs(semaphore, get_model_semaphore('slow-model'))
+            self.assertTrue(semaphore.acquire(blocking=False))
+            self.assertFalse(semaphore.acquire(blocking=False))
+            semaphore.release()
+
+    def test_add_token_info(self):
+        total = {"input_tokens": 0, "output_tokens": 0}
+        add_token_info(total, {"input_tokens": 10, "output_tokens": 2, "cache_read_input_tokens": 8})
+        add_token_info(total, {"input_tokens": 5, "output_tokens": 1})
+        add_token_info(total, None)
+        self.assertEqual({"input_tokens": 15, "output_tokens": 3, "cache_read_input_tokens": 8}, total)
+
+
+if __name__ == '__main__':
+    unittest.main()
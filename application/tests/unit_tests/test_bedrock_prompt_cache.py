@@ -0,0 +1,79 @@
+import io
+import json
+import unittest
+
+from utils.bedrock_prompt_cache import build_claude3_prompt, get_token_info
+
+
+class BedrockStub:
+    """Local stand-in for bedrock-runtime that reports prompt cache usage like Bedrock does"""
+
+    def __init__(self):
+        self.cached_prefixes = set()
+
+    def invoke_model(self, body, modelId):
+        request = json.loads(body)
+        blocks = request["system"] if isinstance(request["system"], list) else [{"text": request["system"]}]
+        content = request["messages"][0]["content"]
+        blocks = blocks + (content if isinstance(content, list) else [{"text": content}])
+
+        usage = {"input_tokens": 0, "output_tokens": 5, "cache_read_input_tokens": 0,
+                 "cache_creation_input_tokens": 0}
+        prefix = ""
+        cached_length = 0
+        for block in blocks:
+            prefix += block["text"]
+            if "cache_control" in block:
+                cached_length = len(prefix)
+                if prefix in self.cached_prefixes:
+                    usage["cache_read_input_tokens"] = len(prefix)
+                else:
+                    usage["cache_creation_input_tokens"] = len(prefix) - usage["cache_read_input_tokens"]
+                    self.cached_prefixes.add(prefix)
+        usage["input_tokens"] = len(prefix) - cached_length
+        response_body = {"content": [{"type": "text", "text": "SELECT 1"}], "usage": usage}
+        return {"body": io.BytesIO(json.dumps(response_body).encode('utf-8'))}
+
+
+def invoke(client, prompt, with_cache_points):
+    system, messages = prompt
+    request = {"anthropic_version": "bedrock-2023-05-31", "max_tokens": 4096, "system": system, "messages": messages,
+               "temperature": 0.01}
+    response = client.invoke_model(body=json.dumps(request), modelId="anthropic.claude-3-5-sonnet-20240620-v1:0")
+    return get_token_info(json.loads(response["body"].read())["usage"], with_cache_points)
+
+
+class TestBedrockPromptCache(unittest.TestCase):
+    def setUp(self):
+        self.client = BedrockStub()
+        self.schema = "orders: sales orders\nCREATE TABLE orders (id int)\n"
+
+    def test_static_prefix_is_written_then_read(self):
+        first = build_claude3_prompt("You are a SQL expert", self.schema + "Question: top orders",
+                                     user_cache_prefix=self.schema, with_cache_points=True)
+        second = build_claude3_prompt("You are a SQL expert", self.schema + "Question: daily revenue",
+                                      user_cache_prefix=self.schema, with_cache_points=True)
+
+        first_usage = invoke(self.client, first, True)
+        second_usage = invoke(self.client, second, True)
+        self.assertGreater(first_usage["cache_creation_input_tokens"], 0)
+        self.assertEqual(0, first_usage["cache_read_input_tokens"])
+        self.assertEqual(len("You are a SQL expert" + self.schema), second_usage["cache_read_input_tokens"])
+        self.assertEqual(len("Question: daily revenue"), second_usage["input_tokens"])
+
+    def test_plain_request_without_cache_points(self):
+        system, messages = build_claude3_prompt("You are a SQL expert", self.schema + "Question: top orders",
+                                                user_cache_prefix=self.schema, with_cache_points=False)
+        self.assertEqual("You are a SQL expert", system)
+        self.assertEqual([{"role": "user", "content": self.schema + "Question: top orders"}], messages)
+
+    def test_prefix_mismatch_sends_single_block(self):
+        _, messages = build_claude3_prompt("system", "other text", user_cache_prefix=self.schema,
+                                           with_cache_points=True)
+        self.assertEqual([{"type": "text", "text": "other text"}], messages[0]["content"])
+        self.assertEqual({"cache_read_input_tokens": 0, "cache_creation_input_tokens": 0},
+                         get_token_info({}, with_cache_points=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import unittest
+
+from nlq.business.bulk_indexer import KIND_ENTITY, KIND_SQL, fake_embed_texts, run_bulk_indexer
+
+
+class LocalIndex:
+    """Stand-in for OpenSearch bulk writes, can fail once after a number of writes"""
+
+    def __init__(self, fail_after=None):
+        self.documents = []
+        self.fail_after = fail_after
+        self.writes = 0
+
+    def write_actions(self, actions):
+        if self.fail_after is not None and self.writes == self.fail_after:
+            self.fail_after = None
+            raise ConnectionError('cluster unavailable')
+        self.writes += 1
+        self.documents.extend(actions)
+        return len(actions), []
+
+    def get_documents(self, index_name, doc_ids):
+        indexed = {document['_id']: document for document in self.documents if document['_index'] == index_name}
+        return {doc_id: indexed[doc_id] for doc_id in doc_ids if doc_id in indexed}
+
+
+class TestBulkIndexer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.directory.name, 'samples.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_rows(self, rows):
+        with open(self.source_path, 'w', encoding='utf-8') as file:
+            for row in rows:
+                file.write(json.dumps(row) + '\n')
+
+    def test_resume_after_failure(self):
+        self.write_rows([{'question': f'question {index}', 'sql': f'select {index}'} for index in range(10)]
+                        + [{'question': '', 'sql': 'select 0'}])
+        local_index = LocalIndex(fail_after=2)
+        embed_texts = fake_embed_texts(8)
+
+        with self.assertRaises(ConnectionError):
+            run_bulk_indexer(self.source_path, KIND_SQL, 'demo', 'uba', embed_texts, local_index.write_actions,
+                             chunk_size=3, embedding_workers=2)
+        self.assertEqual(6, len(local_index.documents))
+
+        stats = run_bulk_indexer(self.source_path, KIND_SQL, 'demo', 'uba', embed_texts, local_index.write_actions,
+                                 chunk_size=3, embedding_workers=2)
+        self.assertEqual({'rows': 11, 'indexed': 10, 'failed': 0, 'skipped': 1}, stats)
+        self.assertEqual([f'question {index}' for index in range(10)],
+                         [document['text'] for document in local_index.documents])
+        document = local_index.documents[0]
+        self.assertEqual({'_index', '_id', 'text', 'sql', 'profile', 'vector_field'}, set(document))
+        self.assertEqual(embed_texts(['question 0'])[0], document['vector_field'])
+
+    def test_dimension_entity_document(self):
+        self.write_rows([{'entity': 'Beijing', 'entity_type': 'dimension',
+                          'entity_table_info': json.dumps([{'table_name': 'orders', 'column_name': 'city',
+                                                            'value': 'beijing'}])}])
+        local_index = LocalIndex()
+        run_bulk_indexer(self.source_path, KIND_ENTITY, 'demo', 'uba_ner', fake_embed_texts(4),
+                         local_index.write_actions)
+        document = local_index.documents[0]
+        self.assertEqual(1, document['entity_count'])
+        self.assertIn('is located in table orders, column city', document['comment'])
+
+    def test_dimension_values_are_merged_with_indexed_values(self):
+        def dimension_row(value):
+            return {'entity': 'Beijing', 'entity_type': 'dimension',
+                    'entity_table_info': [{'table_name': 'orders', 'column_name': 'city', 'value': value}]}
+
+        self.write_rows([dimension_row('beijing')])
+        local_index = LocalIndex()
+        run_bulk_indexer(self.source_path, KIND_ENTITY, 'demo', 'uba_ner', fake_embed_texts(4),
+                         local_index.write_actions, get_documents=local_index.get_documents)
+
+        self.write_rows([dimension_row('BJ'), dimension_row('Peking'), {'entity': 'GMV', 'comment': 'revenue'}])
+        stats = run_bulk_indexer(self.source_path, KIND_ENTITY, 'demo', 'uba_ner', fake_embed_texts(4),
+                                 local_index.write_actions, restart=True, get_documents=local_index.get_documents)
+        self.assertEqual(3, stats['indexed'])
+        document = local_index.get_documents('uba_ner', [local_index.documents[0]['_id']])[
+            local_index.documents[0]['_id']]
+        self.assertEqual(['Peking', 'BJ', 'beijing'], [item['value'] for item in document['entity_table_info']])
+        self.assertEqual(3, document['entity_count'])
+        self.assertEqual(3, document['comment'].count('is located in table orders'))
+
+
+if __name__ == '__main__':
+    unittest.main()
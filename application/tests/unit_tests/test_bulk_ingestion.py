@@ -0,0 +1,48 @@
+import threading
+import unittest
+
+from nlq.business.bulk_ingestion import dedupe_by_text, ingest_in_chunks, iter_chunks
+
+
+class TestBulkIngestion(unittest.TestCase):
+    def test_dedupe_keeps_last_item_at_first_position(self):
+        samples = [('q1', 'sql a'), ('q2', 'sql b'), (' q1 ', 'sql c')]
+        self.assertEqual([(' q1 ', 'sql c'), ('q2', 'sql b')], dedupe_by_text(samples, lambda sample: sample[0]))
+
+    def test_iter_chunks(self):
+        self.assertEqual([[1, 2], [3, 4], [5]], list(iter_chunks(range(1, 6), 2)))
+
+    def test_ingest_in_chunks(self):
+        embedded = []
+        written = []
+        lock = threading.Lock()
+
+        def embed_texts(texts):
+            embedded.append(list(texts))
+            if 'broken' in texts:
+                raise RuntimeError('throttled')
+            return [[float(len(text))] for text in texts]
+
+        def write_chunk(chunk, embeddings):
+            with lock:
+                written.extend(zip(chunk, embeddings))
+            return len(chunk), 0, 0
+
+        progress = []
+        samples = [(f'question {index}', 'select 1') for index in range(5)] + [('question 0', 'select 2'),
+                                                                            ('broken', '')]
+        report = ingest_in_chunks(samples, lambda sample: sample[0], embed_texts, write_chunk, chunk_size=2,
+                                  on_progress=lambda each_report: progress.append(each_report.processed))
+
+        self.assertEqual([['question 0', 'question 1'], ['question 2', 'question 3'], ['question 4', 'broken']],
+                         embedded)
+        self.assertEqual(1, report.duplicates)
+        self.assertEqual(6, report.processed)
+        self.assertEqual(4, report.indexed)
+        self.assertEqual(2, report.failed)
+        self.assertEqual([2, 4, 6], progress)
+        self.assertIn((('question 0', 'select 2'), [10.0]), written)
+
+
+if __name__ == '__main__':
+    unittest.main()
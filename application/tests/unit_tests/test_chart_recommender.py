@@ -0,0 +1,85 @@
+import datetime
+import decimal
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from utils import chart_recommender
+from utils.chart_recommender import is_chart_recommender_enabled, recommend_chart
+
+
+class TestRecommendChart(unittest.TestCase):
+    def test_recommendations(self):
+        cases = [
+            ('month and measure is a line',
+             pd.DataFrame({'month': ['2024-01', '2024-02', '2024-03'], 'sales': [10, 20, 15]}),
+             'line', [['month', 'sales']]),
+            ('date objects and decimal measure is a line',
+             pd.DataFrame({'order_date': [datetime.date(2024, 1, day) for day in range(1, 4)],
+                           'revenue': [decimal.Decimal('1.5'), decimal.Decimal('2.5'), decimal.Decimal('3')]}),
+             'line', [['order_date', 'revenue']]),
+            ('few categories and positive measure is a pie',
+             pd.DataFrame({'region': ['east', 'west', 'north'], 'orders': [5, 7, 3]}),
+             'pie', [['region', 'orders']]),
+            ('more categories is a bar',
+             pd.DataFrame({'city': [f'city {index}' for index in range(10)], 'orders': list(range(10))}),
+             'bar', [['city', 'orders']]),
+            ('negative measure is a bar',
+             pd.DataFrame({'region': ['east', 'west'], 'profit': [5, -2]}),
+             'bar', [['region', 'profit']]),
+            ('single kpi is a table',
+             pd.DataFrame({'total_sales': [1234]}),
+             'table', [['total_sales']]),
+            ('single row is a table',
+             pd.DataFrame({'region': ['east'], 'orders': [5]}),
+             'table', [['region', 'orders']]),
+            ('wide result is a table',
+             pd.DataFrame({'a': [1, 2], 'b': [3, 4], 'c': ['x', 'y'], 'd': [5, 6]}),
+             'table', [['a', 'b', 'c', 'd']]),
+            ('high cardinality categories is a table',
+             pd.DataFrame({'customer': [f'customer {index}' for index in range(50)], 'orders': list(range(50))}),
+             'table', [['customer', 'orders']]),
+            ('two categories is a table',
+             pd.DataFrame({'name': ['a', 'b'], 'city': ['x', 'y']}),
+             'table', [['name', 'city']]),
+            ('codes with leading zeros are categories',
+             pd.DataFrame({'zip': ['01234', '02345'], 'code': ['0012', '0034']}),
+             'table', [['zip', 'code']]),
+        ]
+        for name, data, show_type, format_data in cases:
+            with self.subTest(name):
+                self.assertEqual({"show_type": show_type, "format_data": format_data}, recommend_chart(data))
+
+    def test_ambiguous_results_are_left_to_the_llm(self):
+        cases = [
+            ('empty result', pd.DataFrame({'region': [], 'orders': []})),
+            ('three columns', pd.DataFrame({'month': ['2024-01', '2024-02'], 'region': ['a', 'b'], 'x': [1, 2]})),
+            ('repeated categories', pd.DataFrame({'region': ['east', 'east', 'west'], 'orders': [1, 2, 3]})),
+            ('two numbers', pd.DataFrame({'year': [2023, 2024], 'orders': [1, 2]})),
+        ]
+        for name, data in cases:
+            with self.subTest(name):
+                self.assertIsNone(recommend_chart(data))
+
+
+class TestChartRecommenderFlag(unittest.TestCase):
+    def test_flag_parsing(self):
+        cases = [
+            (True, True), (False, False), ('true', True), ('True', True), ('false', False), ('False', False),
+            ('0', False), ('no', False),
+        ]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(expected, is_chart_recommender_enabled({'chart_recommender': value}))
+
+    def test_unset_flag_uses_default(self):
+        for profile in [None, {}, {'chart_recommender': None}, {'chart_recommender': ''}]:
+            for default in [True, False]:
+                with self.subTest(profile=profile, default=default), \
+                        mock.patch.object(chart_recommender, 'CHART_RECOMMENDER_ENABLED', default):
+                    self.assertEqual(default, is_chart_recommender_enabled(profile))
+
+
+if __name__ == '__main__':
+    unittest.main()
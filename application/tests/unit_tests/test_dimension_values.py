@@ -0,0 +1,46 @@
+import unittest
+
+from nlq.business.dimension_values import group_dimension_values, parse_dimension_column, plan_dimension_refresh
+
+
+def dimension_value(table_name, value):
+    return {'table_name': table_name, 'column_name': 'city', 'value': value}
+
+
+class TestDimensionValues(unittest.TestCase):
+    def test_parse_dimension_column(self):
+        self.assertEqual(('sales.orders', 'city'), parse_dimension_column('sales.orders.city'))
+        with self.assertRaises(ValueError):
+            parse_dimension_column('city')
+
+    def test_same_values_are_grouped_across_tables(self):
+        values = {
+            ('orders', 'city'): [['Beijing', 'Shanghai'], [' Beijing ', None, '', 'x' * 1000]],
+            ('customers', 'city'): [['Beijing']],
+        }
+        entities = group_dimension_values([('orders', 'city'), ('customers', 'city')],
+                                          lambda table_name, column_name: iter(values[(table_name, column_name)]))
+        self.assertEqual({'Beijing': [dimension_value('orders', 'Beijing'), dimension_value('customers', 'Beijing')],
+                          'Shanghai': [dimension_value('orders', 'Shanghai')]}, entities)
+
+    def test_only_new_entities_are_embedded(self):
+        entities = {
+            'Beijing': [dimension_value('orders', 'Beijing')],
+            'Shanghai': [dimension_value('orders', 'Shanghai'), dimension_value('customers', 'Shanghai')],
+            'Shenzhen': [dimension_value('orders', 'Shenzhen')],
+            'GMV': [dimension_value('orders', 'GMV')],
+        }
+        indexed = {
+            'Beijing': {'entity_type': 'dimension', 'entity_table_info': [dimension_value('orders', 'Beijing')]},
+            'Shanghai': {'entity_type': 'dimension', 'entity_table_info': [dimension_value('orders', 'Shanghai')]},
+            'GMV': {'entity_type': 'metrics', 'entity_table_info': []},
+        }
+        plan = plan_dimension_refresh(entities, indexed)
+        self.assertEqual([('Shenzhen', entities['Shenzhen'])], plan.new)
+        self.assertEqual([('Shanghai', entities['Shanghai'])], plan.updates)
+        self.assertEqual(1, plan.unchanged)
+        self.assertEqual(['GMV'], plan.conflicts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from array import array
+
+from utils.embedding_cache import EmbeddingCache, SqliteEmbeddingStore, get_cache_key
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def fake_embedding(self, text):
+        self.calls.append(text)
+        return [float(len(text)), 0.5, -0.25]
+
+    def test_hit_after_miss_and_normalized_key(self):
+        cache = EmbeddingCache(max_bytes=1024 * 1024)
+        first = cache.get_or_create('titan', 3, 'top 10 products', self.fake_embedding)
+        second = cache.get_or_create('titan', 3, '  top 10\tproducts ', self.fake_embedding)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_key_contains_model_and_dimension(self):
+        self.assertNotEqual(get_cache_key('titan', 1536, 'sales'), get_cache_key('titan', 1024, 'sales'))
+        self.assertNotEqual(get_cache_key('titan', 1536, 'sales'), get_cache_key('bge', 1536, 'sales'))
+
+    def test_lru_eviction_bounded_by_bytes(self):
+        one_entry_bytes = EmbeddingCache._entry_size(array('f', [0.0] * 3))
+        cache = EmbeddingCache(max_bytes=one_entry_bytes * 2)
+        cache.put('titan', 3, 'a', [1.0, 2.0, 3.0])
+        cache.put('titan', 3, 'b', [1.0, 2.0, 3.0])
+        cache.get('titan', 3, 'a')
+        cache.put('titan', 3, 'c', [1.0, 2.0, 3.0])
+
+        self.assertIsNotNone(cache.get('titan', 3, 'a'))
+        self.assertIsNone(cache.get('titan', 3, 'b'))
+        self.assertLessEqual(cache.stats()['bytes'], one_entry_bytes * 2)
+
+    def test_persistent_tier_survives_memory_clear(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = SqliteEmbeddingStore(os.path.join(tmp_dir, 'embedding.db'))
+            cache = EmbeddingCache(max_bytes=1024 * 1024, persistent_store=store)
+            cache.put('titan', 3, 'revenue', [0.25, 0.5, 0.75])
+            cache.clear()
+
+            self.assertEqual(cache.get('titan', 3, 'revenue'), [0.25, 0.5, 0.75])
+            self.assertEqual(cache.stats()['persistent_hits'], 1)
+            store.connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+from nlq.business.bulk_indexer import KIND_ENTITY, KIND_SQL
+from nlq.business.index_maintenance import find_near_duplicates, migrate_document_ids
+from nlq.data_access.opensearch_documents import build_sample_record, get_document_id
+
+
+def dimension_value(value):
+    return {'table_name': 'orders', 'column_name': 'city', 'value': value}
+
+
+class LocalIndex:
+    """Stand-in for an OpenSearch index with bulk writes and get by id"""
+
+    def __init__(self, documents):
+        self.documents = {doc_id: source for doc_id, source in documents}
+
+    def hits(self):
+        return [{'_id': doc_id, '_source': source} for doc_id, source in list(self.documents.items())]
+
+    def write_actions(self, actions):
+        for action in actions:
+            if action.get('_op_type') == 'delete':
+                del self.documents[action['_id']]
+            else:
+                self.documents[action['_id']] = {key: value for key, value in action.items()
+                                                 if not key.startswith('_')}
+        return len(actions), []
+
+    def get_documents(self, index_name, doc_ids):
+        return {doc_id: self.documents[doc_id] for doc_id in doc_ids if doc_id in self.documents}
+
+
+class TestDocumentId(unittest.TestCase):
+    def test_same_text_and_profile_share_the_id(self):
+        self.assertEqual(get_document_id('demo', 'top 10 users'), get_document_id('demo', ' top  10\tusers '))
+        self.assertNotEqual(get_document_id('demo', 'top 10 users'), get_document_id('other', 'top 10 users'))
+        self.assertNotEqual(get_document_id('demo', 'top 10 users'), get_document_id('demo', 'Top 10 users'))
+        record = build_sample_record('uba', 'demo', 'top 10 users', 'select 1', [0.1])
+        self.assertEqual(get_document_id('demo', 'top 10 users'), record['_id'])
+
+
+class TestMigrateDocumentIds(unittest.TestCase):
+    def test_duplicates_collapse_into_the_deterministic_id(self):
+        local_index = LocalIndex([
+            ('random-1', {'text': 'top users', 'sql': 'select 1', 'profile': 'demo', 'vector_field': [1.0]}),
+            ('random-2', {'text': 'top  users', 'sql': 'select 2', 'profile': 'demo', 'vector_field': [1.0]}),
+            ('random-3', {'text': 'top users', 'sql': 'select 3', 'profile': 'other', 'vector_field': [1.0]}),
+            (get_document_id('demo', 'new'), {'text': 'new', 'sql': 'select 4', 'profile': 'demo'}),
+        ])
+        stats = migrate_document_ids(local_index.hits(), KIND_SQL, 'uba', local_index.write_actions,
+                                     local_index.get_documents, batch_size=2)
+        self.assertEqual({'documents': 4, 'unchanged': 1, 'migrated': 3, 'merged': 1, 'failed': 0, 'skipped': 0},
+                         stats)
+        self.assertEqual({get_document_id('demo', 'top users'), get_document_id('other', 'top users'),
+                          get_document_id('demo', 'new')}, set(local_index.documents))
+        self.assertEqual('select 2', local_index.documents[get_document_id('demo', 'top users')]['sql'])
+
+        rerun = migrate_document_ids(local_index.hits(), KIND_SQL, 'uba', local_index.write_actions,
+                                     local_index.get_documents)
+        self.assertEqual(3, rerun['unchanged'])
+
+    def test_dry_run_writes_nothing(self):
+        local_index = LocalIndex([('random-1', {'text': 'top users', 'sql': 'select 1', 'profile': 'demo'})])
+        stats = migrate_document_ids(local_index.hits(), KIND_SQL, 'uba', local_index.write_actions,
+                                     local_index.get_documents, dry_run=True)
+        self.assertEqual(1, stats['migrated'])
+        self.assertEqual(['random-1'], list(local_index.documents))
+
+    def test_dimension_values_are_merged(self):
+        doc_id = get_document_id('demo', 'Beijing')
+        local_index = LocalIndex([
+            ('random-1', {'entity': 'Beijing', 'entity_type': 'dimension', 'profile': 'demo', 'comment': '',
+                          'entity_table_info': [dimension_value('beijing')]}),
+            (doc_id, {'entity': 'Beijing', 'entity_type': 'dimension', 'profile': 'demo', 'comment': '',
+                      'entity_table_info': [dimension_value('BJ')]}),
+        ])
+        migrate_document_ids(local_index.hits(), KIND_ENTITY, 'uba_ner', local_index.write_actions,
+                             local_index.get_documents)
+        document = local_index.documents[doc_id]
+        self.assertEqual([doc_id], list(local_index.documents))
+        self.assertEqual(['BJ', 'beijing'], [item['value'] for item in document['entity_table_info']])
+        self.assertEqual(2, document['entity_count'])
+        self.assertIn('the dimension value is beijing', document['comment'])
+
+
+class TestFindNearDuplicates(unittest.TestCase):
+    def test_near_duplicates_of_a_profile(self):
+        hits = [
+            {'_id': 'a', '_source': {'text': 'top users', 'profile': 'demo', 'vector_field': [1.0, 0.0]}},
+            {'_id': 'b', '_source': {'text': 'top users?', 'profile': 'demo', 'vector_field': [0.999, 0.01]}},
+            {'_id': 'c', '_source': {'text': 'daily sales', 'profile': 'demo', 'vector_field': [0.0, 1.0]}},
+        ]
+
+        def search_similar(profile_name, embeddings, top_k):
+            return [hits for _ in embeddings]
+
+        groups = find_near_duplicates(hits, KIND_SQL, search_similar, min_similarity=0.99)
+        self.assertEqual([('a', ['b'])], [(kept['_id'], [hit['_id'] for hit in duplicates])
+                                          for kept, duplicates in groups])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import time
+import unittest
+
+from nlq.business.intent_classifier import IntentClassifierRegistry, IntentClassifierStats, build_intent_classifier
+
+EMBEDDINGS = {
+    'total sales last month': [1.0, 0.0, 0.0],
+    'sales by region last month': [0.95, 0.05, 0.0],
+    'why did sales drop and what drove it': [0.0, 1.0, 0.0],
+    'what does gmv mean': [0.0, 0.0, 1.0],
+}
+
+
+def embed_texts(texts):
+    return [EMBEDDINGS[text] for text in texts]
+
+
+class TestIntentClassifier(unittest.TestCase):
+    def setUp(self):
+        self.classifier = build_intent_classifier([
+            ('total sales last month', 'normal_search'),
+            ('sales by region last month', 'normal_search'),
+            ('why did sales drop and what drove it', 'agent_search'),
+            ('what does gmv mean', 'knowledge_search'),
+            ('total sales last month', 'agent_search'),
+            ('what does gmv mean', 'unknown_intent'),
+        ], embed_texts)
+
+    def test_newest_label_is_kept(self):
+        self.assertEqual(4, len(self.classifier))
+        self.assertEqual('normal_search', self.classifier.intents[self.classifier.queries.index(
+            'total sales last month')])
+
+    def test_confident_and_ambiguous_predictions(self):
+        prediction = self.classifier.predict([0.98, 0.02, 0.0], k=2, min_similarity=0.9, min_confidence=0.8)
+        self.assertEqual('normal_search', prediction.intent)
+        self.assertTrue(prediction.confident)
+
+        prediction = self.classifier.predict([0.6, 0.6, 0.0], k=3, min_similarity=0.9, min_confidence=0.8)
+        self.assertFalse(prediction.confident)
+
+    def test_k_larger_than_examples_and_other_dimension(self):
+        prediction = self.classifier.predict([0.0, 0.0, 2.0], k=10, min_similarity=0.9, min_confidence=0.5)
+        self.assertEqual('knowledge_search', prediction.intent)
+        self.assertAlmostEqual(1.0, prediction.similarity)
+        self.assertIsNone(self.classifier.predict([1.0, 0.0], k=2))
+        self.assertIsNone(build_intent_classifier([], embed_texts).predict([1.0, 0.0, 0.0]))
+
+    def test_registry_builds_in_background(self):
+        registry = IntentClassifierRegistry(refresh_interval=3600)
+        examples = [('total sales last month', 'normal_search')]
+        self.assertIsNone(registry.get('demo', lambda profile_name, size: examples, embed_texts))
+        for _ in range(100):
+            if 'demo' in registry.classifiers:
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, len(registry.classifiers['demo'][0]))
+
+    def test_shadow_stats(self):
+        stats = IntentClassifierStats()
+        stats.record_comparison('normal_search', 'normal_search')
+        stats.record_comparison('normal_search', 'agent_search')
+        self.assertEqual(0.5, stats.stats()['accuracy'])
+        self.assertEqual({'normal_search->normal_search': 1, 'normal_search->agent_search': 1},
+                         stats.stats()['confusion'])
+
+
+if __name__ == '__main__':
+    unittest.main()
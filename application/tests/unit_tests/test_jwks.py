@@ -0,0 +1,78 @@
+import base64
+import json
+import time
+import unittest
+
+from utils.jwks import JwksCache, JwksKeyError, TokenVerifier, VerifiedTokenCache
+
+
+def encode_segment(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+def make_token(kid, claims):
+    return f"{encode_segment({'alg': 'RS256', 'kid': kid})}.{encode_segment(claims)}.signature"
+
+
+class LocalJwks:
+    """Stand-in for the Cognito JWKS endpoint"""
+
+    def __init__(self, kids):
+        self.kids = list(kids)
+        self.fetch_count = 0
+
+    def fetch(self):
+        self.fetch_count += 1
+        return {"keys": [{"kid": kid, "kty": "RSA"} for kid in self.kids]}
+
+
+def verify_signature(token, key, audience=None, access_token=None):
+    header_segment, payload_segment, _ = token.split('.')
+    if json.loads(base64.urlsafe_b64decode(header_segment + '==')).get('kid') != key['kid']:
+        raise ValueError('signature verification failed')
+    return json.loads(base64.urlsafe_b64decode(payload_segment + '=='))
+
+
+class TestJwks(unittest.TestCase):
+    def setUp(self):
+        self.jwks = LocalJwks(['key-1'])
+        self.token_cache = VerifiedTokenCache(ttl=60)
+        self.verifier = TokenVerifier(JwksCache(self.jwks.fetch, ttl=3600, min_refetch_interval=0),
+                                      self.token_cache, verify_signature)
+
+    def test_keys_and_tokens_are_cached(self):
+        token = make_token('key-1', {'username': 'alice', 'exp': time.time() + 300})
+        other_token = make_token('key-1', {'username': 'bob', 'exp': time.time() + 300})
+
+        self.assertEqual(self.verifier.decode(token)['username'], 'alice')
+        self.assertEqual(self.verifier.decode(token)['username'], 'alice')
+        self.assertEqual(self.verifier.decode(other_token)['username'], 'bob')
+        self.assertEqual(self.jwks.fetch_count, 1)
+
+    def test_unknown_kid_refetches_jwks(self):
+        self.verifier.decode(make_token('key-1', {'username': 'alice'}))
+        self.jwks.kids.append('key-2')
+
+        self.assertEqual(self.verifier.decode(make_token('key-2', {'username': 'bob'}))['username'], 'bob')
+        self.assertEqual(self.jwks.fetch_count, 2)
+        with self.assertRaises(JwksKeyError):
+            self.verifier.decode(make_token('key-3', {'username': 'eve'}))
+
+    def test_expired_token_is_not_served_from_cache(self):
+        token = make_token('key-1', {'username': 'alice', 'exp': time.time() - 1})
+        self.token_cache.put(token, {'username': 'alice', 'exp': time.time() - 1})
+        self.assertIsNone(self.token_cache.get(token))
+
+    def test_ttl_refresh_keeps_keys_when_endpoint_fails(self):
+        jwks_cache = JwksCache(self.jwks.fetch, ttl=0, min_refetch_interval=0)
+        self.assertIsNotNone(jwks_cache.get_key('key-1'))
+
+        def unreachable():
+            raise ConnectionError('unreachable')
+
+        jwks_cache.fetch_jwks = unreachable
+        self.assertIsNotNone(jwks_cache.get_key('key-1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
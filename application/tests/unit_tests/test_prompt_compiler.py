@@ -0,0 +1,31 @@
+import unittest
+
+from utils.prompts.generate_prompt import CompiledTemplate, generate_llm_prompt, prompt_cache, prompt_map_dict
+
+MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
+
+
+class TestPromptCompiler(unittest.TestCase):
+    def test_render_matches_format(self):
+        template = "schema {sql_schema} {{literal}}\nexamples {examples}\nquestion {question} {examples}"
+        compiled = CompiledTemplate(template, {"sql_schema": "t: {not a field}"}, ["examples", "question"])
+        self.assertEqual(template.format(sql_schema="t: {not a field}", examples="Q {x}", question="why?"),
+                         compiled.render(examples="Q {x}", question="why?"))
+
+    def test_compiled_prompt_is_reused_per_profile_version(self):
+        tables_info = {"orders": {"ddl": "CREATE TABLE orders (id int)", "description": "orders"}}
+        sql_examples = [{"_source": {"text": "count orders", "sql": "SELECT COUNT(*) FROM orders"}}]
+        expected = generate_llm_prompt(tables_info, '', prompt_map_dict, "top orders", sql_examples,
+                                       model_id=MODEL_ID, dialect='redshift')
+
+        prompt_cache.clear()
+        misses = prompt_cache.misses
+        for _ in range(3):
+            self.assertEqual(expected, generate_llm_prompt(tables_info, '', prompt_map_dict, "top orders",
+                                                           sql_examples, model_id=MODEL_ID, dialect='redshift',
+                                                           profile_version='sales:1'))
+        self.assertEqual(misses + 1, prompt_cache.misses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from nlq.business.datasource.factory import DataSourceFactory
+from nlq.business.datasource.mysql import MySQLDataSource
+
+
+class TestRowLimit(unittest.TestCase):
+    def setUp(self):
+        self.base = MySQLDataSource()
+
+    def test_append_limit(self):
+        self.assertEqual("SELECT * FROM orders\nLIMIT 1001", self.base.inject_row_limit("SELECT * FROM orders;", 1001))
+        self.assertEqual("WITH t AS (SELECT * FROM orders LIMIT 5) SELECT * FROM t\nLIMIT 1001",
+                         self.base.inject_row_limit("WITH t AS (SELECT * FROM orders LIMIT 5) SELECT * FROM t", 1001))
+
+    def test_keep_smaller_limit_and_lower_larger_limit(self):
+        self.assertEqual("SELECT * FROM orders LIMIT 10", self.base.inject_row_limit("SELECT * FROM orders LIMIT 10", 1001))
+        self.assertEqual("SELECT * FROM orders LIMIT 1001 OFFSET 20",
+                         self.base.inject_row_limit("SELECT * FROM orders LIMIT 50000 OFFSET 20", 1001))
+        self.assertEqual("SELECT * FROM orders LIMIT 20, 1001",
+                         self.base.inject_row_limit("SELECT * FROM orders LIMIT 20, 50000", 1001))
+
+    def test_skip_non_select(self):
+        self.assertEqual("SHOW TABLES", self.base.inject_row_limit("SHOW TABLES", 1001))
+        self.assertEqual("SELECT 1; SELECT 2", self.base.inject_row_limit("SELECT 1; SELECT 2", 1001))
+
+
+class TestRowLimitDialects(unittest.TestCase):
+    def test_limit_dialects_get_limit(self):
+        for db_type in ['mysql', 'postgresql', 'redshift', 'starrocks', 'clickhouse', 'hive', 'athena', 'bigquery']:
+            with self.subTest(db_type=db_type):
+                self.assertTrue(DataSourceFactory.get_data_source(db_type).support_limit_injection())
+                self.assertEqual("SELECT * FROM orders\nLIMIT 1001",
+                                 DataSourceFactory.apply_row_limit_for_sql(db_type, "SELECT * FROM orders", 1001))
+
+    def test_other_dialects_are_left_to_fetch_cap(self):
+        for db_type in ['presto', 'sqlserver', 'oracle', None]:
+            with self.subTest(db_type=db_type):
+                self.assertFalse(DataSourceFactory.get_data_source(db_type).support_limit_injection())
+                self.assertEqual("SELECT TOP 10 * FROM orders",
+                                 DataSourceFactory.apply_row_limit_for_sql(db_type, "SELECT TOP 10 * FROM orders", 1001))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+from utils.schema_metadata_cache import SchemaMetadataCache, get_schema_fingerprint
+
+
+def get_table(table_name):
+    return {'name': table_name, 'comment': None, 'columns': [{'name': 'id', 'type': 'INTEGER', 'comment': None}]}
+
+
+class TestSchemaMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.fingerprint = 'v1'
+        self.reflected = []
+
+    def get_fingerprint(self):
+        return self.fingerprint
+
+    def reflect_tables(self, table_names):
+        self.reflected.append(list(table_names))
+        return {table_name: get_table(table_name) for table_name in table_names if table_name != 'sales.missing'}
+
+    def test_only_missing_tables_are_reflected(self):
+        cache = SchemaMetadataCache(ttl=3600, check_interval=60)
+        tables = cache.get_tables('conn', 'sales', ['sales.orders'], self.get_fingerprint, self.reflect_tables)
+        self.assertEqual(['sales.orders'], list(tables))
+        tables = cache.get_tables('conn', 'sales', ['sales.orders', 'sales.users', 'sales.missing'],
+                                  self.get_fingerprint, self.reflect_tables)
+        self.assertEqual(['sales.orders', 'sales.users'], list(tables))
+        self.assertEqual([['sales.orders'], ['sales.users', 'sales.missing']], self.reflected)
+        self.assertEqual(1, cache.stats()['hits'])
+
+    def test_changed_schema_is_reflected_again(self):
+        cache = SchemaMetadataCache(ttl=3600, check_interval=60)
+        with mock.patch('utils.schema_metadata_cache.time.monotonic', return_value=1000.0):
+            cache.get_tables('conn', 'sales', ['sales.orders'], self.get_fingerprint, self.reflect_tables)
+        with mock.patch('utils.schema_metadata_cache.time.monotonic', return_value=1030.0):
+            # within the check interval the fingerprint is not read
+            self.fingerprint = 'v2'
+            cache.get_tables('conn', 'sales', ['sales.orders'], self.get_fingerprint, self.reflect_tables)
+        self.assertEqual(1, len(self.reflected))
+        with mock.patch('utils.schema_metadata_cache.time.monotonic', return_value=1100.0):
+            cache.get_tables('conn', 'sales', ['sales.orders'], self.get_fingerprint, self.reflect_tables)
+        self.assertEqual(2, len(self.reflected))
+
+    def test_failed_check_keeps_the_cached_tables(self):
+        cache = SchemaMetadataCache(ttl=3600, check_interval=0)
+        cache.get_tables('conn', 'sales', ['sales.orders'], self.get_fingerprint, self.reflect_tables)
+        self.fingerprint = None
+        cache.get_tables('conn', 'sales', ['sales.orders'], self.get_fingerprint, self.reflect_tables)
+        self.assertEqual(1, len(self.reflected))
+
+    def test_table_names_and_invalidation(self):
+        cache = SchemaMetadataCache(ttl=3600, check_interval=60)
+        list_tables = mock.Mock(return_value=['sales.orders'])
+        cache.get_table_names('conn', 'sales', self.get_fingerprint, list_tables)
+        self.assertEqual(['sales.orders'], cache.get_table_names('conn', 'sales', self.get_fingerprint, list_tables))
+        cache.invalidate_connection('conn')
+        cache.get_table_names('conn', 'sales', self.get_fingerprint, list_tables)
+        self.assertEqual(2, list_tables.call_count)
+
+    def test_fingerprint_ignores_row_order(self):
+        rows = [('orders', 'id', 'integer'), ('orders', 'city', None)]
+        self.assertEqual(get_schema_fingerprint(rows), get_schema_fingerprint(list(reversed(rows))))
+        self.assertNotEqual(get_schema_fingerprint(rows), get_schema_fingerprint(rows[:1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+
+from nlq.business import schema_retrieval
+from nlq.business.schema_retrieval import SchemaIndex, get_foreign_key_neighbours, prune_tables_info, tokenize
+
+
+def make_tables_info(count):
+    tables_info = {
+        'orders': {'ddl': 'CREATE TABLE orders (order_id int, customer_id int REFERENCES customers(customer_id), '
+                          'order_amount decimal, order_date date)', 'description': 'sales orders'},
+        'customers': {'ddl': 'CREATE TABLE customers (customer_id int, customer_name varchar, city varchar)',
+                      'description': 'customer master data'},
+        'products': {'ddl': 'CREATE TABLE products (product_id int, product_name varchar, category varchar)',
+                     'tbl_a': 'product catalog', 'col_a': 'product_id: id\nproduct_name: name\ncategory: category'},
+    }
+    for index in range(count - len(tables_info)):
+        tables_info[f'log_table_{index}'] = {'ddl': f'CREATE TABLE log_table_{index} (event_id int, payload text)',
+                                             'description': 'application event log'}
+    return tables_info
+
+
+class TestSchemaRetrieval(unittest.TestCase):
+    def test_tokenize_splits_identifiers(self):
+        self.assertEqual(['order_amount', 'order', 'amount', 'productname', 'customerid', 'customer', 'id'],
+                         tokenize('order_amount productname customerId'))
+
+    def test_foreign_key_neighbours(self):
+        neighbours = get_foreign_key_neighbours(make_tables_info(3))
+        self.assertEqual({'customers'}, neighbours['orders'])
+        self.assertEqual({'orders'}, neighbours['customers'])
+        self.assertEqual(set(), neighbours['products'])
+
+    def test_select_adds_neighbours_and_rejects_low_confidence(self):
+        schema_index = SchemaIndex(make_tables_info(30))
+        self.assertEqual(['orders', 'customers'], schema_index.select('total order amount by day', top_n=1))
+        self.assertEqual(['products'], schema_index.select('how many products per category', top_n=1))
+        self.assertIsNone(schema_index.select('weather tomorrow', top_n=1))
+
+    def test_common_token_and_unrelated_embedding_is_no_match(self):
+        tables_info = {f't{index}': {'ddl': f'CREATE TABLE t{index} (id int, value_{index} int)'}
+                       for index in range(30)}
+        schema_index = SchemaIndex(tables_info, lambda texts: [[0.0, 1.0, 0.0] if text.startswith('t5\n')
+                                                               else [1.0, 0.0, 0.0] for text in texts])
+        self.assertIsNone(schema_index.select('what is the id', [0.0, 0.0, 1.0]))
+        self.assertEqual(['t5'], schema_index.select('what is the id', [0.0, 1.0, 0.0], top_n=1))
+        self.assertEqual(['t3'], schema_index.select('value_3 by id', [0.0, 0.0, 1.0], top_n=1))
+
+    def test_prune_falls_back_to_full_schema(self):
+        tables_info = make_tables_info(30)
+        with mock.patch.object(schema_retrieval, 'SCHEMA_PRUNING_ENABLED', True), \
+                mock.patch.object(schema_retrieval, 'SCHEMA_PRUNING_TOP_N', 1):
+            self.assertEqual(['products'], list(prune_tables_info('demo', tables_info, 'products per category')))
+            self.assertIs(tables_info, prune_tables_info('demo', tables_info, 'weather tomorrow'))
+            small_tables_info = make_tables_info(3)
+            self.assertIs(small_tables_info, prune_tables_info('small', small_tables_info, 'products per category'))
+
+            embedded = []
+
+            def failing_embedding(texts):
+                embedded.append(texts)
+                raise RuntimeError('embedding endpoint unavailable')
+
+            # the tables are embedded once, then lexical pruning is used until the retry interval passed
+            self.assertEqual(['products'], list(prune_tables_info('broken', tables_info, 'products per category',
+                                                                  failing_embedding)))
+            self.assertEqual(['products'], list(prune_tables_info('broken', tables_info, 'products per category',
+                                                                  failing_embedding)))
+            self.assertEqual(1, len(embedded))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import unittest
+
+from utils import sql_result_cache
+from utils.sql_result_cache import get_result_cache_key, get_result_cache_ttl, normalize_sql
+
+
+class TestSqlResultCacheKey(unittest.TestCase):
+    def test_comments_and_whitespace_do_not_change_the_key(self):
+        self.assertEqual("SELECT a FROM t WHERE x = 'Some  Text'",
+                         normalize_sql("SELECT  a -- first column\n  FROM t\nWHERE x = 'Some  Text';"))
+        self.assertEqual(get_result_cache_key('conn', 'SELECT a FROM t'),
+                         get_result_cache_key('conn', '/* cached */ SELECT a\nFROM t;'))
+
+    def test_case_changes_the_key(self):
+        self.assertNotEqual(get_result_cache_key('conn', 'SELECT "Date" FROM t'),
+                            get_result_cache_key('conn', 'SELECT "DATE" FROM t'))
+        self.assertNotEqual(get_result_cache_key('conn', 'SELECT a FROM t'),
+                            get_result_cache_key('other', 'SELECT a FROM t'))
+
+
+class TestSqlResultCacheTtl(unittest.TestCase):
+    def test_profiles_opt_in(self):
+        if 'SQL_RESULT_CACHE_TTL' not in os.environ:
+            self.assertEqual(0, sql_result_cache.SQL_RESULT_CACHE_TTL)
+        for profile in [{}, {'result_cache_ttl': None}, {'result_cache_ttl': ''}]:
+            self.assertEqual(sql_result_cache.SQL_RESULT_CACHE_TTL, get_result_cache_ttl(profile))
+        self.assertEqual(60, get_result_cache_ttl({'result_cache_ttl': '60'}))
+        self.assertEqual(0, get_result_cache_ttl({'result_cache_ttl': 0}))
+
+
+if __name__ == '__main__':
+    unittest.main()
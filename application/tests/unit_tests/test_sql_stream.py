@@ -0,0 +1,50 @@
+import json
+import unittest
+
+from utils.sql_stream import SqlStreamParser, iter_bedrock_stream, iter_sagemaker_stream
+
+
+def bedrock_event(content):
+    return {"chunk": {"bytes": json.dumps(content).encode('utf8')}}
+
+
+class TestSqlStream(unittest.TestCase):
+    def test_sql_is_detected_when_block_closes(self):
+        response = "Let me think.\n<sql>SELECT id\nFROM orders</sql>\nThe query lists all orders."
+        parser = SqlStreamParser()
+        detected = [(index, parser.feed(response[index:index + 7])) for index in range(0, len(response), 7)]
+        closed_at = [index for index, sql in detected if sql is not None]
+
+        self.assertEqual(1, len(closed_at))
+        self.assertLess(closed_at[0], response.index("The query"))
+        self.assertEqual("SELECT id\nFROM orders", parser.sql)
+        self.assertEqual(response, parser.get_text())
+
+    def test_markdown_block_and_missing_sql(self):
+        parser = SqlStreamParser()
+        for piece in ["```", "sql\nSELECT 1", "\n``", "`\nexplanation"]:
+            parser.feed(piece)
+        self.assertEqual("\nSELECT 1\n", parser.sql)
+
+        parser = SqlStreamParser()
+        parser.feed("I cannot answer that question.")
+        self.assertIsNone(parser.sql)
+
+    def test_bedrock_stream_text_and_usage(self):
+        events = [bedrock_event({"type": "message_start", "message": {"usage": {"input_tokens": 120}}}),
+                  bedrock_event({"type": "content_block_delta", "delta": {"text": "<sql>SELECT 1"}}),
+                  bedrock_event({"type": "content_block_delta", "delta": {"text": "</sql>"}}),
+                  bedrock_event({"type": "message_delta", "usage": {"output_tokens": 9}})]
+        usage = {}
+        self.assertEqual("<sql>SELECT 1</sql>", "".join(iter_bedrock_stream({"body": events}, usage)))
+        self.assertEqual({"input_tokens": 120, "output_tokens": 9}, usage)
+
+    def test_sagemaker_server_sent_events(self):
+        payloads = ['data: {"token": {"text": "SEL"}}\n\ndata: {"tok', 'en": {"text": "ECT"}}\n\n',
+                    'data: {"token": {"text": "</s>", "special": true}}\n\n']
+        events = [{"PayloadPart": {"Bytes": payload.encode('utf8')}} for payload in payloads]
+        self.assertEqual("SELECT", "".join(iter_sagemaker_stream({"Body": events})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,84 @@
 import json
+import os
+import sys
 
-import sqlalchemy as db
 from sqlalchemy import text
 from utils.env_var import RDS_MYSQL_HOST, RDS_MYSQL_PORT, RDS_MYSQL_USERNAME, RDS_MYSQL_PASSWORD, RDS_MYSQL_DBNAME, RDS_PQ_SCHEMA
 import pandas as pd
 import sqlparse
 from nlq.business.connection import ConnectionManagement
+from nlq.business.datasource.factory import DataSourceFactory
+from nlq.data_access.engine_registry import EngineRegistry
 from utils.logging import getLogger
+from utils.sql_result_cache import get_sql_result_cache, get_result_cache_ttl
 
 logger = getLogger()
 
 ALLOWED_QUERY_TYPES = ['SELECT']
+
+# bounded fetch of query results, a profile can override the caps with result_max_rows and result_max_bytes
+SQL_RESULT_MAX_ROWS = int(os.getenv('SQL_RESULT_MAX_ROWS', 10000))
+SQL_RESULT_MAX_BYTES = int(os.getenv('SQL_RESULT_MAX_BYTES', 32 * 1024 * 1024))
+SQL_RESULT_FETCH_SIZE = int(os.getenv('SQL_RESULT_FETCH_SIZE', 1000))
+# run a COUNT(*) over the query when a result was truncated, PostgreSQL uses the cheaper EXPLAIN estimate instead
+SQL_RESULT_COUNT_TOTAL_ROWS = os.getenv('SQL_RESULT_COUNT_TOTAL_ROWS', 'false').lower() == 'true'
+
+
+def get_engine_by_url(p_db_url, conn_name=''):
+    """
+    Get the pooled engine of a db url, resolving the sample database placeholders if needed
+    """
+    if isinstance(p_db_url, str) and '{RDS_MYSQL_USERNAME}' in p_db_url:
+        p_db_url = p_db_url.format(
+            RDS_MYSQL_HOST=RDS_MYSQL_HOST,
+            RDS_MYSQL_PORT=RDS_MYSQL_PORT,
+            RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
+            RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
+            RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
+        )
+    if conn_name:
+        engine = EngineRegistry.lookup(p_db_url, conn_name)
+        if engine is None:
+            # first use of this connection, load its config so the pool settings are honoured
+            engine = ConnectionManagement.get_engine_by_name(conn_name)
+        return engine
+    return EngineRegistry.get_engine(p_db_url)
+
+
+def get_engine_by_profile(profile):
+    """
+    Get the pooled engine of a data profile
+    """
+    conn_name = profile.get('conn_name', '')
+    if profile.get('db_type') == "bigquery":
+        return ConnectionManagement.get_engine_by_name(conn_name)
+    p_db_url = profile['db_url']
+    if not p_db_url:
+        p_db_url = ConnectionManagement.get_db_url_by_name(conn_name)
+    return get_engine_by_url(p_db_url, conn_name)
+
+
+def run_with_credential_refresh(engine, conn_name, run):
+    """
+    Call run(engine), and once more with a freshly loaded config if the database rejected the cached credentials
+    :return: engine that was used, result of run
+    """
+    try:
+        return engine, run(engine)
+    except Exception as e:
+        if not conn_name or not ConnectionManagement.is_auth_error(e):
+            raise
+        logger.warning(f'authentication failed for connection {conn_name}, reloading its credentials')
+        engine = ConnectionManagement.refresh_connection(conn_name)
+        return engine, run(engine)
+
+
 def query_from_database(p_db_url: str, query, schema=None):
     """
     Query the database
     """
     try:
-        if '{RDS_MYSQL_USERNAME}' in p_db_url:
-            engine = db.create_engine(p_db_url.format(
-                RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-                RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-                RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-                RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-                RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-            ))
-        else:
-            engine = db.create_engine(p_db_url)
+        engine = get_engine_by_url(p_db_url)
         with engine.connect() as connection:
             logger.info(f'{query=}')
             sanitized_query = sqlparse.format(query, strip_comments=True)
@@ -48,58 +101,112 @@ def query_from_database(p_db_url: str, query, schema=None):
     }
 
 
-def query_from_sql_pd(p_db_url: str, query, schema=None):
+def query_from_sql_pd(p_db_url: str, query, schema=None, conn_name='', result_cache_ttl=None):
     """
     Query the database
+    :param result_cache_ttl: seconds to cache the result for, None or 0 always queries the database
     """
-    if '{RDS_MYSQL_USERNAME}' in p_db_url:
-        engine = db.create_engine(p_db_url.format(
-            RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-            RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-            RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-            RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-            RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-        ))
-    else:
-        engine = db.create_engine(p_db_url)
-
-    with engine.connect() as connection:
-        logger.info(f'{query=}')
-        res = pd.DataFrame()
-        try:
-            res = pd.read_sql_query(text(query), connection)
-        except Exception as e:
-            logger.error("query_from_sql_pd is error")
-            logger.error(e)
-        return res
+    engine = get_engine_by_url(p_db_url, conn_name)
 
-def get_sql_result_tool(profile, sql):
-    result_dict = {"data": pd.DataFrame(), "sql": sql, "status_code": 200, "error_info": ""}
+    def read_sql(engine):
+        with engine.connect() as connection:
+            logger.info(f'{query=}')
+            return pd.read_sql_query(text(query), connection)
+
+    def execute():
+        return run_with_credential_refresh(engine, conn_name, read_sql)[1]
+
+    res = pd.DataFrame()
+    try:
+        res = get_sql_result_cache().get_or_execute(conn_name or str(engine.url), query, result_cache_ttl, execute)
+    except Exception as e:
+        logger.error("query_from_sql_pd is error")
+        logger.error(e)
+    return res
+
+def get_result_limits(profile):
+    max_rows = profile.get('result_max_rows')
+    max_bytes = profile.get('result_max_bytes')
+    return (SQL_RESULT_MAX_ROWS if max_rows is None or max_rows == '' else int(max_rows),
+            SQL_RESULT_MAX_BYTES if max_bytes is None or max_bytes == '' else int(max_bytes))
+
+
+def fetch_bounded(connection, sql, max_rows, max_bytes):
+    """
+    Fetch at most max_rows rows and roughly max_bytes bytes, using a server side cursor where the driver supports it
+    :return: DataFrame, True if the byte cap stopped the fetch
+    """
+    cursor = connection.execution_options(stream_results=True).execute(text(sql))
+    columns = list(cursor.keys())
+    rows = []
+    fetched_bytes = 0
+    truncated_by_bytes = False
+    try:
+        while len(rows) < max_rows:
+            chunk = cursor.fetchmany(min(SQL_RESULT_FETCH_SIZE, max_rows - len(rows)))
+            if not chunk:
+                break
+            rows.extend(chunk)
+            fetched_bytes += sum(sys.getsizeof(value) for row in chunk for value in row)
+            if fetched_bytes > max_bytes:
+                truncated_by_bytes = True
+                break
+    finally:
+        cursor.close()
+    return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True), truncated_by_bytes
+
+
+def estimate_total_rows(engine, sql, db_type):
+    """
+    Estimate the row count of a truncated query, None if no estimate is available
+    """
+    sql = sql.strip().rstrip(';')
     try:
-        p_db_url = profile['db_url']
-        if not p_db_url:
-            conn_name = profile['conn_name']
-            p_db_url = ConnectionManagement.get_db_url_by_name(conn_name)
-
-        if '{RDS_MYSQL_USERNAME}' in p_db_url:
-            engine = db.create_engine(p_db_url.format(
-                RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-                RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-                RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-                RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-                RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-            ))
-        else:
-            if profile['db_type'] == "bigquery":
-                password, host = ConnectionManagement.get_db_password_host_by_name(profile['conn_name'])
-                password = json.loads(password)
-                engine = db.create_engine(url=host, credentials_info=password)
-            else:
-                engine = db.create_engine(p_db_url)
         with engine.connect() as connection:
-            logger.info(f'{sql=}')
-            executed_result_df = pd.read_sql_query(text(sql), connection)
-            result_dict["data"] = executed_result_df.fillna("")
+            if db_type == 'postgresql':
+                plan = connection.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return int(plan[0]['Plan']['Plan Rows'])
+            if SQL_RESULT_COUNT_TOTAL_ROWS:
+                return int(connection.execute(text(f'SELECT COUNT(*) FROM ({sql}) genbi_total_rows')).scalar())
+    except Exception as e:
+        logger.warning(f'total row estimate failed: {e}')
+    return None
+
+
+def get_sql_result_tool(profile, sql):
+    result_dict = {"data": pd.DataFrame(), "sql": sql, "status_code": 200, "error_info": "", "truncated": False,
+                   "total_row_estimate": None}
+    try:
+        engine = get_engine_by_profile(profile)
+        max_rows, max_bytes = get_result_limits(profile)
+        # one extra row tells whether the result was truncated
+        bounded_sql = DataSourceFactory.apply_row_limit_for_sql(profile.get('db_type'), sql, max_rows + 1)
+        connection_key = profile.get('conn_name') or str(engine.url)
+        result_cache = get_sql_result_cache()
+        result_cache_ttl = get_result_cache_ttl(profile)
+
+        executed_result_df = result_cache.get(connection_key, bounded_sql) if result_cache_ttl > 0 else None
+        truncated_by_bytes = False
+        if executed_result_df is None:
+            def fetch(engine):
+                with engine.connect() as connection:
+                    logger.info(f'{bounded_sql=}')
+                    return fetch_bounded(connection, bounded_sql, max_rows + 1, max_bytes)
+
+            engine, (executed_result_df, truncated_by_bytes) = run_with_credential_refresh(
+                engine, profile.get('conn_name'), fetch)
+            if result_cache_ttl > 0 and not truncated_by_bytes:
+                result_cache.put(connection_key, bounded_sql, executed_result_df, result_cache_ttl)
+
+        if truncated_by_bytes or len(executed_result_df) > max_rows:
+            executed_result_df = executed_result_df.head(max_rows)
+            result_dict["truncated"] = True
+            result_dict["total_row_estimate"] = estimate_total_rows(engine, sql, profile.get('db_type'))
+            logger.info(f'result truncated to {len(executed_result_df)} rows, '
+                        f'estimated total {result_dict["total_row_estimate"]}')
+        result_dict["data"] = executed_result_df.fillna("")
     except Exception as e:
         logger.error("get_sql_result is error: {}".format(e))
         result_dict["error_info"] = str(e)
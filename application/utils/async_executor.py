@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# worker threads shared by all websocket sessions of one uvicorn worker
+ASYNC_EXECUTOR_MAX_WORKERS = int(os.getenv('ASYNC_EXECUTOR_MAX_WORKERS', 64))
+
+# sub-tasks submitted from inside a handler, e.g. speculative retrieval. A separate pool, so that a handler waiting
+# on its sub-tasks can never starve them of threads.
+ASYNC_TASK_MAX_WORKERS = int(os.getenv('ASYNC_TASK_MAX_WORKERS', 32))
+
+# per-stage limits, so that a burst of slow LLM calls cannot take every thread from retrieval or SQL execution.
+# The database limit defaults to DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW, more would only wait on the pool.
+STAGE_LLM = 'llm'
+STAGE_RETRIEVAL = 'retrieval'
+STAGE_DATABASE = 'database'
+STAGE_DEFAULT = 'default'
+
+STAGE_CONCURRENCY = {
+    STAGE_LLM: int(os.getenv('ASYNC_LLM_CONCURRENCY', 32)),
+    STAGE_RETRIEVAL: int(os.getenv('ASYNC_RETRIEVAL_CONCURRENCY', 16)),
+    STAGE_DATABASE: int(os.getenv('ASYNC_DATABASE_CONCURRENCY', 15)),
+}
+
+# sub-tasks of one agent question that run at the same time, and calls in flight per LLM model across all questions
+AGENT_TASK_CONCURRENCY = int(os.getenv('AGENT_TASK_CONCURRENCY', 4))
+LLM_MODEL_CONCURRENCY = int(os.getenv('LLM_MODEL_CONCURRENCY', 8))
+# comma separated model_id=limit pairs overriding LLM_MODEL_CONCURRENCY
+LLM_MODEL_CONCURRENCY_OVERRIDES = {
+    model_id.strip(): int(limit) for model_id, limit in
+    (item.rsplit('=', 1) for item in os.getenv('LLM_MODEL_CONCURRENCY_OVERRIDES', '').split(',') if '=' in item)}
+
+executor = None
+task_executor = None
+executor_lock = threading.Lock()
+
+# asyncio semaphores belong to one event loop, keep one set per loop
+loop_semaphores = weakref.WeakKeyDictionary()
+
+model_semaphores = {}
+model_semaphores_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        with executor_lock:
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_MAX_WORKERS,
+                                              thread_name_prefix='genbi-worker')
+    return executor
+
+
+def get_task_executor():
+    global task_executor
+    if task_executor is None:
+        with executor_lock:
+            if task_executor is None:
+                task_executor = ThreadPoolExecutor(max_workers=ASYNC_TASK_MAX_WORKERS,
+                                                   thread_name_prefix='genbi-task')
+    return task_executor
+
+
+def get_model_semaphore(model_id) -> threading.BoundedSemaphore:
+    """
+    Semaphore limiting the concurrent calls of one LLM model, use as a context manager around the call
+    """
+    semaphore = model_semaphores.get(model_id)
+    if semaphore is None:
+        with model_semaphores_lock:
+            semaphore = model_semaphores.get(model_id)
+            if semaphore is None:
+                limit = LLM_MODEL_CONCURRENCY_OVERRIDES.get(model_id, LLM_MODEL_CONCURRENCY)
+                semaphore = threading.BoundedSemaphore(max(limit, 1))
+                model_semaphores[model_id] = semaphore
+    return semaphore
+
+
+def map_in_order(func, items, max_concurrency=None) -> list:
+    """
+    Run func over items on the task pool with at most max_concurrency calls in flight, e.g. the sub-tasks of an
+    agent question. A failing item does not stop the others.
+    :param max_concurrency: defaults to AGENT_TASK_CONCURRENCY, 1 runs the items one after the other
+    :return: list of (result, exception) tuples in the order of items
+    """
+    items = list(items)
+    max_concurrency = AGENT_TASK_CONCURRENCY if max_concurrency is None else max_concurrency
+    results = [None] * len(items)
+    if max_concurrency <= 1 or len(items) <= 1:
+        for index, item in enumerate(items):
+            try:
+                results[index] = (func(item), None)
+            except Exception as e:
+                results[index] = (None, e)
+        return results
+
+    pending = {}
+    next_index = 0
+    while next_index < len(items) or pending:
+        while next_index < len(items) and len(pending) < max_concurrency:
+            context = contextvars.copy_context()
+            pending[get_task_executor().submit(context.run, func, items[next_index])] = next_index
+            next_index += 1
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                results[index] = (future.result(), None)
+            except Exception as e:
+                results[index] = (None, e)
+    return results
+
+
+def get_stage_semaphore(stage):
+    if stage not in STAGE_CONCURRENCY:
+        return None
+    loop = asyncio.get_running_loop()
+    semaphores = loop_semaphores.get(loop)
+    if semaphores is None:
+        semaphores = {name: asyncio.Semaphore(limit) for name, limit in STAGE_CONCURRENCY.items()}
+        loop_semaphores[loop] = semaphores
+    return semaphores[stage]
+
+
+async def run_blocking(stage, func, *args, **kwargs):
+    """
+    Run a blocking function on the shared worker pool without blocking the event loop
+    :param stage: one of STAGE_LLM, STAGE_RETRIEVAL, STAGE_DATABASE or STAGE_DEFAULT, selects the concurrency limit
+    :param func: blocking callable
+    :return: the return value of func
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    semaphore = get_stage_semaphore(stage)
+    if semaphore is None:
+        return await loop.run_in_executor(get_executor(), call)
+    async with semaphore:
+        return await loop.run_in_executor(get_executor(), call)
@@ -6,6 +6,7 @@ from jose import jwt
 import requests
 import os
 
+from utils.jwks import JwksCache, TokenVerifier, VerifiedTokenCache
 from utils.logging import getLogger
 
 VITE_COGNITO_REGION = os.getenv("VITE_COGNITO_REGION")
@@ -21,12 +22,24 @@ JWKS_URL = os.getenv("JWKS_URL",
 
 TOKEN_URL = f"{AUTH_PATH}/oauth2/token"
 
+JWKS_CACHE_TTL = int(os.getenv("JWKS_CACHE_TTL", 3600))
+VERIFIED_TOKEN_CACHE_TTL = int(os.getenv("VERIFIED_TOKEN_CACHE_TTL", 60))
+
 logger = getLogger()
 
+def fetch_jwks():
+    response = requests.get(JWKS_URL, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+def verify_signature(token, key, audience=None, access_token=None):
+    return jwt.decode(token, key, audience=audience, access_token=access_token, algorithms=["RS256"])
+
+token_verifier = TokenVerifier(JwksCache(fetch_jwks, ttl=JWKS_CACHE_TTL),
+                               VerifiedTokenCache(ttl=VERIFIED_TOKEN_CACHE_TTL), verify_signature)
+
 def jwt_decode(token, audience=None, access_token=None):
-    return jwt.decode(
-            token, requests.get(JWKS_URL).json(), audience=audience, access_token=access_token, algorithms=["RS256"]
-        )
+    return token_verifier.decode(token, audience=audience, access_token=access_token)
 
 class RefreshTokenError(Exception):
     ERROR_FMT = 'Refresh token error: {description}'
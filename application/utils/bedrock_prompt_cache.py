@@ -0,0 +1,63 @@
+import os
+
+# comma separated Bedrock model ids whose static prompt prefix is sent with cache points, e.g.
+# anthropic.claude-3-5-sonnet-20240620-v1:0,anthropic.claude-3-haiku-20240307-v1:0
+BEDROCK_PROMPT_CACHE_MODEL_IDS = [model_id.strip() for model_id in
+                                  os.getenv('BEDROCK_PROMPT_CACHE_MODEL_IDS', '').split(',') if model_id.strip()]
+
+CACHE_CONTROL = {"type": "ephemeral"}
+CACHE_TOKEN_KEYS = ['cache_read_input_tokens', 'cache_creation_input_tokens']
+
+
+def is_prompt_cache_enabled(model_id) -> bool:
+    return model_id in BEDROCK_PROMPT_CACHE_MODEL_IDS
+
+
+def build_cacheable_content(text, cache_prefix=None) -> list:
+    """
+    Split a prompt into content blocks, with a cache point after its static prefix
+    :param cache_prefix: static start of the text, None marks the whole text as cacheable
+    :return: list of text content blocks
+    """
+    if cache_prefix is None:
+        cache_prefix = text
+    if not cache_prefix or not text.startswith(cache_prefix):
+        return [{"type": "text", "text": text}]
+    blocks = [{"type": "text", "text": cache_prefix, "cache_control": CACHE_CONTROL}]
+    if len(text) > len(cache_prefix):
+        blocks.append({"type": "text", "text": text[len(cache_prefix):]})
+    return blocks
+
+
+def build_claude3_prompt(system_prompt, user_prompt, system_cache_prefix=None, user_cache_prefix=None,
+                         with_cache_points=False):
+    """
+    System prompt and messages of a Claude 3 invoke_model call. With cache points, the system prompt and the static
+    prefix of the user prompt are marked cacheable, so Bedrock reads them from its prompt cache on the next question
+    of the same profile.
+    :param system_cache_prefix: static start of the system prompt, None caches the whole system prompt
+    :param user_cache_prefix: static start of the user prompt, None sends the user prompt without cache point
+    :return: (system, messages)
+    """
+    if not with_cache_points:
+        return system_prompt, [{"role": "user", "content": user_prompt}]
+    system = build_cacheable_content(system_prompt, system_cache_prefix)
+    user_content = build_cacheable_content(user_prompt, user_cache_prefix) if user_cache_prefix else user_prompt
+    return system, [{"role": "user", "content": user_content}]
+
+
+def get_token_info(usage, with_cache_points=False) -> dict:
+    """Token usage of a Claude 3 response, with the cache read and write counts when cache points were sent"""
+    token_info = dict(usage or {})
+    if with_cache_points:
+        for key in CACHE_TOKEN_KEYS:
+            token_info[key] = token_info.get(key) or 0
+    return token_info
+
+
+def add_token_info(total, token_info) -> dict:
+    """Add the input, output and cache token counts of one call to the running total of a stage"""
+    for key in ['input_tokens', 'output_tokens'] + CACHE_TOKEN_KEYS:
+        if token_info and key in token_info:
+            total[key] = total.get(key, 0) + (token_info[key] or 0)
+    return total
@@ -0,0 +1,145 @@
+import os
+import threading
+
+import pandas as pd
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# pick the chart type of a query result from its column types and cardinality, and only ask the LLM when the rules
+# are ambiguous. A profile can override it with chart_recommender.
+CHART_RECOMMENDER_ENABLED = os.getenv('CHART_RECOMMENDER_ENABLED', 'false').lower() == 'true'
+# categories a pie chart is still readable with, up to CHART_BAR_MAX_CATEGORIES a bar chart is used
+CHART_PIE_MAX_CATEGORIES = int(os.getenv('CHART_PIE_MAX_CATEGORIES', 6))
+CHART_BAR_MAX_CATEGORIES = int(os.getenv('CHART_BAR_MAX_CATEGORIES', 30))
+
+COLUMN_TEMPORAL = 'temporal'
+COLUMN_NUMERIC = 'numeric'
+COLUMN_CATEGORICAL = 'categorical'
+
+# 2024-01, 2024-01-31, 2024/01/31 12:00:00
+DATE_PATTERN = r'^\d{4}[-/]\d{1,2}([-/]\d{1,2})?([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?$'
+
+
+def is_chart_recommender_enabled(profile) -> bool:
+    enabled = profile.get('chart_recommender') if profile else None
+    if enabled is None or enabled == '':
+        return CHART_RECOMMENDER_ENABLED
+    # stored as a bool by the profile page, but as text when the profile was edited in DynamoDB
+    return str(enabled).lower() == 'true'
+
+
+def get_column_kind(column: pd.Series) -> str:
+    """
+    Kind of a result column. Object columns are checked as a whole, so Decimal values of a SUM are numeric and
+    date strings are temporal.
+    """
+    if pd.api.types.is_bool_dtype(column):
+        return COLUMN_CATEGORICAL
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return COLUMN_TEMPORAL
+    if pd.api.types.is_numeric_dtype(column):
+        return COLUMN_NUMERIC
+    values = column.dropna()
+    if len(values) == 0:
+        return COLUMN_CATEGORICAL
+    if values.map(lambda value: hasattr(value, 'isoformat')).all():
+        # date and datetime objects
+        return COLUMN_TEMPORAL
+    texts = values.astype(str).str.strip()
+    if texts.str.match(DATE_PATTERN).all():
+        return COLUMN_TEMPORAL
+    if pd.to_numeric(values, errors='coerce').notna().all() and not texts.str.match(r'^0\d').any():
+        # leading zeros are codes, e.g. zip codes or ids
+        return COLUMN_NUMERIC
+    return COLUMN_CATEGORICAL
+
+
+def recommend_chart(data: pd.DataFrame):
+    """
+    Rule-based choice of how to show a query result, in the format of the visualization LLM response
+    :param data: the query result
+    :return: {"show_type": table, bar, pie or line, "format_data": [[x column, y column]]}, or None when the rules
+    cannot decide and the LLM has to choose
+    """
+    columns = list(data.columns)
+    if len(columns) == 0 or len(data) == 0:
+        return None
+    if len(columns) == 1 or len(columns) > 3 or len(data) == 1:
+        # a list, a single row or a wide result is a table
+        return {"show_type": "table", "format_data": [columns]}
+    if len(columns) == 3 or len(set(columns)) != len(columns):
+        return None
+
+    kinds = {column: get_column_kind(data[column]) for column in columns}
+    by_kind = {}
+    for column in columns:
+        by_kind.setdefault(kinds[column], []).append(column)
+    temporal = by_kind.get(COLUMN_TEMPORAL, [])
+    numeric = by_kind.get(COLUMN_NUMERIC, [])
+    categorical = by_kind.get(COLUMN_CATEGORICAL, [])
+
+    if len(temporal) == 1 and len(numeric) == 1:
+        return {"show_type": "line", "format_data": [[temporal[0], numeric[0]]]}
+    if len(categorical) == 1 and len(numeric) == 1:
+        category_column, value_column = categorical[0], numeric[0]
+        category_count = data[category_column].nunique(dropna=False)
+        if category_count != len(data):
+            # repeated categories are not an aggregate, e.g. a detail list
+            return None
+        if category_count > CHART_BAR_MAX_CATEGORIES:
+            return {"show_type": "table", "format_data": [columns]}
+        values = pd.to_numeric(data[value_column], errors='coerce')
+        if category_count <= CHART_PIE_MAX_CATEGORIES and (values >= 0).all() and values.sum() > 0:
+            return {"show_type": "pie", "format_data": [[category_column, value_column]]}
+        return {"show_type": "bar", "format_data": [[category_column, value_column]]}
+    if len(categorical) == 2:
+        return {"show_type": "table", "format_data": [columns]}
+    # two numbers, e.g. a year as integer and a value, or two dates
+    return None
+
+
+class ChartRecommenderStats:
+    """Counts how often the rules decided the chart and how often the LLM was still called"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            recommendations = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / recommendations if recommendations else 0.0
+            }
+
+
+chart_recommender_stats = ChartRecommenderStats()
+
+
+def get_chart_recommendation(data: pd.DataFrame):
+    """
+    recommend_chart with hit accounting, a failing rule falls back to the LLM
+    :return: the recommendation, or None
+    """
+    try:
+        recommendation = recommend_chart(data)
+    except Exception as e:
+        logger.warning(f"chart recommendation failed, fall back to the LLM: {e}")
+        recommendation = None
+    chart_recommender_stats.record(recommendation is not None)
+    stats = chart_recommender_stats.stats()
+    logger.info(f"chart recommendation {recommendation}, hit rate {stats['hit_rate']:.2%} "
+                f"of {stats['hits'] + stats['misses']}")
+    return recommendation
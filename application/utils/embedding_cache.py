@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# '' keeps the cache in process memory only, 'sqlite' or 'redis' add a persistent tier shared across restarts
+EMBEDDING_CACHE_BACKEND = os.getenv('EMBEDDING_CACHE_BACKEND', '')
+EMBEDDING_CACHE_MAX_MB = float(os.getenv('EMBEDDING_CACHE_MAX_MB', 64))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '/tmp/genbi_embedding_cache.db')
+EMBEDDING_CACHE_REDIS_URL = os.getenv('EMBEDDING_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+EMBEDDING_CACHE_REDIS_TTL = int(os.getenv('EMBEDDING_CACHE_REDIS_TTL', 7 * 24 * 3600))
+
+# rough per-entry overhead of the key, the OrderedDict node and the array header
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_text(text) -> str:
+    """Normalize unicode form and whitespace, so that trivially different inputs share one embedding"""
+    return " ".join(unicodedata.normalize('NFKC', str(text)).split())
+
+
+def get_cache_key(model_name, dimension, text) -> str:
+    raw_key = f"{model_name}|{dimension}|{normalize_text(text)}"
+    return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+
+class SqliteEmbeddingStore:
+    """Persistent embedding tier backed by a local sqlite file"""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vector BLOB)")
+            self.connection.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT vector FROM embedding WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vector = array('f')
+        vector.frombytes(row[0])
+        return vector
+
+    def put(self, key, vector: array):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO embedding (key, vector) VALUES (?, ?)",
+                                    (key, vector.tobytes()))
+            self.connection.commit()
+
+
+class RedisEmbeddingStore:
+    """Persistent embedding tier backed by any Redis compatible server"""
+
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get("genbi:embedding:" + key)
+        if value is None:
+            return None
+        vector = array('f')
+        vector.frombytes(value)
+        return vector
+
+    def put(self, key, vector: array):
+        self.client.set("genbi:embedding:" + key, vector.tobytes(), ex=self.ttl)
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: an in-process LRU bounded by memory, backed by an optional persistent store.
+    Vectors are kept as float32 arrays, about 6 KiB for a 1536 dimension embedding.
+    """
+
+    def __init__(self, max_bytes, persistent_store=None):
+        self.max_bytes = max_bytes
+        self.persistent_store = persistent_store
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def get(self, model_name, dimension, text):
+        key = get_cache_key(model_name, dimension, text)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+
+        if self.persistent_store is not None:
+            try:
+                vector = self.persistent_store.get(key)
+            except Exception as e:
+                logger.warning(f"embedding cache persistent tier read failed: {e}")
+                vector = None
+            if vector is not None:
+                with self.lock:
+                    self.persistent_hits += 1
+                    self._put_memory(key, vector)
+                return vector.tolist()
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, model_name, dimension, text, embedding):
+        if not embedding:
+            return
+        key = get_cache_key(model_name, dimension, text)
+        vector = array('f', embedding)
+        with self.lock:
+            self._put_memory(key, vector)
+        if self.persistent_store is not None:
+            try:
+                self.persistent_store.put(key, vector)
+            except Exception as e:
+                logger.warning(f"embedding cache persistent tier write failed: {e}")
+
+    def _put_memory(self, key, vector: array):
+        size = self._entry_size(vector)
+        if size > self.max_bytes:
+            return
+        old_vector = self.entries.pop(key, None)
+        if old_vector is not None:
+            self.current_bytes -= self._entry_size(old_vector)
+        self.entries[key] = vector
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= self._entry_size(evicted)
+
+    @staticmethod
+    def _entry_size(vector: array):
+        return vector.itemsize * len(vector) + ENTRY_OVERHEAD_BYTES
+
+    def get_or_create(self, model_name, dimension, text, create_embedding):
+        """Return the cached embedding of the text, calling create_embedding(text) on a miss"""
+        embedding = self.get(model_name, dimension, text)
+        if embedding is None:
+            embedding = create_embedding(text)
+            self.put(model_name, dimension, text, embedding)
+        return embedding
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.current_bytes
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+
+embedding_cache = None
+embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    global embedding_cache
+    if embedding_cache is None:
+        with embedding_cache_lock:
+            if embedding_cache is None:
+                persistent_store = None
+                try:
+                    if EMBEDDING_CACHE_BACKEND == 'sqlite':
+                        persistent_store = SqliteEmbeddingStore(EMBEDDING_CACHE_PATH)
+                    elif EMBEDDING_CACHE_BACKEND == 'redis':
+                        persistent_store = RedisEmbeddingStore(EMBEDDING_CACHE_REDIS_URL, EMBEDDING_CACHE_REDIS_TTL)
+                except Exception as e:
+                    logger.error(f"embedding cache backend {EMBEDDING_CACHE_BACKEND} unavailable, memory only: {e}")
+                embedding_cache = EmbeddingCache(int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024), persistent_store)
+    return embedding_cache
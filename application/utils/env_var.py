@@ -25,6 +25,7 @@ AOS_PORT = os.getenv('AOS_PORT')
 AOS_USER = os.getenv('AOS_USER')
 AOS_PASSWORD = os.getenv('AOS_PASSWORD')
 AOS_DOMAIN = os.getenv('AOS_DOMAIN')
+AOS_MAX_CONNECTIONS = int(os.getenv('AOS_MAX_CONNECTIONS', 20))
 
 AOS_INDEX = os.getenv('AOS_INDEX')
 AOS_INDEX_NER = os.getenv('AOS_INDEX_NER')
@@ -106,7 +107,8 @@ opensearch_info = {
     'sql_index': AOS_INDEX,
     'ner_index': AOS_INDEX_NER,
     'agent_index': AOS_INDEX_AGENT,
-    'embedding_dimension': EMBEDDING_DIMENSION
+    'embedding_dimension': EMBEDDING_DIMENSION,
+    'max_connections': AOS_MAX_CONNECTIONS
 }
 
 query_log_name = os.getenv("QUERY_LOG_INDEX", "genbi_query_logging")
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+
+class JwksKeyError(Exception):
+    pass
+
+
+def get_unverified_kid(token):
+    """Read the kid from the JWT header without verifying the token"""
+    try:
+        header_segment = token.split('.')[0]
+        header_segment += '=' * (-len(header_segment) % 4)
+        return json.loads(base64.urlsafe_b64decode(header_segment)).get('kid')
+    except Exception as e:
+        raise JwksKeyError(f'Invalid token header: {e}')
+
+
+class JwksCache:
+    """
+    Signing keys of a JWKS endpoint by kid. The key set is refreshed after ttl seconds, and refetched early when a
+    token carries an unknown kid (key rotation), at most once per min_refetch_interval seconds.
+    """
+
+    def __init__(self, fetch_jwks, ttl=3600, min_refetch_interval=30):
+        """
+        :param fetch_jwks: callable returning the JWKS document, i.e. {"keys": [...]}
+        """
+        self.fetch_jwks = fetch_jwks
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.keys = None
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+
+    def _refresh(self, now):
+        try:
+            jwks = self.fetch_jwks()
+            self.keys = {key['kid']: key for key in jwks.get('keys', []) if 'kid' in key}
+        except Exception as e:
+            if self.keys is None:
+                raise JwksKeyError(f'JWKS fetch failed: {e}')
+            # keep serving the known keys until the endpoint recovers
+            logger.error(f'JWKS refresh failed, using cached keys: {e}')
+        self.fetched_at = now
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        with self.lock:
+            if self.keys is None or now - self.fetched_at > self.ttl:
+                self._refresh(now)
+            key = self.keys.get(kid)
+            if key is None and now - self.fetched_at >= self.min_refetch_interval:
+                self._refresh(now)
+                key = self.keys.get(kid)
+            return key
+
+
+class VerifiedTokenCache:
+    """Claims of recently verified tokens, keyed by a hash of the token, expiring no later than the token itself"""
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_cache_key(token, audience=None, access_token=None):
+        raw_key = f'{token}|{audience}|{access_token}'
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def get(self, token, audience=None, access_token=None):
+        key = self.get_cache_key(token, audience, access_token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return dict(claims)
+
+    def put(self, token, claims, audience=None, access_token=None):
+        if self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if 'exp' in claims:
+            expires_at = min(expires_at, float(claims['exp']))
+        key = self.get_cache_key(token, audience, access_token)
+        with self.lock:
+            self.entries[key] = (dict(claims), expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class TokenVerifier:
+    def __init__(self, jwks_cache: JwksCache, token_cache: VerifiedTokenCache, verify_signature):
+        """
+        :param verify_signature: callable(token, key, audience, access_token) returning the claims of a valid token
+        and raising otherwise
+        """
+        self.jwks_cache = jwks_cache
+        self.token_cache = token_cache
+        self.verify_signature = verify_signature
+
+    def decode(self, token, audience=None, access_token=None):
+        claims = self.token_cache.get(token, audience, access_token)
+        if claims is not None:
+            return claims
+        kid = get_unverified_kid(token)
+        key = self.jwks_cache.get_key(kid)
+        if key is None:
+            raise JwksKeyError(f'Unknown signing key {kid}')
+        claims = self.verify_signature(token, key, audience, access_token)
+        self.token_cache.put(token, claims, audience, access_token)
+        return dict(claims)
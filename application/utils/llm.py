@@ -1,13 +1,21 @@
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import pandas as pd
 from botocore.config import Config
 
+from utils.bedrock_prompt_cache import is_prompt_cache_enabled, build_claude3_prompt, get_token_info
+from utils.chart_recommender import get_chart_recommendation
 from utils.domain import ModelResponse
+from utils.embedding_cache import get_embedding_cache
+from utils.sql_stream import iter_bedrock_stream, iter_sagemaker_stream
 from utils.logging import getLogger
 
 from langchain_core.output_parsers import JsonOutputParser
-from utils.prompts.generate_prompt import generate_llm_prompt, generate_agent_cot_system_prompt, \
+from utils.prompts.generate_prompt import generate_llm_prompt_parts, generate_agent_cot_system_prompt_parts, \
     generate_intent_prompt, generate_knowledge_prompt, generate_data_visualization_prompt, \
     generate_agent_analyse_prompt, generate_data_summary_prompt, generate_suggest_question_prompt, \
     generate_query_rewrite_prompt
@@ -20,6 +28,8 @@ from nlq.business.model import ModelManagement
 
 logger = getLogger()
 
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', 8))
+
 config = Config(
     region_name=BEDROCK_REGION,
     signature_version='v4',
@@ -36,18 +46,22 @@ bedrock = None
 json_parse = JsonOutputParser()
 embedding_sagemaker_client = None
 sagemaker_client = None
+# handlers run on worker threads, and creating clients from the default boto3 session is not thread safe
+boto3_client_lock = threading.Lock()
 
 
 def get_bedrock_client():
     global bedrock
     if not bedrock:
-        if len(bedrock_ak_sk_info) == 0:
-            bedrock = boto3.client(service_name='bedrock-runtime', config=config)
-        else:
-            bedrock = boto3.client(
-                service_name='bedrock-runtime', config=config,
-                aws_access_key_id=bedrock_ak_sk_info['access_key_id'],
-                aws_secret_access_key=bedrock_ak_sk_info['secret_access_key'])
+        with boto3_client_lock:
+            if not bedrock:
+                if len(bedrock_ak_sk_info) == 0:
+                    bedrock = boto3.client(service_name='bedrock-runtime', config=config)
+                else:
+                    bedrock = boto3.client(
+                        service_name='bedrock-runtime', config=config,
+                        aws_access_key_id=bedrock_ak_sk_info['access_key_id'],
+                        aws_secret_access_key=bedrock_ak_sk_info['secret_access_key'])
     return bedrock
 
 
@@ -147,26 +161,31 @@ def invoke_mixtral_8x7b(model_id, system_prompt, messages, max_tokens, with_resp
 def get_embedding_sagemaker_client():
     global embedding_sagemaker_client
     if not embedding_sagemaker_client:
-        if SAGEMAKER_EMBEDDING_REGION is not None and SAGEMAKER_EMBEDDING_REGION != "":
-            embedding_sagemaker_client = boto3.client(service_name='sagemaker-runtime',
-                                                      region_name=SAGEMAKER_EMBEDDING_REGION)
-        else:
-            embedding_sagemaker_client = boto3.client(service_name='sagemaker-runtime')
+        with boto3_client_lock:
+            if not embedding_sagemaker_client:
+                if SAGEMAKER_EMBEDDING_REGION is not None and SAGEMAKER_EMBEDDING_REGION != "":
+                    embedding_sagemaker_client = boto3.client(service_name='sagemaker-runtime',
+                                                              region_name=SAGEMAKER_EMBEDDING_REGION)
+                else:
+                    embedding_sagemaker_client = boto3.client(service_name='sagemaker-runtime')
     return embedding_sagemaker_client
 
 
 def get_sagemaker_client(model_region=""):
     global sagemaker_client
     if model_region != "" and model_region != AWS_DEFAULT_REGION:
-        sagemaker_client = boto3.client(service_name='sagemaker-runtime',
-                                        region_name=model_region)
+        with boto3_client_lock:
+            sagemaker_client = boto3.client(service_name='sagemaker-runtime',
+                                            region_name=model_region)
         return sagemaker_client
     if not sagemaker_client:
-        if SAGEMAKER_SQL_REGION is not None and SAGEMAKER_SQL_REGION != "":
-            sagemaker_client = boto3.client(service_name='sagemaker-runtime',
-                                            region_name=SAGEMAKER_SQL_REGION)
-        else:
-            sagemaker_client = boto3.client(service_name='sagemaker-runtime')
+        with boto3_client_lock:
+            if not sagemaker_client:
+                if SAGEMAKER_SQL_REGION is not None and SAGEMAKER_SQL_REGION != "":
+                    sagemaker_client = boto3.client(service_name='sagemaker-runtime',
+                                                    region_name=SAGEMAKER_SQL_REGION)
+                else:
+                    sagemaker_client = boto3.client(service_name='sagemaker-runtime')
     return sagemaker_client
 
 
@@ -205,7 +224,36 @@ def invoke_model_sagemaker_endpoint(endpoint_name, body, model_type="LLM", with_
             return response_body
 
 
-def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False):
+def read_response_stream(model_id, response, on_text=None):
+    """
+    Consume a streamed model response
+    :param on_text: called with every text delta as it arrives
+    :return: full text, token usage reported by the stream
+    """
+    usage = {}
+    if model_id.startswith('sagemaker.'):
+        text_stream = iter_sagemaker_stream(response)
+    else:
+        text_stream = iter_bedrock_stream(response, usage)
+    text_pieces = []
+    for text in text_stream:
+        if not text:
+            continue
+        text_pieces.append(text)
+        if on_text is not None:
+            on_text(text)
+    return "".join(text_pieces), usage
+
+
+def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False,
+                     system_cache_prefix=None, user_cache_prefix=None, on_text=None):
+    """
+    :param with_response_stream: stream the completion, the returned ModelResponse still carries the full text
+    :param system_cache_prefix: static start of the system prompt, None treats the whole system prompt as static
+    :param user_cache_prefix: static start of the user prompt, e.g. the schema part of the text2sql prompt
+    The prefixes are sent as Bedrock prompt cache points for the models in BEDROCK_PROMPT_CACHE_MODEL_IDS.
+    :param on_text: with with_response_stream, called with each text delta
+    """
     # Prompt with user turn only.
     user_message = {"role": "user", "content": user_prompt}
     messages = [user_message]
@@ -215,8 +263,11 @@ def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with
     model_response = ModelResponse()
 
     model_config = {}
+    with_cache_points = is_prompt_cache_enabled(model_id)
     if model_id.startswith('anthropic.claude-3'):
-        response = invoke_model_claude3(model_id, system_prompt, messages, max_tokens, with_response_stream)
+        system, claude3_messages = build_claude3_prompt(system_prompt, user_prompt, system_cache_prefix,
+                                                        user_cache_prefix, with_cache_points)
+        response = invoke_model_claude3(model_id, system, claude3_messages, max_tokens, with_response_stream)
     elif model_id.startswith('mistral.mixtral-8x7b'):
         response = invoke_mixtral_8x7b(model_id, system_prompt, messages, max_tokens, with_response_stream)
     elif model_id.startswith('meta.llama3-70b'):
@@ -236,8 +287,15 @@ def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with
         response = invoke_model_sagemaker_endpoint(endpoint_name, body, "LLM", with_response_stream, llm_region)
     logger.info(f'{response=}')
     model_response.response = response
+    if with_response_stream:
+        model_response.text, usage = read_response_stream(model_id, response, on_text)
+        if model_id.startswith('anthropic.claude-3'):
+            model_response.token_info = get_token_info(usage, with_cache_points)
+        else:
+            model_response.token_info = {}
+        return model_response
     if model_id.startswith('anthropic.claude-3'):
-        model_response.token_info = response.get("usage", {})
+        model_response.token_info = get_token_info(response.get("usage", {}), with_cache_points)
     else:
         model_response.token_info = {}
     if model_id.startswith('meta.llama3-70b'):
@@ -255,22 +313,25 @@ def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with
 
 
 def text_to_sql(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None, dialect='mysql',
-                model_provider=None, with_response_stream=False, additional_info=''):
-    user_prompt, system_prompt = generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples, ner_example,
-                                                     model_id, dialect=dialect)
+                model_provider=None, with_response_stream=False, additional_info='', profile_version=None,
+                on_text=None):
+    user_prompt, system_prompt, user_cache_prefix = generate_llm_prompt_parts(
+        ddl, hints, prompt_map, search_box, sql_examples, ner_example, model_id, dialect=dialect,
+        profile_version=profile_version)
     max_tokens = 4096
     model_response = invoke_llm_model(model_id, system_prompt, user_prompt + additional_info, max_tokens,
-                                      with_response_stream)
+                                      with_response_stream, user_cache_prefix=user_cache_prefix, on_text=on_text)
     return model_response.text, model_response
 
 
-def get_agent_cot_task(model_id, prompt_map, search_box, ddl, agent_cot_example=None):
+def get_agent_cot_task(model_id, prompt_map, search_box, ddl, agent_cot_example=None, profile_version=None):
     default_agent_cot_task = {"task_1": search_box}
-    user_prompt, system_prompt = generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id,
-                                                                  agent_cot_example)
+    user_prompt, system_prompt, system_cache_prefix = generate_agent_cot_system_prompt_parts(
+        ddl, prompt_map, search_box, model_id, agent_cot_example, profile_version)
     try:
         max_tokens = 2048
-        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
+        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False,
+                                          system_cache_prefix=system_cache_prefix)
         final_response = model_response.text
         logger.info(f'{final_response=}')
         intent_result_dict = json_parse.parse(final_response)
@@ -344,12 +405,19 @@ def select_data_visualization_type(model_id, search_box, search_data, prompt_map
         return default_data_visualization
 
 
-def data_visualization(model_id, search_box, search_data, prompt_map):
+def data_visualization(model_id, search_box, search_data, prompt_map, use_chart_recommender=False):
+    """
+    :param use_chart_recommender: pick the chart type with the rules of utils.chart_recommender, the LLM is only
+    called when they cannot decide
+    """
     model_response = ModelResponse()
     model_response.token_info = {}
     if len(search_data) == 0:
         return "table", [], "-1", [], model_response
+    chart_recommendation = None
     if isinstance(search_data, pd.DataFrame):
+        if use_chart_recommender:
+            chart_recommendation = get_chart_recommendation(search_data)
         search_data = search_data.fillna("")
         columns = list(search_data.columns)
         data_list = search_data.values.tolist()
@@ -360,6 +428,8 @@ def data_visualization(model_id, search_box, search_data, prompt_map):
         search_data = pd.DataFrame(search_data[1:], columns=search_data[0])
         if len(search_data) == 0:
             return "table", search_data, "-1", [], model_response
+        if use_chart_recommender:
+            chart_recommendation = get_chart_recommendation(search_data)
     all_columns_data = convert_timestamps_to_str(all_columns_data)
     try:
         if len(all_columns_data) < 1:
@@ -369,9 +439,12 @@ def data_visualization(model_id, search_box, search_data, prompt_map):
                 all_columns_data_sample = all_columns_data[0:5]
             else:
                 all_columns_data_sample = all_columns_data
-            model_select_type_dict, model_response = select_data_visualization_type(model_id, search_box,
-                                                                                    all_columns_data_sample,
-                                                                                    prompt_map)
+            if chart_recommendation is not None:
+                model_select_type_dict = chart_recommendation
+            else:
+                model_select_type_dict, model_response = select_data_visualization_type(model_id, search_box,
+                                                                                        all_columns_data_sample,
+                                                                                        prompt_map)
             model_select_type = model_select_type_dict["show_type"]
             model_select_type_columns = model_select_type_dict["format_data"][0]
             data_list = search_data[model_select_type_columns].values.tolist()
@@ -400,10 +473,58 @@ def data_visualization(model_id, search_box, search_data, prompt_map):
 
 def create_vector_embedding(text, index_name):
     model_name = embedding_info["embedding_name"]
-    if embedding_info["embedding_platform"] == "bedrock":
-        return create_vector_embedding_with_bedrock(text, index_name, model_name)
-    else:
-        return create_vector_embedding_with_sagemaker(model_name, text, index_name)
+
+    def create_embedding(input_text):
+        if embedding_info["embedding_platform"] == "bedrock":
+            return create_vector_embedding_with_bedrock(input_text, index_name, model_name)["vector_field"]
+        else:
+            return create_vector_embedding_with_sagemaker(model_name, input_text, index_name)["vector_field"]
+
+    embedding = get_embedding_cache().get_or_create(model_name, embedding_info["embedding_dimension"], text,
+                                                    create_embedding)
+    return {"_index": index_name, "text": text, "vector_field": embedding}
+
+
+def create_vector_embedding_batch(texts, index_name=None, use_cache=True):
+    """
+    Embed a list of texts in one batch: cached texts are served from the embedding cache, the rest are embedded
+    with a single multi-input SageMaker call or concurrent Bedrock calls.
+    :param texts: list of texts, duplicates are embedded once
+    :param index_name:
+    :param use_cache: False for texts being indexed, so that a bulk upload does not evict the cached question
+    embeddings. Indexed texts are embedded as queries like the questions, samples are matched question to question.
+    :return: list of embeddings in the order of texts
+    """
+    model_name = embedding_info["embedding_name"]
+    dimension = embedding_info["embedding_dimension"]
+    cache = get_embedding_cache()
+    embeddings = {}
+    missing_texts = []
+    for text in dict.fromkeys(texts):
+        embedding = cache.get(model_name, dimension, text) if use_cache else None
+        if embedding is None:
+            missing_texts.append(text)
+        else:
+            embeddings[text] = embedding
+
+    if missing_texts:
+        if embedding_info["embedding_platform"] == "bedrock":
+            with ThreadPoolExecutor(max_workers=min(EMBEDDING_MAX_CONCURRENCY, len(missing_texts))) as executor:
+                results = list(executor.map(
+                    lambda text: create_vector_embedding_with_bedrock(text, index_name, model_name)["vector_field"],
+                    missing_texts))
+        else:
+            results = create_vector_embedding_batch_with_sagemaker(model_name, missing_texts)
+        for text, embedding in zip(missing_texts, results):
+            if use_cache:
+                cache.put(model_name, dimension, text, embedding)
+            embeddings[text] = embedding
+    return [embeddings[text] for text in texts]
+
+
+def create_document_embedding_batch(texts, index_name=None):
+    """create_vector_embedding_batch for samples and entities being indexed"""
+    return create_vector_embedding_batch(texts, index_name, use_cache=False)
 
 
 def create_vector_embedding_with_bedrock(text, index_name, model_name):
@@ -434,6 +555,20 @@ def create_vector_embedding_with_sagemaker(endpoint_name, text, index_name):
     return {"_index": index_name, "text": text, "vector_field": embeddings}
 
 
+def create_vector_embedding_batch_with_sagemaker(endpoint_name, texts):
+    body = json.dumps(
+        {
+            "inputs": texts,
+            "is_query": True
+        }
+    )
+    response = invoke_model_sagemaker_endpoint(endpoint_name, body, model_type="embedding")
+    if len(response) != len(texts):
+        raise ValueError(f"embedding endpoint {endpoint_name} returned {len(response)} embeddings for "
+                         f"{len(texts)} texts, check that it supports a list of inputs")
+    return response
+
+
 def generate_suggested_question(prompt_map, search_box, model_id=None):
     max_tokens = 2048
     user_prompt, system_prompt = generate_suggest_question_prompt(prompt_map, search_box, model_id)
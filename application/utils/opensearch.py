@@ -1,44 +1,75 @@
+import functools
+import threading
+
 import boto3
 from opensearchpy import OpenSearch
 from opensearchpy.helpers import bulk
-from utils.llm import create_vector_embedding
-from utils.env_var import opensearch_info, AOS_INDEX_NER, query_log_name
+from utils.llm import create_vector_embedding, create_vector_embedding_batch
+from utils.env_var import opensearch_info, AOS_INDEX_NER, query_log_name, AOS_MAX_CONNECTIONS
 from utils.logging import getLogger
 
 logger = getLogger()
 
+# OpenSearch clients are thread safe and keep a keep-alive connection pool, so one client per cluster is shared
+opensearch_clients = {}
+opensearch_client_lock = threading.Lock()
+
 
-def get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearch_password, region_name):
+def get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearch_password, region_name,
+                                  max_connections=AOS_MAX_CONNECTIONS):
     """
-    Get an OpenSearch Client
+    Get the shared OpenSearch Client of a cluster, creating it on first use
     :param domain:
     :param host:
     :param port:
     :param opensearch_user:
     :param opensearch_password:
     :param region_name:
+    :param max_connections: size of the keep-alive connection pool
     :return:
     """
-    auth = (opensearch_user, opensearch_password)
-    if len(host) == 0:
-        host = get_opensearch_endpoint(domain, region_name)
-
-    # Create the client with SSL/TLS enabled, but hostname verification disabled.
-    opensearch_client = OpenSearch(
-        hosts=[{'host': host, 'port': port}],
-        http_compress=True,  # enables gzip compression for request bodies
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=False,
-        ssl_assert_hostname=False,
-        ssl_show_warn=False
-    )
+    client_key = (domain, host, port, opensearch_user, opensearch_password, region_name)
+    opensearch_client = opensearch_clients.get(client_key)
+    if opensearch_client is not None:
+        return opensearch_client
+
+    with opensearch_client_lock:
+        opensearch_client = opensearch_clients.get(client_key)
+        if opensearch_client is None:
+            auth = (opensearch_user, opensearch_password)
+            if not host:
+                host = get_opensearch_endpoint(domain, region_name)
+
+            # Create the client with SSL/TLS enabled, but hostname verification disabled.
+            opensearch_client = OpenSearch(
+                hosts=[{'host': host, 'port': port}],
+                http_compress=True,  # enables gzip compression for request bodies
+                http_auth=auth,
+                use_ssl=True,
+                verify_certs=False,
+                ssl_assert_hostname=False,
+                ssl_show_warn=False,
+                pool_maxsize=max_connections
+            )
+            opensearch_clients[client_key] = opensearch_client
+            logger.info(f"created shared OpenSearch client for {host}:{port}, {max_connections=}")
     return opensearch_client
 
 
+def get_opensearch_client():
+    """
+    Get the shared OpenSearch Client configured by environment variables
+    :return:
+    """
+    return get_opensearch_cluster_client(opensearch_info['domain'], opensearch_info['host'], opensearch_info['port'],
+                                         opensearch_info['username'], opensearch_info['password'],
+                                         opensearch_info['region'], opensearch_info['max_connections'])
+
+
+@functools.lru_cache(maxsize=None)
 def get_opensearch_endpoint(domain, region):
     """
-    Get OpenseSearch endpoint
+    Get OpenseSearch endpoint, the result is cached as the endpoint of a domain does not change
     :param domain:
     :param region:
     :return:
@@ -204,13 +235,17 @@ def check_field_exists(opensearch_client, index_name, field_name):
 
     return False
 
-def get_retrieve_opensearch(opensearch_info, query, search_type, selected_profile, top_k, score_threshold=0.7):
+def get_index_name_by_search_type(opensearch_info, search_type):
     if search_type == "query":
-        index_name = opensearch_info['sql_index']
+        return opensearch_info['sql_index']
     elif search_type == "ner":
-        index_name = opensearch_info['ner_index']
+        return opensearch_info['ner_index']
     else:
-        index_name = opensearch_info['agent_index']
+        return opensearch_info['agent_index']
+
+
+def get_retrieve_opensearch(opensearch_info, query, search_type, selected_profile, top_k, score_threshold=0.7):
+    index_name = get_index_name_by_search_type(opensearch_info, search_type)
     records_with_embedding = create_vector_embedding(query, index_name=index_name)
     retrieve_result = retrieve_results_from_opensearch(
         index_name=index_name,
@@ -231,10 +266,42 @@ def get_retrieve_opensearch(opensearch_info, query, search_type, selected_profil
     return filter_retrieve_result
 
 
-def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch_user, opensearch_password,
-                                     query_embedding, top_k=3, host='', port=443, profile_name=None):
-    opensearch_client = get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearch_password, region_name)
-    search_query = {
+def get_retrieve_opensearch_batch(opensearch_info, sub_queries, selected_profile):
+    """
+    Embed all sub-queries in one batch and run them as a single _msearch request
+    :param opensearch_info:
+    :param sub_queries: list of dicts with keys query, search_type ("query", "ner" or "agent"), top_k, score_threshold
+    :param selected_profile:
+    :return: list of filtered hits, one list per sub-query in the same order
+    """
+    if len(sub_queries) == 0:
+        return []
+    embeddings = create_vector_embedding_batch([sub_query['query'] for sub_query in sub_queries])
+
+    msearch_body = []
+    for sub_query, embedding in zip(sub_queries, embeddings):
+        index_name = get_index_name_by_search_type(opensearch_info, sub_query['search_type'])
+        msearch_body.append({"index": index_name})
+        msearch_body.append(build_knn_search_query(embedding, sub_query['top_k'], selected_profile))
+
+    opensearch_client = get_opensearch_cluster_client(opensearch_info['domain'], opensearch_info['host'],
+                                                      opensearch_info['port'], opensearch_info['username'],
+                                                      opensearch_info['password'], opensearch_info['region'])
+    response = opensearch_client.msearch(body=msearch_body)
+
+    results = []
+    for sub_query, sub_response in zip(sub_queries, response['responses']):
+        if 'error' in sub_response:
+            logger.error(f"msearch sub-query {sub_query['search_type']} failed: {sub_response['error']}")
+            results.append([])
+            continue
+        score_threshold = sub_query.get('score_threshold', 0.7)
+        results.append([item for item in sub_response['hits']['hits'] if item["_score"] > score_threshold])
+    return results
+
+
+def build_knn_search_query(query_embedding, top_k, profile_name):
+    return {
         "size": top_k,  # Adjust the size as needed to retrieve more or fewer results
         "query": {
             "bool": {
@@ -258,6 +325,13 @@ def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch
         }
     }
 
+
+def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch_user, opensearch_password,
+                                     query_embedding, top_k=3, host='', port=443, profile_name=None):
+    opensearch_client = get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearch_password,
+                                                      region_name)
+    search_query = build_knn_search_query(query_embedding, top_k, profile_name)
+
     # Execute the search query
     response = opensearch_client.search(
         body=search_query,
@@ -362,19 +436,7 @@ def opensearch_index_init():
     :return:
     """
     try:
-        auth = (opensearch_info["username"], opensearch_info["password"])
-        host = opensearch_info["host"]
-        port = opensearch_info["port"]
-        # Create the client with SSL/TLS enabled, but hostname verification disabled.
-        opensearch_client = OpenSearch(
-            hosts=[{'host': host, 'port': port}],
-            http_compress=True,  # enables gzip compression for request bodies
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=False,
-            ssl_assert_hostname=False,
-            ssl_show_warn=False
-        )
+        opensearch_client = get_opensearch_client()
         index_list = [opensearch_info['sql_index'], opensearch_info['ner_index'], opensearch_info['agent_index']]
         dimension = opensearch_info['embedding_dimension']
         index_create_success = True
@@ -1,3 +1,8 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
 from utils.logging import getLogger
 from utils.prompt import POSTGRES_DIALECT_PROMPT_CLAUDE3, MYSQL_DIALECT_PROMPT_CLAUDE3, \
     DEFAULT_DIALECT_PROMPT, AGENT_COT_EXAMPLE, AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3, STARROCKS_DIALECT_PROMPT_CLAUDE3, \
@@ -2182,53 +2187,120 @@ table_prompt_mapper = table_prompt.TablePromptMapper()
 guidance_prompt_mapper = guidance_prompt.GuidancePromptMapper()
 
 
-def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None,
-                        dialect='mysql'):
+# compiled text2sql and agent prompts, keyed by profile version, tables, model and dialect
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv('PROMPT_CACHE_MAX_ENTRIES', 256))
+PROMPT_FIELD_MARKER = '\x00{}\x00'
+
+
+class CompiledTemplate:
+    """A prompt template whose static fields are rendered once, the per-question fields are spliced in by render"""
+
+    def __init__(self, template, static_values, dynamic_fields):
+        markers = {PROMPT_FIELD_MARKER.format(field): field for field in dynamic_fields}
+        rendered = template.format(**static_values, **{field: marker for marker, field in markers.items()})
+        if markers:
+            self.segments = re.split('(' + '|'.join(re.escape(marker) for marker in markers) + ')', rendered)
+        else:
+            self.segments = [rendered]
+        self.markers = markers
+        # rendered text up to the first per-question field, identical for every question
+        self.static_prefix = self.segments[0]
+
+    def render(self, **values) -> str:
+        return ''.join(str(values[self.markers[segment]]) if segment in self.markers else segment
+                       for segment in self.segments)
+
+
+class PromptCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compile(self, key, compile_prompt):
+        with self.lock:
+            compiled = self.entries.get(key)
+            if compiled is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        compiled = compile_prompt()
+        with self.lock:
+            self.entries[key] = compiled
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+prompt_cache = PromptCache(PROMPT_CACHE_MAX_ENTRIES)
+
+
+def get_compiled_prompt(prompt_type, ddl, model_name, dialect, profile_version, compile_prompt):
+    """
+    Memoize a compiled prompt by profile version, tables, model and dialect
+    :param profile_version: changes with every write of the profile, without it the prompt is compiled every time,
+    hashing the tables would cost more than rendering them
+    """
+    if not profile_version:
+        return compile_prompt()
+    return prompt_cache.get_or_compile((prompt_type, profile_version, tuple(ddl), model_name, dialect),
+                                       compile_prompt)
+
+
+def get_prompt_model_name(model_id):
+    name = support_model_ids_map.get(model_id, model_id)
+    if name.startswith("sagemaker."):
+        name = name[10:]
+    return name
+
+
+def build_schema_string(ddl, table_separator):
     long_string = ""
     for table_name, table_data in ddl.items():
         ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
         long_string += "{}: {}\n".format(table_name, table_data["tbl_a"] if 'tbl_a' in table_data else table_data[
             "description"])
         long_string += ddl_string
-        long_string += "\n \n"
+        long_string += table_separator
+    return long_string
 
-    # trying CREATE TABLE ddl
-    # long_string = generate_create_table_ddl(long_string)
-    ddl = long_string
 
-    logger.info(f'{dialect=}')
+def get_dialect_prompt(dialect):
     if dialect == 'postgresql':
-        dialect_prompt = POSTGRES_DIALECT_PROMPT_CLAUDE3
+        return POSTGRES_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'mysql':
-        dialect_prompt = MYSQL_DIALECT_PROMPT_CLAUDE3
+        return MYSQL_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'redshift':
-        dialect_prompt = AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3
+        return AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'starrocks':
-        dialect_prompt = STARROCKS_DIALECT_PROMPT_CLAUDE3
+        return STARROCKS_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'clickhouse':
-        dialect_prompt = CLICKHOUSE_DIALECT_PROMPT_CLAUDE3
+        return CLICKHOUSE_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'hive':
-        dialect_prompt = HIVE_DIALECT_PROMPT_CLAUDE3
+        return HIVE_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'bigquery':
-        dialect_prompt = BIGQUERY_DIALECT_PROMPT_CLAUDE3
+        return BIGQUERY_DIALECT_PROMPT_CLAUDE3
     else:
-        dialect_prompt = DEFAULT_DIALECT_PROMPT
+        return DEFAULT_DIALECT_PROMPT
 
-    example_sql_prompt = ""
-    example_ner_prompt = ""
-    if sql_examples:
-        for item in sql_examples:
-            example_sql_prompt += "Q: " + item['_source']['text'] + "\n"
-            example_sql_prompt += "A: ```sql\n" + item['_source']['sql'] + "```\n"
 
-    if ner_example:
-        for item in ner_example:
-            example_ner_prompt += "ner: " + item['_source']['entity'] + "\n"
-            example_ner_prompt += "ner info:" + item['_source']['comment'] + "\n"
+def compile_llm_prompt(ddl, prompt_map, name, dialect):
+    """Render the parts of the text2sql prompt that only depend on the profile, model and dialect"""
+    long_string = build_schema_string(ddl, "\n \n")
+
+    # trying CREATE TABLE ddl
+    # long_string = generate_create_table_ddl(long_string)
+
+    logger.info(f'{dialect=}')
+    dialect_prompt = get_dialect_prompt(dialect)
 
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
     system_prompt = prompt_map.get('text2sql', {}).get('system_prompt', {}).get(name)
     user_prompt = prompt_map.get('text2sql', {}).get('user_prompt', {}).get(name)
     if long_string == '':
@@ -2242,13 +2314,47 @@ def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, n
     else:
         system_prompt = system_prompt.format(dialect=dialect)
 
-    user_prompt = user_prompt.format(dialect_prompt=dialect_prompt, sql_schema=table_prompt,
-                                     sql_guidance=guidance_prompt, examples=example_sql_prompt,
-                                     ner_info=example_ner_prompt, question=search_box)
+    user_template = CompiledTemplate(user_prompt,
+                                     dict(dialect_prompt=dialect_prompt, sql_schema=table_prompt,
+                                          sql_guidance=guidance_prompt),
+                                     ['examples', 'ner_info', 'question'])
+    return system_prompt, user_template
 
+
+def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None,
+                        dialect='mysql', profile_version=None):
+    user_prompt, system_prompt, _ = generate_llm_prompt_parts(ddl, hints, prompt_map, search_box, sql_examples,
+                                                              ner_example, model_id, dialect, profile_version)
     return user_prompt, system_prompt
 
 
+def generate_llm_prompt_parts(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None,
+                              dialect='mysql', profile_version=None):
+    """
+    Same as generate_llm_prompt
+    :return: user prompt, system prompt, and the static start of the user prompt that can be cached by the model
+    """
+    example_sql_prompt = ""
+    example_ner_prompt = ""
+    if sql_examples:
+        for item in sql_examples:
+            example_sql_prompt += "Q: " + item['_source']['text'] + "\n"
+            example_sql_prompt += "A: ```sql\n" + item['_source']['sql'] + "```\n"
+
+    if ner_example:
+        for item in ner_example:
+            example_ner_prompt += "ner: " + item['_source']['entity'] + "\n"
+            example_ner_prompt += "ner info:" + item['_source']['comment'] + "\n"
+
+    name = get_prompt_model_name(model_id)
+    system_prompt, user_template = get_compiled_prompt('text2sql', ddl, name, dialect, profile_version,
+                                                       lambda: compile_llm_prompt(ddl, prompt_map, name, dialect))
+
+    user_prompt = user_template.render(examples=example_sql_prompt, ner_info=example_ner_prompt, question=search_box)
+
+    return user_prompt, system_prompt, user_template.static_prefix
+
+
 # TODO Must modify prompt
 def generate_sagemaker_intent_prompt(
         query: str,
@@ -2342,42 +2448,49 @@ def generate_sagemaker_explain_prompt(
     return prompt
 
 
-def generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id, agent_cot_example=None):
-    long_string = ""
-    for table_name, table_data in ddl.items():
-        ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
-        long_string += "{}: {}\n".format(table_name, table_data["tbl_a"] if 'tbl_a' in table_data else table_data[
-            "description"])
-        long_string += ddl_string
-        long_string += "\n"
+def compile_agent_cot_system_prompt(ddl, prompt_map, name):
+    ddl = build_schema_string(ddl, "\n")
 
     # trying CREATE TABLE ddl
     # long_string = generate_create_table_ddl(long_string)
-    ddl = long_string
 
+    # fetch system/user prompt from DynamoDB prompt map
+    system_prompt = prompt_map.get('agent', {}).get('system_prompt', {}).get(name)
+    user_prompt = prompt_map.get('agent', {}).get('user_prompt', {}).get(name)
+    return CompiledTemplate(system_prompt, dict(table_schema_data=ddl, sql_guidance=""), ['example_data']), user_prompt
+
+
+def generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id, agent_cot_example=None,
+                                     profile_version=None):
+    user_prompt, system_prompt, _ = generate_agent_cot_system_prompt_parts(ddl, prompt_map, search_box, model_id,
+                                                                           agent_cot_example, profile_version)
+    return user_prompt, system_prompt
+
+
+def generate_agent_cot_system_prompt_parts(ddl, prompt_map, search_box, model_id, agent_cot_example=None,
+                                           profile_version=None):
+    """
+    Same as generate_agent_cot_system_prompt
+    :return: user prompt, system prompt, and the static start of the system prompt that can be cached by the model
+    """
     agent_cot_example_str = ""
     if agent_cot_example:
         for item in agent_cot_example:
             agent_cot_example_str += "query: " + item['_source']['query'] + "\n"
             agent_cot_example_str += "train of thought:" + item['_source']['comment'] + "\n"
 
-    # fetch system/user prompt from DynamoDB prompt map
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    system_prompt = prompt_map.get('agent', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('agent', {}).get('user_prompt', {}).get(name)
+    name = get_prompt_model_name(model_id)
+    system_template, user_prompt = get_compiled_prompt('agent', ddl, name, '', profile_version,
+                                                       lambda: compile_agent_cot_system_prompt(ddl, prompt_map, name))
 
     # reformat prompts
     if agent_cot_example_str != "":
-        system_prompt = system_prompt.format(table_schema_data=ddl, sql_guidance="",
-                                             example_data=agent_cot_example_str)
+        system_prompt = system_template.render(example_data=agent_cot_example_str)
     else:
-        system_prompt = system_prompt.format(table_schema_data=ddl, sql_guidance="",
-                                             example_data=AGENT_COT_EXAMPLE)
+        system_prompt = system_template.render(example_data=AGENT_COT_EXAMPLE)
     user_prompt = user_prompt.format(question=search_box)
 
-    return user_prompt, system_prompt
+    return user_prompt, system_prompt, system_template.static_prefix
 
 
 def generate_intent_prompt(prompt_map, search_box, model_id):
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+import time
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# reflected table metadata is kept per connection and schema for up to the TTL, a schema whose fingerprint changed
+# is reflected again. The fingerprint is checked at most every check interval.
+SCHEMA_METADATA_CACHE_TTL = int(os.getenv('SCHEMA_METADATA_CACHE_TTL', 86400))
+SCHEMA_METADATA_CHECK_INTERVAL = int(os.getenv('SCHEMA_METADATA_CHECK_INTERVAL', 300))
+# schemas reflected in parallel
+SCHEMA_REFLECTION_CONCURRENCY = int(os.getenv('SCHEMA_REFLECTION_CONCURRENCY', 4))
+
+
+def get_schema_fingerprint(rows) -> str:
+    """Order independent digest of the rows describing the columns of a schema"""
+    digest = hashlib.sha256()
+    for row in sorted(tuple('' if value is None else str(value) for value in row) for row in rows):
+        digest.update('\x1f'.join(row).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+class SchemaMetadataEntry:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        # names of the tables and views of the schema, None until listed
+        self.table_names = None
+        # table name -> {'name', 'comment', 'columns': [{'name', 'type', 'comment'}]}
+        self.tables = {}
+        self.loaded_at = time.monotonic()
+        self.checked_at = self.loaded_at
+
+
+class SchemaMetadataCache:
+    """
+    Table lists and reflected table metadata keyed by (connection, schema). Tables are reflected on first use, so
+    a profile with a few tables of a large schema never reflects the whole schema.
+    """
+
+    def __init__(self, ttl, check_interval):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, conn_name, schema, get_fingerprint) -> SchemaMetadataEntry:
+        """
+        :param get_fingerprint: callable returning the current fingerprint of the schema, or None if the database
+        has no cheap change detection or the check failed, then only the TTL applies
+        """
+        key = (conn_name, schema)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and now - entry.loaded_at < self.ttl:
+            if now - entry.checked_at < self.check_interval:
+                return entry
+            fingerprint = get_fingerprint()
+            if fingerprint is None or fingerprint == entry.fingerprint:
+                entry.checked_at = now
+                return entry
+            logger.info(f'schema {schema} of connection {conn_name} changed, reflecting it again')
+        else:
+            fingerprint = get_fingerprint()
+        entry = SchemaMetadataEntry(fingerprint)
+        with self.lock:
+            self.entries[key] = entry
+        return entry
+
+    def get_table_names(self, conn_name, schema, get_fingerprint, list_tables) -> list:
+        """
+        :param list_tables: callable returning the table names of the schema
+        """
+        entry = self.get_entry(conn_name, schema, get_fingerprint)
+        if entry.table_names is None:
+            entry.table_names = list(list_tables())
+        return list(entry.table_names)
+
+    def get_tables(self, conn_name, schema, table_names, get_fingerprint, reflect_tables) -> dict:
+        """
+        :param table_names: tables of the schema, tables that do not exist are left out of the result
+        :param reflect_tables: callable reflecting a list of table names, returns the metadata by table name
+        :return: metadata by table name
+        """
+        entry = self.get_entry(conn_name, schema, get_fingerprint)
+        missing = [table_name for table_name in table_names if table_name not in entry.tables]
+        with self.lock:
+            self.hits += len(table_names) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            entry.tables.update(reflect_tables(missing))
+        return {table_name: entry.tables[table_name] for table_name in table_names if table_name in entry.tables}
+
+    def invalidate_connection(self, conn_name):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == conn_name]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "schemas": len(self.entries)
+            }
+
+
+schema_metadata_cache = None
+schema_metadata_cache_lock = threading.Lock()
+
+
+def get_schema_metadata_cache():
+    global schema_metadata_cache
+    if schema_metadata_cache is None:
+        with schema_metadata_cache_lock:
+            if schema_metadata_cache is None:
+                schema_metadata_cache = SchemaMetadataCache(SCHEMA_METADATA_CACHE_TTL, SCHEMA_METADATA_CHECK_INTERVAL)
+    return schema_metadata_cache
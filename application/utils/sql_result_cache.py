@@ -0,0 +1,149 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import sqlparse
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# default TTL in seconds of profiles without result_cache_ttl, 0 keeps the cache off unless a profile opts in
+SQL_RESULT_CACHE_TTL = int(os.getenv('SQL_RESULT_CACHE_TTL', 0))
+SQL_RESULT_CACHE_MAX_MB = float(os.getenv('SQL_RESULT_CACHE_MAX_MB', 256))
+
+
+def normalize_sql(sql) -> str:
+    """
+    Strip comments, redundant whitespace and the trailing semicolon. Case is kept, an identifier that happens to be a
+    keyword is case sensitive in some databases, e.g. a quoted "Date" column.
+    """
+    formatted_sql = sqlparse.format(sql, strip_comments=True, strip_whitespace=True)
+    return formatted_sql.strip().rstrip(';').strip()
+
+
+def get_result_cache_key(connection_key, sql) -> str:
+    raw_key = f"{connection_key}|{normalize_sql(sql)}"
+    return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+
+def dataframe_to_parquet(df) -> bytes:
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False, compression='zstd')
+    return buffer.getvalue()
+
+
+def parquet_to_dataframe(data: bytes):
+    import pandas as pd
+    return pd.read_parquet(io.BytesIO(data))
+
+
+class SqlResultCacheEntry:
+    def __init__(self, connection_key, data: bytes, expires_at):
+        self.connection_key = connection_key
+        self.data = data
+        self.expires_at = expires_at
+
+
+class SqlResultCache:
+    """
+    LRU cache of query results, keyed by connection and normalized SQL. The SQL is the final one after
+    row level security was applied, so users with different filters never share a result.
+    Results are stored as Parquet bytes, bounded by their total size.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, connection_key, sql):
+        key = get_result_cache_key(connection_key, sql)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            data = entry.data
+        return parquet_to_dataframe(data)
+
+    def put(self, connection_key, sql, df, ttl):
+        try:
+            data = dataframe_to_parquet(df)
+        except Exception as e:
+            # e.g. object columns with mixed types, the result is simply not cached
+            logger.warning(f"sql result not cached, parquet conversion failed: {e}")
+            return
+        if len(data) > self.max_bytes:
+            return
+        key = get_result_cache_key(connection_key, sql)
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = SqlResultCacheEntry(connection_key, data, time.time() + ttl)
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= len(entry.data)
+
+    def get_or_execute(self, connection_key, sql, ttl, execute):
+        """
+        Return the cached result of the sql, or call execute() and cache the DataFrame it returns
+        :param connection_key: connection name or db url the sql runs on
+        :param ttl: seconds to keep the result, 0 or None bypasses the cache
+        """
+        if not ttl or ttl <= 0:
+            return execute()
+        df = self.get(connection_key, sql)
+        if df is None:
+            df = execute()
+            self.put(connection_key, sql, df, ttl)
+        return df
+
+    def invalidate_connection(self, connection_key):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry.connection_key == connection_key]:
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.current_bytes
+            }
+
+
+sql_result_cache = None
+sql_result_cache_lock = threading.Lock()
+
+
+def get_sql_result_cache():
+    global sql_result_cache
+    if sql_result_cache is None:
+        with sql_result_cache_lock:
+            if sql_result_cache is None:
+                sql_result_cache = SqlResultCache(int(SQL_RESULT_CACHE_MAX_MB * 1024 * 1024))
+    return sql_result_cache
+
+
+def get_result_cache_ttl(profile) -> int:
+    ttl = profile.get('result_cache_ttl')
+    return SQL_RESULT_CACHE_TTL if ttl is None or ttl == '' else int(ttl)
@@ -0,0 +1,97 @@
+import json
+import os
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# stream every text2sql completion and start executing the SQL as soon as its block is closed, while the
+# explanation after it is still being generated
+SQL_OVERLAPPED_EXECUTION = os.getenv('SQL_OVERLAPPED_EXECUTION', 'false').lower() == 'true'
+
+SQL_BLOCK_MARKERS = [("<sql>", "</sql>"), ("```sql", "```")]
+
+
+class SqlStreamParser:
+    """
+    Incremental parser of a streamed text2sql response, detects the SQL block as soon as it is closed so the SQL can
+    be used before the explanation after it has finished streaming. Mirrors utils.tool.get_generated_sql.
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.text = ""
+        self.sql = None
+
+    def feed(self, text):
+        """
+        :return: the SQL if this piece closed the SQL block, otherwise None
+        """
+        self.pieces.append(text)
+        if self.sql is not None:
+            return None
+        self.text += text
+        for start_marker, end_marker in SQL_BLOCK_MARKERS:
+            start = self.text.find(start_marker)
+            if start < 0:
+                continue
+            end = self.text.find(end_marker, start + len(start_marker))
+            if end < 0:
+                return None
+            self.sql = self.text[start + len(start_marker):end]
+            return self.sql
+        return None
+
+    def get_text(self):
+        return "".join(self.pieces)
+
+
+def iter_bedrock_stream(response, usage):
+    """
+    Text deltas of an invoke_model_with_response_stream response of Claude 3, Llama 3 or Mixtral
+    :param usage: dict filled with the token usage reported by the stream
+    """
+    for event in response['body']:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        content = json.loads(chunk["bytes"].decode('utf8'))
+        content_type = content.get("type")
+        if content_type == "message_start":
+            usage.update(content.get("message", {}).get("usage", {}))
+        elif content_type == "content_block_delta":
+            yield content.get("delta", {}).get("text", "")
+        elif content_type == "message_delta":
+            usage.update(content.get("usage", {}))
+        elif "generation" in content:
+            yield content["generation"]
+        elif "outputs" in content:
+            yield "".join(output.get("text", "") for output in content["outputs"])
+
+
+def iter_sagemaker_stream(response):
+    """
+    Text of an invoke_endpoint_with_response_stream response. Server-sent event lines of text generation
+    endpoints ("data: {"token": {"text": ...}}") are unwrapped, other payloads are passed through as text.
+    """
+    buffer = ""
+    for event in response['Body']:
+        payload = event.get("PayloadPart", {}).get("Bytes", b"").decode('utf8')
+        if not payload.startswith("data:") and not buffer:
+            yield payload
+            continue
+        buffer += payload
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if not line.startswith("data:"):
+                continue
+            try:
+                content = json.loads(line[len("data:"):])
+            except ValueError:
+                logger.warning(f"unparseable stream event {line}")
+                continue
+            token = content.get("token") or {}
+            if not token.get("special"):
+                yield token.get("text", "")
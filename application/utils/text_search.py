@@ -1,24 +1,59 @@
 from nlq.business.connection import ConnectionManagement
+from nlq.business.schema_retrieval import prune_tables_info
+from utils.async_executor import get_model_semaphore, map_in_order
+from utils.bedrock_prompt_cache import add_token_info
 from utils.domain import SearchTextSqlResult
-from utils.llm import text_to_sql
+from utils.llm import text_to_sql, create_vector_embedding_batch, create_document_embedding_batch
 from utils.logging import getLogger
-from utils.opensearch import get_retrieve_opensearch
+from utils.opensearch import get_retrieve_opensearch, get_retrieve_opensearch_batch
 from utils.tool import get_generated_sql
 
 logger = getLogger()
 
 
 def entity_retrieve_search(entity_slot, opensearch_info, selected_profile):
+    if len(entity_slot) == 0:
+        return []
+    sub_queries = [{"query": each_entity, "search_type": "ner", "top_k": 1, "score_threshold": 0.7}
+                   for each_entity in entity_slot]
+    retrieve_results = get_retrieve_opensearch_batch(opensearch_info, sub_queries, selected_profile)
+    return dedupe_entity_retrieve(retrieve_results)
+
+
+def entity_qa_retrieve_search(entity_slot, search_box, opensearch_info, selected_profile):
+    """
+    Retrieve the entities of all slots and the QA samples of the question in one batched embedding call and a
+    single OpenSearch msearch round trip
+    :return: entity_slot_retrieve, qa_retrieve
+    """
+    sub_queries = [{"query": each_entity, "search_type": "ner", "top_k": 1, "score_threshold": 0.7}
+                   for each_entity in entity_slot]
+    sub_queries.append({"query": search_box, "search_type": "query", "top_k": 3, "score_threshold": 0.5})
+    retrieve_results = get_retrieve_opensearch_batch(opensearch_info, sub_queries, selected_profile)
+    return dedupe_entity_retrieve(retrieve_results[:-1]), retrieve_results[-1]
+
+
+def speculative_retrieve_search(search_box, opensearch_info, selected_profile):
+    """
+    Retrieve the QA samples and an entity guess for the whole question before its intent and slots are known.
+    The question is embedded once and searched in both the query and the ner index.
+    :return: entity_guess_retrieve, qa_retrieve
+    """
+    sub_queries = [{"query": search_box, "search_type": "ner", "top_k": 5, "score_threshold": 0.7},
+                   {"query": search_box, "search_type": "query", "top_k": 3, "score_threshold": 0.5}]
+    entity_guess_retrieve, qa_retrieve = get_retrieve_opensearch_batch(opensearch_info, sub_queries,
+                                                                       selected_profile)
+    return entity_guess_retrieve, qa_retrieve
+
+
+def dedupe_entity_retrieve(retrieve_results):
     entity_slot_retrieve = []
     entity_name_set = set()
-    for each_entity in entity_slot:
-        entity_retrieve = get_retrieve_opensearch(opensearch_info, each_entity, "ner",
-                                                  selected_profile, 1, 0.7)
-        if len(entity_retrieve) > 0:
-            for each_entity_retrieve in entity_retrieve:
-                if each_entity_retrieve['_source']['entity'] not in entity_name_set:
-                    entity_name_set.add(each_entity_retrieve['_source']['entity'])
-                    entity_slot_retrieve.append(each_entity_retrieve)
+    for entity_retrieve in retrieve_results:
+        for each_entity_retrieve in entity_retrieve:
+            if each_entity_retrieve['_source']['entity'] not in entity_name_set:
+                entity_name_set.add(each_entity_retrieve['_source']['entity'])
+                entity_slot_retrieve.append(each_entity_retrieve)
     return entity_slot_retrieve
 
 
@@ -78,29 +113,29 @@ def qa_retrieve_search(search_box, opensearch_info, selected_profile):
 
 def agent_text_search(search_box, model_type, database_profile, entity_slot, opensearch_info, selected_profile, use_rag,
                       agent_cot_task_result):
-    agent_search_results = []
-    default_agent_search_results = []
-    default_each_res_dict = {}
-    default_each_res_dict["query"] = search_box
-    default_each_res_dict["response"] = ""
-    default_each_res_dict["sql"] = "-1"
+    """
+    Generate the SQL of every agent sub-task, sub-tasks run in parallel up to AGENT_TASK_CONCURRENCY
+    :return: sub-task results with a SQL in the order of the task split, summed token_info
+    """
     token_info = {}
     token_info["input_tokens"] = 0
     token_info["output_tokens"] = 0
-    try:
-        for each_task in agent_cot_task_result:
-            each_res_dict = {}
-            each_task_query = agent_cot_task_result[each_task]
-            each_res_dict["query"] = each_task_query
-            entity_slot_retrieve = []
-            retrieve_result = []
-            if use_rag:
-                entity_slot_retrieve = get_retrieve_opensearch(opensearch_info, each_task_query, "ner",
-                                                               selected_profile, 3, 0.5)
-
-                retrieve_result = get_retrieve_opensearch(opensearch_info, each_task_query, "query",
-                                                          selected_profile, 3, 0.5)
-            each_task_response, model_response = text_to_sql(database_profile['tables_info'],
+
+    def generate_task_sql(each_task_query):
+        each_res_dict = {}
+        each_res_dict["query"] = each_task_query
+        entity_slot_retrieve = []
+        retrieve_result = []
+        if use_rag:
+            entity_slot_retrieve, retrieve_result = get_retrieve_opensearch_batch(
+                opensearch_info,
+                [{"query": each_task_query, "search_type": "ner", "top_k": 3, "score_threshold": 0.5},
+                 {"query": each_task_query, "search_type": "query", "top_k": 3, "score_threshold": 0.5}],
+                selected_profile)
+        tables_info = prune_tables_info(selected_profile, database_profile['tables_info'], each_task_query,
+                                        create_vector_embedding_batch, create_document_embedding_batch)
+        with get_model_semaphore(model_type):
+            each_task_response, model_response = text_to_sql(tables_info,
                                                              database_profile['hints'],
                                                              database_profile['prompt_map'],
                                                              each_task_query,
@@ -108,19 +143,20 @@ def agent_text_search(search_box, model_type, database_profile, entity_slot, ope
                                                              sql_examples=retrieve_result,
                                                              ner_example=entity_slot_retrieve,
                                                              dialect=database_profile['db_type'],
-                                                             model_provider=None)
-            if model_response.token_info is not None and len(model_response.token_info) > 0:
-                sub_token_info = model_response.token_info
-                if "input_tokens" in sub_token_info:
-                    token_info["input_tokens"] = token_info["input_tokens"] + sub_token_info["input_tokens"]
-                if "output_tokens" in sub_token_info:
-                    token_info["output_tokens"] = token_info["output_tokens"] + sub_token_info["output_tokens"]
-            each_task_sql = get_generated_sql(each_task_response)
-            each_res_dict["response"] = each_task_response
-            each_res_dict["sql"] = each_task_sql
-            if each_res_dict["sql"] != "":
-                agent_search_results.append(each_res_dict)
-        return agent_search_results, token_info
-    except Exception as e:
-        logger.error(e)
-    return default_agent_search_results, token_info
+                                                             model_provider=None,
+                                                             profile_version=database_profile.get('profile_version'))
+        each_res_dict["response"] = each_task_response
+        each_res_dict["sql"] = get_generated_sql(each_task_response)
+        return each_res_dict, model_response.token_info
+
+    agent_search_results = []
+    task_queries = [agent_cot_task_result[each_task] for each_task in agent_cot_task_result]
+    for (task_result, error), task_query in zip(map_in_order(generate_task_sql, task_queries), task_queries):
+        if error is not None:
+            logger.error(f"agent sub-task {task_query} failed: {error}")
+            continue
+        each_res_dict, sub_token_info = task_result
+        add_token_info(token_info, sub_token_info)
+        if each_res_dict["sql"] != "":
+            agent_search_results.append(each_res_dict)
+    return agent_search_results, token_info